@@ -0,0 +1,255 @@
+"""
+Admission control for the LLM-backed endpoints.
+
+Two layers keep a burst from queueing up behind slow upstream calls:
+
+- ``RateLimiter``: a token bucket per client (``RATE_LIMIT_PER_MINUTE``
+  sustained, ``RATE_LIMIT_BURST`` at once), checked before a request does any
+  work. A request may cost more than one token (``/ask/batch`` costs one per
+  question).
+- ``AdmissionGate``: a global cap of ``LLM_MAX_INFLIGHT`` upstream calls per
+  worker. Callers wait in a priority queue, so interactive ``/ask`` traffic is
+  served before quiz generation, and background pool refills come last;
+  ``LLM_INTERACTIVE_RESERVE`` slots are kept for interactive calls only. When
+  ``LLM_MAX_QUEUE`` callers are already waiting, or a caller has waited
+  ``LLM_QUEUE_TIMEOUT`` seconds, the call is shed with ``Overloaded``.
+
+Both surface as ``429 Too Many Requests`` with a ``Retry-After`` header, so
+clients back off quickly instead of timing out slowly. The priority of the
+current request is carried in the ``request_priority`` context variable.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from metrics import ADMISSION_REJECTED
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))  # 0 disables per-client limits
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+# Reverse proxies in front of the app (e.g. 1 on Render). Each appends the address it saw to
+# X-Forwarded-For, so the client is the entry that many places from the right; anything further
+# left was sent by the client and cannot be trusted. 0 uses the socket peer address.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "0"))
+
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+LLM_INTERACTIVE_RESERVE = int(os.getenv("LLM_INTERACTIVE_RESERVE", "2"))
+
+# Lower value = served first
+INTERACTIVE = 0
+STANDARD = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", STANDARD: "standard", BACKGROUND: "background"}
+
+request_priority: contextvars.ContextVar = contextvars.ContextVar("request_priority", default=STANDARD)
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; `retry_after` is a hint in whole seconds."""
+
+    def __init__(self, message: str, retry_after: int = 1, reason: str = "overloaded"):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float, cost: float = 1.0) -> float:
+        """
+        Take `cost` tokens; returns 0 if admitted, else the seconds until they are available.
+
+        A cost above the capacity is admitted once the bucket is full and leaves it
+        in debt, so the client waits for the whole cost before its next request.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Per-client token buckets; the least recently seen clients are forgotten first."""
+
+    def __init__(self, per_minute: float = RATE_LIMIT_PER_MINUTE, burst: int = RATE_LIMIT_BURST,
+                 max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self.limited = 0
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def check(self, client: str, cost: float = 1.0) -> float:
+        """0 if `client` may proceed with a request costing `cost` tokens, else the seconds to wait before retrying."""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            wait = bucket.take(now, cost)
+        if wait:
+            self.limited += 1
+            ADMISSION_REJECTED.inc(reason="rate_limit")
+        return wait
+
+    def stats(self) -> Dict:
+        return {"per_minute": self.rate * 60.0, "burst": self.burst, "clients": len(self._buckets),
+                "limited": self.limited}
+
+
+class Slot:
+    """One admitted upstream call; `release` is idempotent."""
+
+    def __init__(self, gate: "AdmissionGate"):
+        self.gate = gate
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.gate._release(time.monotonic() - self.started)
+
+
+class AdmissionGate:
+    """Priority-ordered cap on concurrent upstream calls that sheds load instead of queueing forever."""
+
+    def __init__(self, limit: int = LLM_MAX_INFLIGHT, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT, interactive_reserve: int = LLM_INTERACTIVE_RESERVE):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.interactive_reserve = min(interactive_reserve, max(limit - 1, 0))
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.mean_hold = 1.0  # moving average of seconds per call, for Retry-After hints
+        self._waiters: List[list] = []  # heap of [priority, sequence, future]
+        self._sequence = itertools.count()
+
+    def _capacity(self, priority: int) -> int:
+        return self.limit if priority == INTERACTIVE else self.limit - self.interactive_reserve
+
+    def _first_waiter(self) -> Optional[list]:
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)  # timed out or cancelled
+        return self._waiters[0] if self._waiters else None
+
+    def has_capacity(self, priority: int = INTERACTIVE) -> bool:
+        """True if a call at `priority` would be admitted right away."""
+        return self.in_flight < self._capacity(priority) and self._first_waiter() is None
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.mean_hold * (self.queue_depth() + 1) / max(self.limit, 1)))
+
+    async def acquire(self, priority: Optional[int] = None) -> Slot:
+        """Wait for a slot (served by priority, then arrival); raises Overloaded when shed."""
+        priority = request_priority.get() if priority is None else priority
+        first = self._first_waiter()
+        if self.in_flight < self._capacity(priority) and (first is None or first[0] > priority):
+            self.in_flight += 1
+            self.admitted += 1
+            return Slot(self)
+
+        if self.queue_depth() >= self.max_queue:
+            self.shed += 1
+            ADMISSION_REJECTED.inc(reason="queue_full")
+            raise Overloaded("Server is busy, please retry shortly", self.retry_after(), "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, [priority, next(self._sequence), future])
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(0.0)  # handed a slot just as we were cancelled
+            raise
+        except asyncio.TimeoutError:
+            # A slot handed over just as the timeout fired is still ours to use
+            if not future.done() or future.cancelled():
+                future.cancel()
+                self.timed_out += 1
+                ADMISSION_REJECTED.inc(reason="queue_timeout")
+                raise Overloaded("Server is busy, please retry shortly", self.retry_after(), "queue_timeout")
+        self.admitted += 1
+        return Slot(self)
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[int] = None):
+        held = await self.acquire(priority)
+        try:
+            yield held
+        finally:
+            held.release()
+
+    def _release(self, held_seconds: float):
+        self.in_flight -= 1
+        if held_seconds:
+            self.mean_hold = 0.9 * self.mean_hold + 0.1 * held_seconds
+        while True:
+            first = self._first_waiter()
+            if first is None or self.in_flight >= self._capacity(first[0]):
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            first[2].set_result(None)
+
+    def stats(self) -> Dict:
+        waiting: Dict[str, int] = {}
+        for priority, _, future in self._waiters:
+            if not future.done():
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                waiting[name] = waiting.get(name, 0) + 1
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": waiting,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "mean_call_seconds": round(self.mean_hold, 3)
+        }
+
+
+def client_id(headers, client_host: Optional[str], trusted_proxies: int = RATE_LIMIT_TRUSTED_PROXIES) -> str:
+    """Identify the caller for rate limiting: the address seen by the outermost trusted proxy."""
+    if trusted_proxies > 0:
+        forwarded = [entry.strip() for entry in headers.get("x-forwarded-for", "").split(",") if entry.strip()]
+        if len(forwarded) >= trusted_proxies:
+            return forwarded[-trusted_proxies]
+    return client_host or "unknown"
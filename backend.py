@@ -1,25 +1,76 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from typing import List, Dict
-from sentence_transformers import SentenceTransformer, util
-import json, os, requests, re, uuid, time
-from requests.exceptions import RequestException
+from typing import List, Dict, Optional
+import asyncio, hashlib, hmac, json, logging, math, os, re, uuid, time, weakref
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+from admission import BACKGROUND, INTERACTIVE, STANDARD, AdmissionGate, Overloaded, RateLimiter, client_id, request_priority
+from embedding_backends import create_embedding_backend
+from hedging import BudgetExhausted, hedged
+from kb_index import INDEX_DIR, KnowledgeBaseIndex, load_or_build_index
+from ingest import embedding_text, source_signature
+from llm_client import LLMClient, LLMError
+from logging_config import configure_logging, request_id_var
+from metrics import ASK_ANSWERS, CACHE_LOOKUPS, REQUEST_LATENCY, registry, stage_timer
+from llm_json import parse_quiz_questions, parse_suggestions, stream_quiz_questions
+from retrieval import BM25Index, create_retriever, reciprocal_rank_fusion
+from context_builder import assemble_context, extractive_answer
+from caches import SemanticCache, SingleFlight, TTLCache
+from quiz_pool import QuizPool
+from suggestion_index import SuggestionIndex, load_or_build_suggestion_index, load_suggestion_index
+from question_history import QuestionHistory
+from session_store import SessionStore, create_session_store
+from embedding_service import BatchingEncoder
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Queued, level-gated logging (LOG_LEVEL, LOG_FORMAT=text|json); see logging_config.py
+configure_logging()
+logger = logging.getLogger("backend")
+
 # OpenRouter API configuration
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 if not OPENROUTER_API_KEY:
-    print("WARNING: OPENROUTER_API_KEY environment variable not set")
+    logger.warning("OPENROUTER_API_KEY environment variable not set")
     
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
-OPENROUTER_MODEL = "openrouter/zephyr-7b-beta"
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+# Comma-separated; the first model serves every call, the others receive hedged /ask requests in turn
+OPENROUTER_MODELS = [m.strip() for m in os.getenv("OPENROUTER_MODELS", "openrouter/zephyr-7b-beta").split(",") if m.strip()]
+OPENROUTER_MODEL = OPENROUTER_MODELS[0]
+
+# Shared keep-alive connection pool for all upstream LLM calls
+llm_client = LLMClient(api_url=OPENROUTER_API_URL, api_key=OPENROUTER_API_KEY)
+
+# 🚦 Admission control (see admission.py): per-client token buckets on the LLM-backed endpoints,
+# and a priority-ordered cap on in-flight upstream calls that sheds excess load with 429
+rate_limiter = RateLimiter()
+llm_gate = AdmissionGate()
+LLM_ENDPOINT_PRIORITIES = {
+    "/ask": INTERACTIVE,
+    "/ask/stream": INTERACTIVE,
+    "/ask/batch": STANDARD,
+    "/suggest": STANDARD,
+    "/quiz": STANDARD,
+    "/quiz/stream": STANDARD,
+    "/quiz/evaluate": STANDARD,
+}
+
+def require_llm_api_key():
+    """Raise HTTPException if the OpenRouter API key is missing."""
+    if not OPENROUTER_API_KEY:
+        logger.error("OpenRouter API key is not configured")
+        raise HTTPException(
+            status_code=500, 
+            detail="OpenRouter API key not configured. Please set OPENROUTER_API_KEY environment variable."
+        )
 
-def get_llm_response(messages: List[Dict[str, str]], max_tokens: int = 2000, temperature: float = 0.7) -> str:
+async def get_llm_response(messages: List[Dict[str, str]], max_tokens: int = 2000, temperature: float = 0.7,
+                           model: Optional[str] = None) -> str:
     """
     Send a request to OpenRouter API and return the assistant's response.
     
@@ -27,6 +78,7 @@ def get_llm_response(messages: List[Dict[str, str]], max_tokens: int = 2000, tem
         messages: List of message dictionaries with 'role' and 'content' keys
         max_tokens: Maximum number of tokens to generate
         temperature: Sampling temperature (0.0 to 2.0)
+        model: Model to use instead of OPENROUTER_MODEL
     
     Returns:
         str: The assistant's response content
@@ -35,101 +87,69 @@ def get_llm_response(messages: List[Dict[str, str]], max_tokens: int = 2000, tem
         HTTPException: If API key is missing or API request fails
     """
     # Check if API key is configured
-    if not OPENROUTER_API_KEY:
-        print("[ERROR] OpenRouter API key is not configured")
-        raise HTTPException(
-            status_code=500, 
-            detail="OpenRouter API key not configured. Please set OPENROUTER_API_KEY environment variable."
-        )
+    require_llm_api_key()
+    model = model or OPENROUTER_MODEL
     
-    # Prepare headers
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Log the request for debugging
+    logger.debug("Sending request to OpenRouter API: model=%s messages=%d max_tokens=%d temperature=%s",
+                 model, len(messages), max_tokens, temperature)
     
-    # Prepare request payload
-    payload = {
-        "model": OPENROUTER_MODEL,
-        "messages": messages,
-        "max_tokens": max_tokens,
-        "temperature": temperature
-    }
+    # Waits for an upstream slot by request priority; raises Overloaded (429) when shed
+    async with llm_gate.slot():
+        try:
+            with stage_timer("llm"):
+                content = await llm_client.chat(messages, model, max_tokens=max_tokens, temperature=temperature)
+        except LLMError as e:
+            logger.error("OpenRouter request failed: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
+        except Exception as e:
+            error_msg = f"Unexpected error calling OpenRouter API: {str(e)}"
+            logger.exception("Unexpected error calling OpenRouter API")
+            raise HTTPException(status_code=500, detail=error_msg)
     
-    # Log the request for debugging
-    print(f"[DEBUG] Sending request to OpenRouter API:")
-    print(f"[DEBUG] Model: {OPENROUTER_MODEL}")
-    print(f"[DEBUG] Messages count: {len(messages)}")
-    print(f"[DEBUG] Max tokens: {max_tokens}, Temperature: {temperature}")
+    # Log successful response
+    logger.debug("Received response from OpenRouter API (%d characters)", len(content))
     
-    try:
-        # Send request to OpenRouter API
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        
-        # Log response status
-        print(f"[DEBUG] OpenRouter API response status: {response.status_code}")
-        
-        # Check if request was successful
-        if response.status_code != 200:
-            error_detail = f"OpenRouter API error: {response.status_code}"
-            try:
-                error_data = response.json()
-                if "error" in error_data:
-                    error_detail += f" - {error_data['error'].get('message', 'Unknown error')}"
-            except:
-                error_detail += f" - {response.text[:200]}"
-            
-            print(f"[ERROR] {error_detail}")
-            raise HTTPException(status_code=500, detail=error_detail)
-        
-        # Parse response
-        result = response.json()
-        
-        # Extract content from response
-        choices = result.get("choices", [])
-        if not choices:
-            print("[ERROR] No choices in OpenRouter API response")
-            raise HTTPException(status_code=500, detail="OpenRouter API returned no response choices")
-        
-        message = choices[0].get("message", {})
-        content = message.get("content", "")
-        
-        if not content:
-            print("[ERROR] Empty content in OpenRouter API response")
-            raise HTTPException(status_code=500, detail="OpenRouter API returned empty response")
-        
-        # Log successful response
-        print(f"[DEBUG] Successfully received response from OpenRouter API ({len(content)} characters)")
-        
-        return content
-        
-    except requests.exceptions.ConnectionError as e:
-        error_msg = "Cannot connect to OpenRouter API. Please check your internet connection."
-        print(f"[ERROR] Connection error: {e}")
-        raise HTTPException(status_code=500, detail=error_msg)
-        
-    except requests.exceptions.Timeout as e:
-        error_msg = "OpenRouter API request timed out. Please try again."
-        print(f"[ERROR] Timeout error: {e}")
-        raise HTTPException(status_code=500, detail=error_msg)
-        
-    except requests.exceptions.RequestException as e:
-        error_msg = f"OpenRouter API request failed: {str(e)}"
-        print(f"[ERROR] Request error: {e}")
-        raise HTTPException(status_code=500, detail=error_msg)
-        
-    except json.JSONDecodeError as e:
-        error_msg = "Failed to parse OpenRouter API response"
-        print(f"[ERROR] JSON decode error: {e}")
-        raise HTTPException(status_code=500, detail=error_msg)
-        
-    except Exception as e:
-        error_msg = f"Unexpected error calling OpenRouter API: {str(e)}"
-        print(f"[ERROR] Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail=error_msg)
+    return content
+
+def question_id(question: str) -> str:
+    """Stable ID for a quiz question, derived from its normalized text."""
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()[:12]
+
+class QuizSession:
+    """A stored quiz plus hash indexes for O(1) answer lookup during evaluation."""
+
+    def __init__(self, questions: List[Dict]):
+        self.questions = questions
+        self._encoded: Optional[str] = None
+        self.by_id: Dict[str, Dict] = {}
+        self.by_question: Dict[str, Dict] = {}
+        for q in questions:
+            q.setdefault("id", question_id(q["question"]))
+            self.by_id[q["id"]] = q
+            self.by_question[normalize_question(q["question"])] = q
+
+    def __len__(self):
+        return len(self.questions)
 
-# Store quizzes in memory
-active_quizzes: Dict[str, List[Dict]] = {}
+    def dumps(self) -> str:
+        # Encoded once; cached quizzes reuse the same session object
+        if self._encoded is None:
+            self._encoded = json.dumps(self.questions)
+        return self._encoded
+
+    @classmethod
+    def loads(cls, raw: str) -> "QuizSession":
+        return cls(json.loads(raw))
+
+    def find(self, question: str, qid: Optional[str] = None) -> Optional[Dict]:
+        """Look up a stored question by ID, falling back to its normalized text."""
+        if qid and qid in self.by_id:
+            return self.by_id[qid]
+        return self.by_question.get(normalize_question(question))
+
+# Store quizzes in a bounded, expiring session store (memory or shared SQLite)
+active_quizzes: SessionStore = create_session_store(encode=QuizSession.dumps, decode=QuizSession.loads)
 
 class QuizAnswer(BaseModel):
     question: str
@@ -140,19 +160,95 @@ class QuizEvaluateRequest(BaseModel):
 
 class AskRequest(BaseModel):
     question: str
+    mode: Optional[str] = None  # "semantic", "lexical" or "hybrid" (default: RETRIEVAL_MODE)
+
+class AskBatchRequest(BaseModel):
+    questions: List[str]
+    mode: Optional[str] = None
+    stream: bool = False  # NDJSON, one line per question as it completes
 
 class SuggestRequest(BaseModel):
     question: str
+    mode: Optional[str] = None  # "index", "refine" or "llm"; defaults to SUGGEST_MODE
 
 class UserResponse(BaseModel):
     question: str
     answer: str
+    question_id: Optional[str] = None
 
 class QuizEvalRequest(BaseModel):
     session_id: str
     responses: List[UserResponse]
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watcher = asyncio.create_task(watch_knowledge_base()) if KB_WATCH_INTERVAL > 0 else None
+    preload = asyncio.create_task(preload_embedding_model()) if EMBEDDING_PRELOAD and not embedding_model.loaded else None
+    # Builds the suggestion index in the background if it was not prebuilt; /suggest falls back until then
+    suggestions = asyncio.create_task(prepare_suggestion_index(knowledge)) if SUGGEST_MODE != "llm" else None
+    if OPENROUTER_API_KEY:
+        quiz_pool.warm()
+    yield
+    if watcher:
+        watcher.cancel()
+    await quiz_pool.aclose()
+    await embedding_service.aclose()
+    await llm_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+def too_many_requests(detail: str, retry_after: int) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=429, headers={"Retry-After": str(retry_after)})
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    logger.warning("Shed %s %s (%s)", request.method, request.url.path, exc.reason)
+    return too_many_requests(str(exc), exc.retry_after)
+
+@app.middleware("http")
+async def admission_middleware(request: Request, call_next):
+    """Rate-limit LLM-backed endpoints per client and tag the request with its upstream priority."""
+    priority = LLM_ENDPOINT_PRIORITIES.get(request.url.path)
+    if priority is None:
+        return await call_next(request)
+    client = client_id(request.headers, request.client.host if request.client else None)
+    wait = rate_limiter.check(client)
+    if wait:
+        return too_many_requests("Rate limit exceeded, please slow down", math.ceil(wait))
+    request.state.client_id = client
+    token = request_priority.set(priority)
+    try:
+        return await call_next(request)
+    finally:
+        request_priority.reset(token)
+
+async def preload_embedding_model():
+    try:
+        await run_in_threadpool(embedding_model.load)
+    except Exception:
+        logger.exception("Embedding model preload failed; it will be retried on first use")
+
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """
+    Tag every log record of a request with its X-Request-ID (generated if the
+    client sent none) and record the request latency per endpoint.
+    """
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        request_id_var.reset(token)
+        # Label by route template (e.g. /quiz/history/{topic}) to keep label cardinality bounded
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - start, method=request.method,
+                                endpoint=getattr(route, "path", "unmatched"), status=status)
+    response.headers["X-Request-ID"] = request_id
+    return response
 
 # Serve static files (CSS, JS, images) - only in production
 if os.getenv("RENDER"):  # Render sets this environment variable
@@ -174,247 +270,709 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-embedding_model = SentenceTransformer("paraphrase-MiniLM-L3-v2")
+# Embedding model (EMBEDDING_BACKEND=torch|onnx); nothing is loaded until the first encode,
+# and with EMBEDDING_PRELOAD=1 the lifespan loads it in the background so /health answers right away
+embedding_model = create_embedding_backend()
+EMBEDDING_PRELOAD = os.getenv("EMBEDDING_PRELOAD", "1") == "1"
 
-kb_path = os.path.join("data", "nursing_guide_cleaned.txt")
-with open(kb_path, 'r', encoding='utf-8') as file:
-    knowledge_base = file.read()
+class KnowledgeBase:
+    """
+    Immutable snapshot of the KB index and its retriever.
 
-def chunk_text(text, chunk_size=300, overlap=50):
-    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size - overlap)]
+    Handlers grab the current snapshot once per request, so a hot reload can
+    swap in a new one without disturbing in-flight /ask requests.
+    """
 
-chunks = chunk_text(knowledge_base)
-embeddings = embedding_model.encode(chunks)
+    def __init__(self, index: KnowledgeBaseIndex):
+        self.index = index
+        self.key = index.key
+        self.records = index.records
+        self.chunks = index.chunks
+        self.retriever = create_retriever(index.embeddings, index_path=index.path)
+        self.lexical = BM25Index([embedding_text(record) for record in index.records])
 
-@app.post("/ask")
-def ask_question(request: AskRequest):
-    question_embedding = embedding_model.encode([request.question])
-    
-    # Use semantic_search instead of FAISS
-    hits = util.semantic_search(question_embedding, embeddings, top_k=5)
-    
-    # Extract the most relevant chunks
-    relevant_chunks = []
-    for hit in hits[0]:  # hits[0] contains the results for the first query
-        corpus_id = hit['corpus_id']
-        relevant_chunks.append(chunks[corpus_id])
-    
-    context = "\n".join(relevant_chunks)
+    def hits(self, raw_hits: List[Dict]) -> List[Dict]:
+        """Attach chunk text and provenance (document, section, character span) to retriever hits."""
+        hits = []
+        for hit in raw_hits:
+            record = self.records[hit["corpus_id"]]
+            hits.append(dict(hit, text=self.chunks[hit["corpus_id"]], doc=record["doc"],
+                             section=record["section"], start=record["start"], end=record["end"]))
+        return hits
+
+def build_knowledge_base(previous: Optional[KnowledgeBase] = None) -> KnowledgeBase:
+    """Chunk the KB sources and load (or incrementally build) the matching index."""
+    index = load_or_build_index(lambda: embedding_model, previous=previous.index if previous else None,
+                                variant=embedding_model.variant)
+    return KnowledgeBase(index)
+
+# Load the prebuilt, memory-mapped KB index (see kb_index.py); only new or
+# changed chunks are re-embedded here when the KB sources changed since the last build.
+knowledge = build_knowledge_base()
+
+# 🔄 Hot reload: POST /admin/reload, or poll the KB sources every KB_WATCH_INTERVAL seconds
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+kb_reload_lock = asyncio.Lock()
+
+async def reload_knowledge_base() -> KnowledgeBase:
+    """Rebuild the KB off the event loop and atomically swap it in."""
+    global knowledge
+    async with kb_reload_lock:
+        previous = knowledge
+        updated = await run_in_threadpool(build_knowledge_base, previous)
+        knowledge = updated
+    if updated.key != previous.key:
+        logger.info("Knowledge base reloaded: %s -> %s (%d chunks)", previous.key, updated.key, len(updated.records))
+        if SUGGEST_MODE != "llm":
+            await prepare_suggestion_index(updated)
+    return updated
+
+async def watch_knowledge_base():
+    signature = source_signature()
+    while True:
+        await asyncio.sleep(KB_WATCH_INTERVAL)
+        try:
+            current = await run_in_threadpool(source_signature)
+            if current != signature:
+                await reload_knowledge_base()
+                signature = current
+        except Exception as e:
+            logger.exception("Knowledge base reload failed: %s", e)
+
+# Concurrent query encodes are micro-batched into one forward pass
+embedding_service = BatchingEncoder(embedding_model.encode)
+
+async def embed_question(question: str):
+    return await embed_questions([question])
 
+async def embed_questions(questions: List[str]):
+    """Embed several questions in one (micro-batched) forward pass."""
+    with stage_timer("embed"):
+        return await embedding_service.encode(questions)
+
+# 🔀 Retrieval mode: "semantic" (embeddings), "lexical" (BM25) or "hybrid" (both, fused by reciprocal rank)
+RETRIEVAL_MODES = ("semantic", "lexical", "hybrid")
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+# How many candidates each ranking contributes to the fusion, per requested hit
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))
+
+def retrieval_mode(mode: Optional[str]) -> str:
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
+    return mode
+
+async def retrieve_context(question: str, top_k: int = 5, question_embedding=None,
+                           kb: Optional[KnowledgeBase] = None, mode: Optional[str] = None) -> List[Dict]:
+    """
+    Return the top-k knowledge base hits ({corpus_id, score, text, doc, section}) for a question.
+
+    In hybrid mode the semantic and BM25 rankings are fused with reciprocal rank
+    fusion, so `score` is the fused score rather than a cosine similarity.
+    """
+    return (await retrieve_contexts([question], top_k, question_embedding, kb, mode))[0]
+
+async def retrieve_contexts(questions: List[str], top_k: int = 5, question_embeddings=None,
+                            kb: Optional[KnowledgeBase] = None, mode: Optional[str] = None) -> List[List[Dict]]:
+    """Top-k hits for each of several questions, with one semantic search over all of them."""
+    kb = kb or knowledge
+    mode = retrieval_mode(mode)
+    if mode != "lexical" and question_embeddings is None:
+        question_embeddings = await embed_questions(questions)
+
+    with stage_timer("retrieve"):
+        if mode == "lexical":
+            raw_hits = [kb.lexical.search(question, top_k=top_k) for question in questions]
+        elif mode == "semantic":
+            # Nearest-neighbour search over the memory-mapped index (exact, IVF or HNSW), one row per question
+            raw_hits = kb.retriever.search(question_embeddings, top_k=top_k)
+        else:
+            candidates = top_k * HYBRID_CANDIDATES
+            semantic_hits = kb.retriever.search(question_embeddings, top_k=candidates)
+            raw_hits = [
+                reciprocal_rank_fusion([semantic, kb.lexical.search(question, top_k=candidates)], top_k=top_k)
+                for question, semantic in zip(questions, semantic_hits)
+            ]
+        return [kb.hits(hits) for hits in raw_hits]
+
+def build_ask_messages(question: str, context: str) -> List[Dict[str, str]]:
     prompt = (
         f"You are a concise and helpful nursing assistant. "
         f"Based only on the context below, give a brief answer in 1-2 sentences. Avoid long explanations.\n\n"
         f"Context:\n{context}\n\n"
-        f"Question:\n{request.question}"
+        f"Question:\n{question}"
     )
 
-    messages = [
+    return [
         {"role": "system", "content": "You are a helpful medical assistant."},
         {"role": "user", "content": prompt}
     ]
 
-    answer = get_llm_response(messages)
-    return {"response": answer}
+# 🔁 Semantic answer cache: near-duplicate questions reuse a previous answer
+answer_cache = SemanticCache(
+    maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "86400")),  # seconds = 1 day
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93")),
+    name="answers"
+)
 
-def extract_json_from_text(text: str):
-    try:
-        text = text.encode().decode('unicode_escape').replace('\n', '').replace('\\', '')
-        match = re.search(r'\[\s*\{.*?\}\s*\]', text, re.DOTALL)
-        if not match:
-            raise ValueError("No valid JSON array found.")
-        raw_list = json.loads(match.group(0))
-
-        converted = []
-        for item in raw_list:
-            options = [item[k] for k in ['option1', 'option2', 'option3', 'option4'] if k in item]
-            answer = item.get("answer", "").strip()
-
-            # ✅ Normalize answer to match one of the options
-            matched_answer = next((opt for opt in options if normalize(opt) == normalize(answer)), None)
-
-            if not matched_answer:
-                # 🔁 If no matching option, fallback to first option or mark as invalid
-                matched_answer = options[0] if options else ""
-
-            converted.append({
-                "question": item.get("question", "").strip(),
-                "options": options,
-                "answer": matched_answer
-            })
+# 🤝 Single-flight: concurrent identical /ask, /quiz and /suggest requests share one upstream call
+ask_flights = SingleFlight("ask")
+quiz_flights = SingleFlight("quiz")
+suggest_flights = SingleFlight("suggest")
 
-        return converted
-    except Exception as e:
-        raise ValueError(f"Quiz parse failed: {e}")
+# ⌛ /ask latency budget (see hedging.py): after ASK_HEDGE_AFTER seconds without an answer a hedged
+# duplicate goes out (to the next of OPENROUTER_MODELS, if any); once ASK_LATENCY_BUDGET seconds from the
+# start of the request are spent, or every attempt failed, the answer is extracted from the retrieved passages
+ASK_LATENCY_BUDGET = float(os.getenv("ASK_LATENCY_BUDGET", "10"))  # 0 disables the budget and hedging
+ASK_HEDGE_AFTER = float(os.getenv("ASK_HEDGE_AFTER", "3"))
+ASK_MAX_HEDGES = int(os.getenv("ASK_MAX_HEDGES", "1"))
+# Attempts still running at the deadline finish in the background and cache their answer for the next asker
+ASK_CACHE_LATE_ANSWERS = os.getenv("ASK_CACHE_LATE_ANSWERS", "1") == "1"
+EXTRACTIVE_EMPTY = "I couldn't find this in the nursing guide right now. Please try again shortly."
+late_answers = set()  # background tasks caching answers that missed the deadline
+
+@app.post("/ask")
+async def ask_question(request: AskRequest):
+    kb = knowledge
+    deadline = time.monotonic() + ASK_LATENCY_BUDGET if ASK_LATENCY_BUDGET > 0 else None
+    mode = retrieval_mode(request.mode)
 
-def normalize(s):
-    return re.sub(r'\W+', '', s).lower()
+    # Cached answers are scoped to the KB index they came from (see SemanticCache); only
+    # answers built with the default retrieval mode are cached, so only that mode needs the
+    # embedding up front (other modes embed during retrieval if they search semantically)
+    use_cache = mode == RETRIEVAL_MODE
+    question_embedding = await embed_question(request.question) if use_cache else None
+    cached_answer = answer_cache.get(question_embedding, namespace=kb.key) if use_cache else None
+    if cached_answer is not None:
+        return {"response": cached_answer, "cached": True, "answered_by": "cache"}
 
+    # Identical questions arriving together share one retrieval + LLM call
+    key = (kb.key, mode, normalize_question(request.question))
 
+    async def answer():
+        hits = await retrieve_context(request.question, question_embedding=question_embedding, kb=kb, mode=mode)
+        return await answer_from_hits(request.question, hits, question_embedding, kb, use_cache, deadline)
+
+    return dict(await ask_flights.run(key, answer))
+
+async def answer_from_hits(question: str, hits: List[Dict], question_embedding, kb: KnowledgeBase,
+                           use_cache: bool, deadline: Optional[float] = None) -> Dict:
+    """
+    Build the prompt context from retrieved hits, ask the LLM and cache the answer.
+
+    With a `deadline` (time.monotonic()) the LLM call is hedged, and the answer
+    is extracted from the hits if no attempt succeeds in time.
+    """
+    # Merge overlapping chunks, drop near-duplicates and fit the context into the token budget
+    with stage_timer("context"):
+        context = assemble_context(hits)
+    logger.debug("/ask context: %d passages from %d hits, %d tokens (%d saved)",
+                 len(context["passages"]), len(hits), context["tokens"], context["tokens_saved"])
+    messages = build_ask_messages(question, context["text"])
+    usage = {"context_tokens": context["tokens"], "context_tokens_saved": context["tokens_saved"]}
+
+    if deadline is None:
+        response, answered_by, model = await get_llm_response(messages), "llm", OPENROUTER_MODEL
+    else:
+        require_llm_api_key()
+        try:
+            # Hedges are only sent while the upstream has spare admission slots, so they never add to a queue
+            response, attempt, model = await hedged(
+                lambda model: get_llm_response(messages, model=model), OPENROUTER_MODELS,
+                hedge_after=ASK_HEDGE_AFTER, max_hedges=ASK_MAX_HEDGES,
+                budget=max(deadline - time.monotonic(), 0.001), may_hedge=llm_gate.has_capacity
+            )
+            answered_by = "hedge" if attempt else "llm"
+        except Overloaded:
+            raise
+        except BudgetExhausted as e:
+            logger.warning("/ask LLM budget of %.1fs exhausted, answering extractively", ASK_LATENCY_BUDGET)
+            if use_cache and ASK_CACHE_LATE_ANSWERS:
+                cache_late_answer(e.pending, question_embedding, kb)
+            else:
+                for task in e.pending:
+                    task.cancel()
+            return dict(extractive_response(question, hits, "budget"), **usage)
+        except Exception as e:
+            logger.warning("Every /ask LLM attempt failed, answering extractively: %s", e)
+            return dict(extractive_response(question, hits, "error"), **usage)
+
+    ASK_ANSWERS.inc(path=answered_by)
+    if use_cache:
+        answer_cache.set(question_embedding, response, namespace=kb.key)
+    return dict({"response": response, "answered_by": answered_by, "model": model}, **usage)
+
+def extractive_response(question: str, hits: List[Dict], reason: str) -> Dict:
+    """LLM-free answer from the retrieved passages; never cached, so the next asker gets a real answer."""
+    ASK_ANSWERS.inc(path="extractive")
+    with stage_timer("extract"):
+        response = extractive_answer(question, hits) or EXTRACTIVE_EMPTY
+    return {"response": response, "answered_by": "extractive", "fallback_reason": reason}
+
+def cache_late_answer(pending: List[asyncio.Task], question_embedding, kb: KnowledgeBase):
+    """Cache the first of `pending` LLM attempts to succeed after the deadline; cancel the rest."""
+    async def first_success():
+        try:
+            for attempt in asyncio.as_completed(pending):
+                try:
+                    answer_cache.set(question_embedding, await attempt, namespace=kb.key)
+                    return
+                except Exception:
+                    continue
+        finally:
+            for task in pending:
+                task.cancel()
+
+    task = asyncio.create_task(first_success())
+    late_answers.add(task)
+    task.add_done_callback(late_answers.discard)
+
+# 📦 Batch /ask: one encode and one search for all questions, bounded LLM fan-out
+ASK_BATCH_MAX_QUESTIONS = int(os.getenv("ASK_BATCH_MAX_QUESTIONS", "100"))
+ASK_BATCH_CONCURRENCY = int(os.getenv("ASK_BATCH_CONCURRENCY", "8"))
+
+@app.post("/ask/batch")
+async def ask_questions_batch(request: AskBatchRequest, http_request: Request):
+    """
+    Answer several questions at once.
+
+    Identical questions (after normalization) are answered once. All questions
+    are embedded in one forward pass and searched in one matrix-wide query;
+    at most ASK_BATCH_CONCURRENCY LLM calls run at a time. Returns
+    {"results": [...]} in request order, or with `"stream": true` an NDJSON
+    stream of results (each with its `index`) in completion order.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given")
+    if len(request.questions) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {ASK_BATCH_MAX_QUESTIONS} questions per batch")
+    # The middleware charged one token for the request; a batch costs one per question
+    if len(request.questions) > 1:
+        wait = rate_limiter.check(http_request.state.client_id, cost=len(request.questions) - 1)
+        if wait:
+            return too_many_requests("Rate limit exceeded, please slow down", math.ceil(wait))
+    kb = knowledge
+    mode = retrieval_mode(request.mode)
+    use_cache = mode == RETRIEVAL_MODE
+
+    # De-duplicate: positions[u] lists the request indexes asking unique question u
+    unique: List[str] = []
+    positions: List[List[int]] = []
+    seen: Dict[str, int] = {}
+    for index, question in enumerate(request.questions):
+        normalized = normalize_question(question)
+        if normalized not in seen:
+            seen[normalized] = len(unique)
+            unique.append(question)
+            positions.append([])
+        positions[seen[normalized]].append(index)
+
+    # Lexical retrieval outside the cached default mode never uses the embeddings
+    embeddings = await embed_questions(unique) if use_cache or mode != "lexical" else None
+    answers: Dict[int, Dict] = {}
+    if use_cache:
+        for u in range(len(unique)):
+            cached_answer = answer_cache.get(embeddings[u], namespace=kb.key)
+            if cached_answer is not None:
+                answers[u] = {"response": cached_answer, "cached": True}
+    misses = [u for u in range(len(unique)) if u not in answers]
+    hits_by_question: Dict[int, List[Dict]] = {}
+    if misses:
+        require_llm_api_key()
+        hits = await retrieve_contexts([unique[u] for u in misses],
+                                       question_embeddings=embeddings[misses] if embeddings is not None else None,
+                                       kb=kb, mode=mode)
+        hits_by_question = dict(zip(misses, hits))
+    semaphore = asyncio.Semaphore(ASK_BATCH_CONCURRENCY)
+
+    async def answer(u: int):
+        question = unique[u]
+        async with semaphore:
+            try:
+                # Shares in-flight work with identical single /ask requests
+                result = await ask_flights.run(
+                    (kb.key, mode, normalize_question(question)),
+                    lambda: answer_from_hits(question, hits_by_question[u],
+                                             embeddings[u:u + 1] if embeddings is not None else None, kb, use_cache))
+                return u, dict(result)
+            except HTTPException as e:
+                return u, {"error": e.detail}
+            except Overloaded as e:
+                return u, {"error": str(e), "retry_after": e.retry_after}
+
+    def entries(u: int, result: Dict) -> List[Dict]:
+        return [dict(result, index=index, question=request.questions[index]) for index in positions[u]]
+
+    if not request.stream:
+        answers.update(await asyncio.gather(*(answer(u) for u in misses)))
+        results = sorted((entry for u in range(len(unique)) for entry in entries(u, answers[u])),
+                         key=lambda entry: entry["index"])
+        return {"results": results, "unique_questions": len(unique), "cached": len(unique) - len(misses)}
+
+    async def lines():
+        for u, result in answers.items():
+            for entry in entries(u, result):
+                yield json.dumps(entry) + "\n"
+        tasks = [asyncio.create_task(answer(u)) for u in misses]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                u, result = await finished
+                for entry in entries(u, result):
+                    yield json.dumps(entry) + "\n"
+        finally:
+            # Client went away: stop the LLM calls that are still pending
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def sse_event(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def holding_slot(slot, stream):
+    """
+    Pass `stream` through, releasing the admission slot (if any) when it ends or the client goes away.
+
+    The release is also tied to the wrapper's lifetime: if the response is dropped
+    before its body is first iterated (client gone, response start failed), the
+    generator's `finally` never runs, but the finalizer does. `Slot.release` is idempotent.
+    """
+    async def relay():
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+            if slot is not None:
+                slot.release()
+
+    body = relay()
+    if slot is not None:
+        weakref.finalize(body, slot.release)
+    return body
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: AskRequest, http_request: Request):
+    """
+    Streaming variant of /ask using Server-Sent Events.
+
+    Emits a `context` event with the retrieved chunks first, then one `token`
+    event per LLM delta, and finally `done` (or `error`). If the client goes
+    away the upstream stream is closed so no further tokens are generated.
+    """
+    require_llm_api_key()
+    hits = await retrieve_context(request.question, mode=request.mode)
+    with stage_timer("context"):
+        context = assemble_context(hits)
+    messages = build_ask_messages(request.question, context["text"])
+    # Admitted (or shed with 429) before the stream starts; held until it ends
+    slot = await llm_gate.acquire()
+
+    async def events():
+        yield sse_event("context", {
+            "chunks": [
+                {"id": hit["corpus_id"], "score": round(hit["score"], 4), "doc": hit["doc"],
+                 "section": hit["section"], "preview": hit["text"][:120]}
+                for hit in hits
+            ],
+            "tokens": context["tokens"],
+            "tokens_saved": context["tokens_saved"]
+        })
+        tokens = llm_client.stream_chat(messages, OPENROUTER_MODEL)
+        try:
+            async for token in tokens:
+                if await http_request.is_disconnected():
+                    logger.debug("/ask/stream client disconnected, cancelling upstream stream")
+                    break
+                yield sse_event("token", {"text": token})
+            else:
+                yield sse_event("done", {})
+        except LLMError as e:
+            logger.error("OpenRouter stream failed: %s", e)
+            yield sse_event("error", {"detail": str(e)})
+        finally:
+            # Closes the upstream HTTP response even when we are cancelled mid-stream
+            await tokens.aclose()
+
+    return StreamingResponse(
+        holding_slot(slot, events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # 🔁 Simple quiz cache - now supports topic-specific caching
 quiz_cache = {}
 
-# 📝 Track previously generated questions to avoid repetition
-question_history: Dict[str, List[str]] = {}
+# 📝 Track previously generated questions (and their embeddings) to avoid repetition and rephrasings
+question_history = QuestionHistory()
+
+def build_quiz_prompt(topic: str, n: int) -> str:
+    """Default quiz prompt for `topic`, asking the model not to repeat recent questions."""
+    if topic and topic.lower() != "general":
+        # Get previously asked questions for this topic to avoid repetition
+        previous_questions = question_history.get(topic, [])
+        
+        prompt = (
+            f"Generate exactly {n} unique multiple-choice nursing questions STRICTLY about '{topic}'. "
+            f"Focus ONLY on {topic} - do not include general nursing questions or questions from other topics. "
+            "Return ONLY a JSON array in this exact format:\n"
+            "[\n"
+            '  {"question": "What is...", "option1": "A", "option2": "B", "option3": "C", "option4": "D", "answer": "A"}\n'
+            "]\n"
+            f"STRICT REQUIREMENTS:\n"
+            f"- ALL questions must be specifically about {topic} nursing care, procedures, assessment, or management\n"
+            f"- Each question must have exactly 4 distinct, non-overlapping answer options (option1-option4)\n"
+            f"- Each question must have exactly ONE clearly correct answer that matches one of the 4 options\n"
+            f"- NO contradictory answers - avoid options that could both be considered correct\n"
+            f"- NO vague, ambiguous, or overly similar answer choices\n"
+            f"- AVOID 'all of the above', 'none of the above', or true/false formats\n"
+            f"- Use phrases like 'best approach', 'most appropriate', or 'priority action' if needed for clarity\n"
+            f"- Make questions practical and clinically relevant to {topic}\n"
+            f"- Focus on application, critical thinking, and clinical decision-making\n"
+            f"- Questions should test knowledge specific to {topic}, not general nursing principles\n"
+            f"- Each answer option should be clearly distinct and not overlap with others\n"
+            f"- Ensure the correct answer is definitively the BEST choice among the 4 options\n"
+            f"- Base correct answers on current evidence-based nursing practice and clinical guidelines\n"
+            f"- Make incorrect options plausible but clearly wrong to experienced nurses\n"
+        )
+        
+        # Add instruction to avoid previously asked questions if any exist
+        if previous_questions:
+            recent_questions = previous_questions[-10:]  # Show last 10 to avoid very long prompts
+            prompt += (
+                f"\nIMPORTANT: Do NOT repeat or rephrase any of these previously asked questions:\n"
+                + "\n".join([f"- {q}" for q in recent_questions])
+                + "\n\nGenerate completely NEW and DIFFERENT questions about the same topic.\n"
+            )
+    else:
+        # Enhanced general nursing prompt
+        previous_questions = question_history.get("General", [])
+        
+        prompt = (
+            f"Generate exactly {n} diverse nursing multiple-choice questions covering different areas of general nursing practice. "
+            "Return ONLY a JSON array in this exact format:\n"
+            "[\n"
+            '  {"question": "What is...", "option1": "A", "option2": "B", "option3": "C", "option4": "D", "answer": "A"}\n'
+            "]\n"
+            f"STRICT REQUIREMENTS:\n"
+            f"- Cover diverse nursing topics (medication admin, patient safety, assessment, etc.)\n"
+            f"- Each question must have exactly 4 distinct, non-overlapping answer options (option1-option4)\n"
+            f"- Each question must have exactly ONE clearly correct answer that matches one of the 4 options\n"
+            f"- NO contradictory answers - avoid options that could both be considered correct\n"
+            f"- NO vague, ambiguous, or overly similar answer choices\n"
+            f"- AVOID 'all of the above', 'none of the above', or true/false formats\n"
+            f"- Use phrases like 'best approach', 'most appropriate', or 'priority action' if needed for clarity\n"
+            f"- Make questions practical and clinically relevant to nursing practice\n"
+            f"- Focus on application, critical thinking, and clinical decision-making\n"
+            f"- Each answer option should be clearly distinct and not overlap with others\n"
+            f"- Ensure the correct answer is definitively the BEST choice among the 4 options\n"
+            f"- Test real-world nursing scenarios and evidence-based practice\n"
+            f"- Base correct answers on current evidence-based nursing practice and clinical guidelines\n"
+            f"- Make incorrect options plausible but clearly wrong to experienced nurses\n"
+        )
+        
+        # Add instruction to avoid previously asked questions if any exist
+        if previous_questions:
+            recent_questions = previous_questions[-8:]  # Show fewer for general to keep prompt manageable
+            prompt += (
+                f"\nIMPORTANT: Do NOT repeat any of these previously asked questions:\n"
+                + "\n".join([f"- {q}" for q in recent_questions])
+                + "\n\nGenerate completely NEW and DIFFERENT questions.\n"
+            )
+
+    return prompt
+
+async def generate_unique_questions(prompt: str, topic: str, n: int):
+    """
+    Generate quiz questions that are not in the topic's history, retrying once
+    with a stronger uniqueness instruction if fewer than half of `n` survive.
+
+    Returns (number of questions parsed, unique questions). The unique
+    questions (possibly more than `n`) are added to the history and get IDs.
+    """
+    response = await generate_with_model(prompt)
+    with stage_timer("quiz_parse"):
+        parsed = parse_quiz_questions(response)
+    if not parsed:
+        return 0, []
+
+    # Filter out exact and near-duplicate questions (recorded in the history as they are accepted)
+    unique_questions = await filter_unique_questions(parsed, topic)
+
+    # If we filtered out too many questions, try to generate more
+    if len(unique_questions) < max(1, n // 2):  # If we have less than half the requested questions
+        logger.info("Only %d unique questions generated, retrying", len(unique_questions))
+        # Try once more with a stronger uniqueness instruction
+        enhanced_prompt = prompt + f"\n\nCRITICAL: Generate {n} COMPLETELY UNIQUE questions. No repeats or variations of common nursing questions."
+        response = await generate_with_model(enhanced_prompt)
+        with stage_timer("quiz_parse"):
+            parsed_retry = parse_quiz_questions(response)
+
+        if parsed_retry:
+            unique_questions += await filter_unique_questions(parsed_retry, topic, limit=n - len(unique_questions))
+
+    for q in unique_questions:
+        q.setdefault("id", question_id(q["question"]))
+    return len(parsed), unique_questions
+
+async def produce_pool_questions(topic: str, n: int) -> List[Dict]:
+    """Quiz pool producer: a batch of fresh questions for `topic` using the default prompt."""
+    # Refills run as their own tasks; they only get upstream slots that interactive traffic leaves free
+    request_priority.set(BACKGROUND)
+    _, questions = await generate_unique_questions(build_quiz_prompt(topic, n), topic, n)
+    return questions
+
+# 🧺 Pre-generated questions per popular topic, topped up in the background
+quiz_pool = QuizPool(produce_pool_questions)
+MAX_QUIZ_QUESTIONS = int(os.getenv("MAX_QUIZ_QUESTIONS", "50"))
 
 @app.get("/quiz")
-def generate_quiz(n: int = 10, prompt: str = "", topic: str = "General", session_id: str = None):
+async def generate_quiz(n: int = Query(10, ge=1, le=MAX_QUIZ_QUESTIONS), prompt: str = "", topic: str = "General", session_id: str = None):
     now = time.time()
 
+    # Use provided session_id or generate new one
+    if not session_id:
+        session_id = str(uuid.uuid4())
+
+    # ✅ Step 1: Draw a fresh mix of questions from the pre-generated pool
+    if not prompt:
+        pooled = quiz_pool.draw(topic, n)
+        if pooled:
+            await active_quizzes.aset(session_id, QuizSession(pooled))
+            logger.debug("Served quiz for session %s from the '%s' pool", session_id, topic)
+            return {"quiz": pooled, "session_id": session_id}
+
     # Create cache key that includes topic to cache topic-specific quizzes
     cache_key = f"{topic}_{n}"
     
-    # ✅ Step 1: Use cache if recent (topic-specific)
+    # ✅ Step 2: Use cache if recent (topic-specific)
     if quiz_cache.get(cache_key) and quiz_cache[cache_key]["data"] and (now - quiz_cache[cache_key]["timestamp"] < quiz_cache[cache_key]["ttl"]):
-        # Use provided session_id or generate new one
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        active_quizzes[session_id] = quiz_cache[cache_key]["data"]
+        CACHE_LOOKUPS.inc(cache="quiz", result="hit")
+        await active_quizzes.aset(session_id, quiz_cache[cache_key]["session"])
         return {"quiz": quiz_cache[cache_key]["data"], "session_id": session_id}
+    CACHE_LOOKUPS.inc(cache="quiz", result="miss")
 
-    # ✅ Step 2: Set default prompt before try block (this avoids unreachable warning)
-    if not prompt:
-        if topic and topic.lower() != "general":
-            # Get previously asked questions for this topic to avoid repetition
-            previous_questions = question_history.get(topic, [])
-            
-            prompt = (
-                f"Generate exactly {n} unique multiple-choice nursing questions STRICTLY about '{topic}'. "
-                f"Focus ONLY on {topic} - do not include general nursing questions or questions from other topics. "
-                "Return ONLY a JSON array in this exact format:\n"
-                "[\n"
-                '  {"question": "What is...", "option1": "A", "option2": "B", "option3": "C", "option4": "D", "answer": "A"}\n'
-                "]\n"
-                f"STRICT REQUIREMENTS:\n"
-                f"- ALL questions must be specifically about {topic} nursing care, procedures, assessment, or management\n"
-                f"- Each question must have exactly 4 distinct, non-overlapping answer options (option1-option4)\n"
-                f"- Each question must have exactly ONE clearly correct answer that matches one of the 4 options\n"
-                f"- NO contradictory answers - avoid options that could both be considered correct\n"
-                f"- NO vague, ambiguous, or overly similar answer choices\n"
-                f"- AVOID 'all of the above', 'none of the above', or true/false formats\n"
-                f"- Use phrases like 'best approach', 'most appropriate', or 'priority action' if needed for clarity\n"
-                f"- Make questions practical and clinically relevant to {topic}\n"
-                f"- Focus on application, critical thinking, and clinical decision-making\n"
-                f"- Questions should test knowledge specific to {topic}, not general nursing principles\n"
-                f"- Each answer option should be clearly distinct and not overlap with others\n"
-                f"- Ensure the correct answer is definitively the BEST choice among the 4 options\n"
-                f"- Base correct answers on current evidence-based nursing practice and clinical guidelines\n"
-                f"- Make incorrect options plausible but clearly wrong to experienced nurses\n"
-            )
-            
-            # Add instruction to avoid previously asked questions if any exist
-            if previous_questions:
-                recent_questions = previous_questions[-10:]  # Show last 10 to avoid very long prompts
-                prompt += (
-                    f"\nIMPORTANT: Do NOT repeat or rephrase any of these previously asked questions:\n"
-                    + "\n".join([f"- {q}" for q in recent_questions])
-                    + "\n\nGenerate completely NEW and DIFFERENT questions about the same topic.\n"
-                )
-        else:
-            # Enhanced general nursing prompt
-            previous_questions = question_history.get("General", [])
-            
-            prompt = (
-                f"Generate exactly {n} diverse nursing multiple-choice questions covering different areas of general nursing practice. "
-                "Return ONLY a JSON array in this exact format:\n"
-                "[\n"
-                '  {"question": "What is...", "option1": "A", "option2": "B", "option3": "C", "option4": "D", "answer": "A"}\n'
-                "]\n"
-                f"STRICT REQUIREMENTS:\n"
-                f"- Cover diverse nursing topics (medication admin, patient safety, assessment, etc.)\n"
-                f"- Each question must have exactly 4 distinct, non-overlapping answer options (option1-option4)\n"
-                f"- Each question must have exactly ONE clearly correct answer that matches one of the 4 options\n"
-                f"- NO contradictory answers - avoid options that could both be considered correct\n"
-                f"- NO vague, ambiguous, or overly similar answer choices\n"
-                f"- AVOID 'all of the above', 'none of the above', or true/false formats\n"
-                f"- Use phrases like 'best approach', 'most appropriate', or 'priority action' if needed for clarity\n"
-                f"- Make questions practical and clinically relevant to nursing practice\n"
-                f"- Focus on application, critical thinking, and clinical decision-making\n"
-                f"- Each answer option should be clearly distinct and not overlap with others\n"
-                f"- Ensure the correct answer is definitively the BEST choice among the 4 options\n"
-                f"- Test real-world nursing scenarios and evidence-based practice\n"
-                f"- Base correct answers on current evidence-based nursing practice and clinical guidelines\n"
-                f"- Make incorrect options plausible but clearly wrong to experienced nurses\n"
-            )
-            
-            # Add instruction to avoid previously asked questions if any exist
-            if previous_questions:
-                recent_questions = previous_questions[-8:]  # Show fewer for general to keep prompt manageable
-                prompt += (
-                    f"\nIMPORTANT: Do NOT repeat any of these previously asked questions:\n"
-                    + "\n".join([f"- {q}" for q in recent_questions])
-                    + "\n\nGenerate completely NEW and DIFFERENT questions.\n"
-                )
-
-    # ✅ Step 3: Try generating quiz
+    # ✅ Step 3: Generate, coalescing concurrent misses for the same topic/size/prompt
+    result = await quiz_flights.run((cache_key, prompt), lambda: generate_quiz_session(topic, n, prompt, cache_key))
+    if "error" in result:
+        return result
+
+    # Store the quiz data
+    await active_quizzes.aset(session_id, result["session"])
+    logger.debug("Generated quiz for session %s (topic: %s)", session_id, topic)
+    return {"quiz": result["data"], "session_id": session_id}
+
+async def generate_quiz_session(topic: str, n: int, prompt: str, cache_key: str) -> Dict:
+    """Generate, index and cache a quiz; returns {"data", "session"} or {"error"}."""
+    now = time.time()
+
+    # Set default prompt before try block (this avoids unreachable warning)
+    default_prompt = not prompt
+    if default_prompt:
+        prompt = build_quiz_prompt(topic, n)
+
+    # ✅ Step 4: Try generating quiz
     try:
-        response = generate_with_model(prompt)
-        parsed = extract_json_from_text(response)
+        parsed_count, unique_questions = await generate_unique_questions(prompt, topic, n)
 
-        if not parsed or len(parsed) == 0:
+        if parsed_count == 0:
             return {"error": "No valid quiz questions were generated. Please check OpenRouter API connection."}
 
-        # Filter out any duplicate questions
-        unique_questions = []
-        for q in parsed:
-            if isinstance(q, dict) and 'question' in q:
-                if is_question_unique(q['question'], topic):
-                    unique_questions.append(q)
-                else:
-                    print(f"[DEBUG] Filtered out duplicate question: {q['question'][:50]}...")
-        
-        # If we filtered out too many questions, try to generate more
-        if len(unique_questions) < max(1, n // 2):  # If we have less than half the requested questions
-            print(f"[DEBUG] Only {len(unique_questions)} unique questions generated, retrying...")
-            # Try once more with a stronger uniqueness instruction
-            enhanced_prompt = prompt + f"\n\nCRITICAL: Generate {n} COMPLETELY UNIQUE questions. No repeats or variations of common nursing questions."
-            response = generate_with_model(enhanced_prompt)
-            parsed_retry = extract_json_from_text(response)
-            
-            if parsed_retry:
-                for q in parsed_retry:
-                    if isinstance(q, dict) and 'question' in q and is_question_unique(q['question'], topic):
-                        unique_questions.append(q)
-                        if len(unique_questions) >= n:
-                            break
-        
-        final_questions = unique_questions[:n] if len(unique_questions) >= n else unique_questions
+        final_questions = unique_questions[:n]
         
         if len(final_questions) == 0:
             return {"error": "Unable to generate unique quiz questions. Please try a different topic."}
 
-        # Add the generated questions to history
-        add_questions_to_history(final_questions, topic)
+        # Surplus questions from the default prompt top up the pool
+        if default_prompt and unique_questions[n:]:
+            quiz_pool.add(topic, unique_questions[n:])
+
+        # Index the questions once; cached sessions share the same read-only index
+        quiz_session = QuizSession(final_questions)
 
         # Cache the result with topic-specific key
         quiz_cache[cache_key] = {
             "data": final_questions,
+            "session": quiz_session,
             "timestamp": now,
             "ttl": 300  # seconds = 5 minutes
         }
 
-        # Use provided session_id or generate new one
-        if not session_id:
-            session_id = str(uuid.uuid4())
-        
-        # Store the quiz data
-        active_quizzes[session_id] = final_questions
-        
-        print(f"[DEBUG] Generated quiz for session {session_id} (topic: {topic})")
-        print(f"[DEBUG] Number of questions stored: {len(final_questions)}")
-        print(f"[DEBUG] Questions generated from {len(parsed)} total, {len(unique_questions)} unique, {len(final_questions)} final")
-        for i, q in enumerate(final_questions):
-            print(f"[DEBUG] Q{i+1}: {q.get('question', 'NO QUESTION')[:50]}...")
-            print(f"[DEBUG] Answer: {q.get('answer', 'NO ANSWER')}")
+        logger.info("Generated quiz for topic '%s': %d parsed, %d unique, %d used",
+                    topic, parsed_count, len(unique_questions), len(final_questions))
         
-        return {"quiz": final_questions, "session_id": session_id}
+        return {"data": final_questions, "session": quiz_session}
 
-    except requests.exceptions.ConnectionError:
-        return {"error": "Cannot connect to OpenRouter API. Please check your internet connection and API key."}
+    except Overloaded:
+        raise
     except Exception as e:
         return {"error": f"Failed to generate quiz: {str(e)}"}
 
-def generate_with_model(query: str):
+@app.get("/quiz/stream")
+async def generate_quiz_stream(http_request: Request, n: int = Query(10, ge=1, le=MAX_QUIZ_QUESTIONS), topic: str = "General", session_id: str = None):
+    """
+    Streaming variant of /quiz using Server-Sent Events.
+
+    Emits a `session` event with the session id, then one `question` event per
+    new question as soon as the model has finished writing it, and finally
+    `done` (or `error`). The session is stored before `done` is sent.
+    """
+    require_llm_api_key()
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    questions = quiz_pool.draw(topic, n) or []
+    # Generating needs an upstream slot: admitted (or shed with 429) before the stream starts
+    slot = await llm_gate.acquire() if not questions else None
+
+    async def events():
+        yield sse_event("session", {"session_id": session_id})
+        for q in questions:
+            yield sse_event("question", q)
+
+        if slot is not None:
+            messages = [
+                {"role": "system", "content": "You are a helpful medical assistant."},
+                {"role": "user", "content": build_quiz_prompt(topic, n)}
+            ]
+            tokens = llm_client.stream_chat(messages, OPENROUTER_MODEL, max_tokens=2000, temperature=0.7)
+            parsed = stream_quiz_questions(tokens)
+            try:
+                async for q in parsed:
+                    if await http_request.is_disconnected():
+                        logger.debug("/quiz/stream client disconnected, cancelling upstream stream")
+                        return
+                    if not await filter_unique_questions([q], topic):
+                        continue
+                    q["id"] = question_id(q["question"])
+                    questions.append(q)
+                    yield sse_event("question", q)
+                    if len(questions) >= n:
+                        break
+            except LLMError as e:
+                logger.error("OpenRouter stream failed: %s", e)
+                yield sse_event("error", {"detail": str(e)})
+                return
+            finally:
+                # Closes the upstream HTTP response even when we are cancelled mid-stream
+                await parsed.aclose()
+                await tokens.aclose()
+
+        if not questions:
+            yield sse_event("error", {"detail": "No valid quiz questions were generated. Please try a different topic."})
+            return
+        await active_quizzes.aset(session_id, QuizSession(questions))
+        logger.debug("Streamed quiz for session %s (topic: %s, %d questions)", session_id, topic, len(questions))
+        yield sse_event("done", {"session_id": session_id, "count": len(questions)})
+
+    return StreamingResponse(
+        holding_slot(slot, events()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def generate_with_model(query: str):
     """
     Generate a response using the OpenRouter API.
     This is a legacy wrapper around get_llm_response for backwards compatibility.
@@ -424,7 +982,7 @@ def generate_with_model(query: str):
         {"role": "user", "content": query}
     ]
     
-    return get_llm_response(messages, max_tokens=2000, temperature=0.7)
+    return await get_llm_response(messages, max_tokens=2000, temperature=0.7)
 
 def normalize(text):
     return text.strip().lower().lstrip('abcd. ').strip()
@@ -433,18 +991,153 @@ def normalize_question(question):
     """Normalize question text for consistent matching"""
     return question.strip().lower().replace('\n', ' ').replace('\r', ' ').replace('  ', ' ').strip()
 
+# ⏱️ Wrong-answer explanations, generated after the scores are returned: concurrency cap and
+# deadline per evaluation. The deadline scales with the calls needed (EXPLANATION_CALL_SECONDS
+# per round of EXPLANATION_CONCURRENCY calls), capped at EXPLANATION_DEADLINE
+EXPLANATION_CONCURRENCY = int(os.getenv("EXPLANATION_CONCURRENCY", "4"))
+EXPLANATION_DEADLINE = float(os.getenv("EXPLANATION_DEADLINE", "8"))
+EXPLANATION_CALL_SECONDS = float(os.getenv("EXPLANATION_CALL_SECONDS", "4"))
+# Ask for all explanations in one structured prompt instead of one call each
+EXPLANATION_BATCH = os.getenv("EXPLANATION_BATCH", "false").lower() == "true"
+EXPLANATION_PLACEHOLDER = "Explanation unavailable."
+
+# 🔁 Cache explanations for repeated mistakes on the same (shared) quiz questions
+explanation_cache = TTLCache(
+    maxsize=int(os.getenv("EXPLANATION_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("EXPLANATION_CACHE_TTL", "604800")),  # seconds = 7 days
+    persist_path=os.getenv("EXPLANATION_CACHE_PATH") or None,
+    name="explanations"
+)
+
+def explanation_cache_key(question: str, user_answer: str, correct_answer: str) -> str:
+    return "\x1f".join([normalize_question(question), normalize(user_answer), normalize(correct_answer)])
+
+def trim_explanation(text: str) -> str:
+    """Keep at most the first two sentences of an explanation."""
+    return ". ".join(text.split(". ")[:2]).strip().rstrip(".") + "."
+
+async def explain_wrong_answer(question: str, user_answer: str, correct_answer: str) -> str:
+    prompt = (
+        f"The user answered the following nursing quiz question incorrectly:\n\n"
+        f"Question: {question}\n"
+        f"User's Answer: {user_answer}\n"
+        f"Correct Answer: {correct_answer}\n\n"
+        f"Briefly explain the correct choice in 1-2 sentences only."
+    )
+    return trim_explanation(await generate_with_model(prompt))
+
+async def explain_wrong_answers_batch(items: List[tuple]) -> List[str]:
+    """Explain several wrong answers with a single LLM call returning a JSON map."""
+    prompt = "The user answered the following nursing quiz questions incorrectly:\n\n"
+    for number, (question, user_answer, correct_answer) in enumerate(items, start=1):
+        prompt += (
+            f"{number}. Question: {question}\n"
+            f"   User's Answer: {user_answer}\n"
+            f"   Correct Answer: {correct_answer}\n"
+        )
+    prompt += (
+        "\nFor each numbered question, briefly explain the correct choice in 1-2 sentences only. "
+        'Return ONLY a JSON object mapping each number to its explanation, e.g. {"1": "...", "2": "..."}'
+    )
+
+    response = await generate_with_model(prompt)
+    match = re.search(r'\{.*\}', response, re.DOTALL)
+    explanations = json.loads(match.group(0)) if match else {}
+    return [
+        trim_explanation(str(explanations[str(number)])) if explanations.get(str(number)) else EXPLANATION_PLACEHOLDER
+        for number in range(1, len(items) + 1)
+    ]
+
+async def generate_explanations(items: List[tuple]) -> List[str]:
+    """Explain (question, user answer, correct answer) triples, serving repeats from the cache."""
+    keys = [explanation_cache_key(*item) for item in items]
+    explanations = list(await asyncio.gather(*(explanation_cache.aget(key) for key in keys)))
+    missing = [i for i, explanation in enumerate(explanations) if explanation is None]
+
+    if missing:
+        with stage_timer("explanations"):
+            generated = await generate_uncached_explanations([items[i] for i in missing])
+        for i, explanation in zip(missing, generated):
+            explanations[i] = explanation
+            if explanation != EXPLANATION_PLACEHOLDER:
+                await explanation_cache.aset(keys[i], explanation)
+
+    return explanations
+
+def explanation_deadline(count: int) -> float:
+    """Seconds to wait for `count` explanations: one call budget per round of concurrent calls, capped."""
+    rounds = math.ceil(count / max(EXPLANATION_CONCURRENCY, 1))
+    return min(EXPLANATION_DEADLINE, EXPLANATION_CALL_SECONDS * rounds)
+
+async def generate_uncached_explanations(items: List[tuple]) -> List[str]:
+    """
+    Explain (question, user answer, correct answer) triples concurrently.
+
+    At most EXPLANATION_CONCURRENCY calls run at once and the whole batch is
+    bounded by explanation_deadline(len(items)); explanations that finished in
+    time are returned and anything unfinished (or failed) degrades to a
+    placeholder, so polling clients always get an answer.
+    """
+    deadline = explanation_deadline(len(items))
+    if EXPLANATION_BATCH and len(items) > 1:
+        try:
+            return await asyncio.wait_for(explain_wrong_answers_batch(items), timeout=deadline)
+        except Exception as e:
+            logger.warning("Batched explanation failed: %s", e)
+            return [EXPLANATION_PLACEHOLDER] * len(items)
+
+    semaphore = asyncio.Semaphore(EXPLANATION_CONCURRENCY)
+
+    async def bounded(item):
+        async with semaphore:
+            return await explain_wrong_answer(*item)
+
+    tasks = [asyncio.create_task(bounded(item)) for item in items]
+    done, pending = await asyncio.wait(tasks, timeout=deadline)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("%d explanation(s) missed the %.1fs deadline", len(pending), deadline)
+
+    return [
+        task.result() if task in done and not task.exception() else EXPLANATION_PLACEHOLDER
+        for task in tasks
+    ]
+
+# 📝 Explanations generated after /quiz/evaluate has returned the scores, per session:
+# {"pending": bool, "explanations": {"<result index>": text}}, polled via GET /quiz/explanations
+quiz_explanations: SessionStore = create_session_store(table="explanations")
+explanation_tasks = set()
+
+async def explain_in_background(session_id: str, pending: Dict[int, tuple]):
+    """Generate the uncached explanations of one evaluation and publish them for polling."""
+    try:
+        explanations = await generate_explanations(list(pending.values()))
+    except Exception as e:
+        logger.warning("Explanations for session %s failed: %s", session_id, e)
+        explanations = [EXPLANATION_PLACEHOLDER] * len(pending)
+    await quiz_explanations.aset(session_id, {
+        "pending": False,
+        "explanations": {str(index): text for index, text in zip(pending, explanations)}
+    })
+
 @app.post("/quiz/evaluate")
-def evaluate_quiz(request: QuizEvalRequest):
-    quiz = active_quizzes.get(request.session_id, [])
+async def evaluate_quiz(request: QuizEvalRequest):
+    """
+    Score a quiz and return the results at once.
+
+    Explanations of wrong answers that are already cached are included. The
+    rest are marked `explanation_pending` and generated in the background;
+    poll GET /quiz/explanations?session_id=... for them.
+    """
+    quiz = await active_quizzes.aget(request.session_id)
     results = []
 
-    print(f"[DEBUG] Evaluating quiz for session: {request.session_id}")
-    print(f"[DEBUG] Available sessions in active_quizzes: {list(active_quizzes.keys())}")
-    print(f"[DEBUG] Quiz data available: {len(quiz)} questions")
-    print(f"[DEBUG] User submitted: {len(request.responses)} responses")
+    logger.debug("Evaluating quiz for session %s: %d questions stored, %d responses",
+                 request.session_id, len(quiz) if quiz else 0, len(request.responses))
     
     if not quiz:
-        print(f"[ERROR] No quiz data found for session {request.session_id}")
+        logger.warning("No quiz data found for session %s", request.session_id)
         # Return error responses for all questions
         for user_response in request.responses:
             results.append({
@@ -455,32 +1148,14 @@ def evaluate_quiz(request: QuizEvalRequest):
             })
         return results
 
+    wrong_answers = []
     for i, user_response in enumerate(request.responses):
-        print(f"\n[DEBUG] Question {i+1}:")
-        print(f"[DEBUG] User question: '{user_response.question}'")
-        print(f"[DEBUG] User answer: '{user_response.answer}'")
-        
-        # Use normalized question matching
-        normalized_user_question = normalize_question(user_response.question)
-        
-        correct_answer = None
-        matched_question = None
-        
-        # Search for matching question using normalized comparison
-        for q in quiz:
-            normalized_stored_question = normalize_question(q["question"])
-            print(f"[DEBUG] Comparing with stored: '{q['question']}'")
-            print(f"[DEBUG] Normalized user: '{normalized_user_question}'")
-            print(f"[DEBUG] Normalized stored: '{normalized_stored_question}'")
-            
-            if normalized_stored_question == normalized_user_question:
-                correct_answer = q["answer"]
-                matched_question = q
-                print(f"[DEBUG] MATCH FOUND! Correct answer: '{correct_answer}'")
-                break
+        # Hash lookup by question ID or normalized text
+        matched_question = quiz.find(user_response.question, user_response.question_id)
+        correct_answer = matched_question["answer"] if matched_question else None
         
         if not correct_answer:
-            print(f"[DEBUG] NO MATCH FOUND for question {i+1}")
+            logger.debug("No stored question matches response %d", i + 1)
             results.append({
                 "question": user_response.question,
                 "correct": False,
@@ -491,85 +1166,164 @@ def evaluate_quiz(request: QuizEvalRequest):
 
         try:
             correct = normalize(user_response.answer) == normalize(correct_answer)
-            print(f"[DEBUG] Answer comparison - User: '{normalize(user_response.answer)}' vs Correct: '{normalize(correct_answer)}' = {correct}")
         except:
             correct = False
-            print(f"[DEBUG] Error in answer comparison")
-
-        if correct:
-            explanation = ""
-        else:
-            prompt = (
-                f"The user answered the following nursing quiz question incorrectly:\n\n"
-                f"Question: {user_response.question}\n"
-                f"User's Answer: {user_response.answer}\n"
-                f"Correct Answer: {correct_answer}\n\n"
-                f"Briefly explain the correct choice in 1-2 sentences only."
-            )
-            try:
-                explanation = generate_with_model(prompt)
-                explanation = ". ".join(explanation.split(". ")[:2]).strip() + "."
-            except:
-                explanation = "Explanation unavailable."
+            logger.debug("Could not compare answer for response %d", i + 1)
 
-        results.append({
+        result = {
             "question": user_response.question,
             "correct": correct,
             "correctAnswer": correct_answer,
-            "explanation": explanation
-        })
+            "explanation": ""
+        }
+        results.append(result)
+        if not correct:
+            wrong_answers.append((len(results) - 1, (result["question"], user_response.answer, correct_answer)))
+
+    # Cached explanations go out with the scores; the rest are generated without holding them up
+    cached = await asyncio.gather(*(explanation_cache.aget(explanation_cache_key(*item)) for _, item in wrong_answers))
+    pending = {}
+    for (index, item), explanation in zip(wrong_answers, cached):
+        if explanation is not None:
+            results[index]["explanation"] = explanation
+        else:
+            results[index]["explanation_pending"] = True
+            pending[index] = item
+    if pending:
+        await quiz_explanations.aset(request.session_id, {"pending": True, "explanations": {}})
+        task = asyncio.create_task(explain_in_background(request.session_id, pending))
+        explanation_tasks.add(task)
+        task.add_done_callback(explanation_tasks.discard)
 
     return results
 
+@app.get("/quiz/explanations")
+async def get_quiz_explanations(session_id: str):
+    """Explanations still owed by the last /quiz/evaluate of `session_id`, keyed by result index."""
+    entry = await quiz_explanations.aget(session_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="No explanations for this session.")
+    return entry
+
+# 💡 Follow-up suggestions (see suggestion_index.py). SUGGEST_MODE=index answers from the precomputed
+# suggestion index with one embedding lookup; "refine" does the same and asks the LLM for better ones in
+# the background, served from suggestion_cache on later requests; "llm" always waits for the LLM
+SUGGEST_MODES = ("index", "refine", "llm")
+SUGGEST_MODE = os.getenv("SUGGEST_MODE", "index").lower()
+# Nearest KB chunks whose candidate questions (and neighbours' questions) are considered
+SUGGEST_SEED_CHUNKS = int(os.getenv("SUGGEST_SEED_CHUNKS", "3"))
+GENERIC_SUGGESTIONS = [
+    "Can you explain more about this topic?",
+    "What are the key nursing considerations?",
+    "When should I seek medical help?"
+]
+
+suggestion_cache = TTLCache(
+    maxsize=int(os.getenv("SUGGEST_CACHE_SIZE", "2000")),
+    ttl=float(os.getenv("SUGGEST_CACHE_TTL", "86400")),
+    name="suggestions"
+)
+# Prebuilt with `python suggestion_index.py build`; otherwise built by the lifespan
+suggestion_index: Optional[SuggestionIndex] = load_suggestion_index(knowledge.key, INDEX_DIR)
+suggestion_index_lock = asyncio.Lock()
+suggestion_refinements = set()  # background LLM refinements, referenced until done
+
+def suggest_mode(mode: Optional[str]) -> str:
+    mode = (mode or SUGGEST_MODE).lower()
+    if mode not in SUGGEST_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown suggestion mode '{mode}', expected one of {SUGGEST_MODES}")
+    return mode
+
+async def prepare_suggestion_index(kb: KnowledgeBase):
+    """Load (or build, off the event loop) the suggestion index matching `kb`."""
+    global suggestion_index
+    async with suggestion_index_lock:
+        if suggestion_index is not None and suggestion_index.key == kb.key:
+            return
+        try:
+            suggestion_index = await run_in_threadpool(
+                load_or_build_suggestion_index, kb.index, lambda: embedding_model, INDEX_DIR, suggestion_index
+            )
+        except Exception:
+            logger.exception("Could not prepare the suggestion index for %s", kb.key)
+
 @app.post("/suggest")
-def suggest_follow_up(request: SuggestRequest):
+async def suggest_follow_up(request: SuggestRequest):
+    mode = suggest_mode(request.mode)
+    key = normalize_question(request.question)
+    if mode == "refine":
+        refined = suggestion_cache.get(key)
+        if refined:
+            return {"suggestions": refined, "source": "llm"}
+
+    if mode != "llm":
+        suggestions = await suggest_from_index(request.question)
+        if suggestions:
+            if mode == "refine":
+                refine_suggestions_later(request.question)
+            return {"suggestions": suggestions, "source": "index"}
+        # No index for the current KB yet (or no candidates): use the LLM if there is one
+        if not OPENROUTER_API_KEY:
+            return {"suggestions": list(GENERIC_SUGGESTIONS), "source": "fallback"}
+
+    return dict(await suggest_flights.run(key, lambda: generate_suggestions(request.question)))
+
+async def suggest_from_index(question: str) -> List[str]:
+    """Follow-ups from the precomputed index: one query embedding, one KB search, no LLM call."""
+    kb = knowledge
+    index = suggestion_index
+    if index is None or index.key != kb.key:
+        return []
+    question_embedding = await embed_question(question)
+    with stage_timer("suggest"):
+        hits = kb.retriever.search(question_embedding, top_k=SUGGEST_SEED_CHUNKS)[0]
+        return index.suggest(question_embedding[0], [hit["corpus_id"] for hit in hits])
+
+def refine_suggestions_later(question: str):
+    if not OPENROUTER_API_KEY:
+        return
+    task = asyncio.create_task(refine_suggestions(question))
+    suggestion_refinements.add(task)
+    task.add_done_callback(suggestion_refinements.discard)
+
+async def refine_suggestions(question: str):
+    """Ask the LLM for follow-ups at background priority and cache them for the next identical question."""
+    request_priority.set(BACKGROUND)
+    key = normalize_question(question)
     try:
-        prompt = (
-            f"Based on this nursing question: '{request.question}'\n\n"
-            f"Generate exactly 3 short, relevant follow-up questions that a nursing student might ask. "
-            f"Return ONLY a JSON array of strings in this exact format:\n"
-            f'["Question 1?", "Question 2?", "Question 3?"]\n\n'
-            f"Focus on practical nursing care, safety considerations, or patient education related to the topic. "
-            f"Keep each question under 15 words."
-        )
-        
-        response = generate_with_model(prompt)
-        
-        # Extract JSON array from response
-        try:
-            # Look for JSON array pattern
-            import re
-            match = re.search(r'\[(.*?)\]', response, re.DOTALL)
-            if match:
-                json_str = '[' + match.group(1) + ']'
-                suggestions = json.loads(json_str)
-                
-                # Validate that we have a list of strings
-                if isinstance(suggestions, list) and len(suggestions) > 0:
-                    # Clean and validate suggestions
-                    cleaned_suggestions = []
-                    for suggestion in suggestions[:3]:  # Limit to 3
-                        if isinstance(suggestion, str) and len(suggestion.strip()) > 0:
-                            cleaned_suggestions.append(suggestion.strip())
-                    
-                    if len(cleaned_suggestions) > 0:
-                        return {"suggestions": cleaned_suggestions}
-            
-            # Fallback if parsing fails
-            return {"suggestions": [
-                "Can you explain more about this topic?",
-                "What are the key nursing considerations?",
-                "When should I seek medical help?"
-            ]}
-            
-        except json.JSONDecodeError:
-            # Fallback suggestions if JSON parsing fails
-            return {"suggestions": [
-                "What are the nursing interventions for this?",
-                "How do I monitor the patient's condition?",
-                "What patient education should I provide?"
-            ]}
+        suggestions = await suggest_flights.run(("refine", key), lambda: llm_suggestions(question))
+    except Exception as e:  # best effort, including Overloaded: the index answer stands
+        logger.debug("Suggestion refinement skipped for %s: %s", question_id(question), e)
+        return
+    if suggestions:
+        suggestion_cache.set(key, suggestions)
+
+async def llm_suggestions(question: str) -> List[str]:
+    prompt = (
+        f"Based on this nursing question: '{question}'\n\n"
+        f"Generate exactly 3 short, relevant follow-up questions that a nursing student might ask. "
+        f"Return ONLY a JSON array of strings in this exact format:\n"
+        f'["Question 1?", "Question 2?", "Question 3?"]\n\n'
+        f"Focus on practical nursing care, safety considerations, or patient education related to the topic. "
+        f"Keep each question under 15 words."
+    )
+
+    response = await generate_with_model(prompt)
+
+    # Extract the suggestions with the shared tolerant JSON array parser
+    return parse_suggestions(response, limit=3)
+
+async def generate_suggestions(question: str) -> Dict:
+    try:
+        suggestions = await llm_suggestions(question)
+        if suggestions:
+            return {"suggestions": suggestions, "source": "llm"}
+
+        # Fallback if parsing fails
+        return {"suggestions": list(GENERIC_SUGGESTIONS), "source": "fallback"}
     
+    except Overloaded:
+        raise
     except Exception as e:
         return {"error": f"Failed to generate suggestions: {str(e)}"}
 
@@ -585,33 +1339,103 @@ def read_root():
 @app.get("/health")
 def health_check():
     """API health check endpoint"""
-    return {"status": "healthy", "message": "KKH Nursing Chatbot API is running."}
+    return {
+        "status": "healthy",
+        "message": "KKH Nursing Chatbot API is running.",
+        "embedding_model": "ready" if embedding_model.loaded else "loading"
+    }
 
-def normalize_question_for_comparison(question: str) -> str:
-    """Normalize question text for comparison to detect duplicates."""
-    return re.sub(r'[^\w\s]', '', question.lower().strip())
+async def filter_unique_questions(questions: List[Dict], topic: str, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Keep the questions that are neither exact nor near-duplicates (by embedding
+    similarity) of the topic's history or of each other, and add them to it.
 
-def is_question_unique(question: str, topic: str) -> bool:
-    """Check if a question is unique for the given topic."""
-    if topic not in question_history:
-        return True
-    
-    normalized_question = normalize_question_for_comparison(question)
-    existing_questions = [normalize_question_for_comparison(q) for q in question_history[topic]]
-    
-    return normalized_question not in existing_questions
+    The whole batch is embedded in one call and compared in one matrix product.
+    """
+    candidates = [q for q in questions if isinstance(q, dict) and q.get('question')]
+    if not candidates or (limit is not None and limit <= 0):
+        return []
+    texts = [q['question'] for q in candidates]
+    with stage_timer("dedup"):
+        embeddings = await embedding_service.encode(texts)
+        mask = question_history.unique_mask(topic, texts, embeddings)
 
-def add_questions_to_history(questions: List[Dict], topic: str):
-    """Add generated questions to the history for the given topic."""
-    if topic not in question_history:
-        question_history[topic] = []
-    
-    for q in questions:
-        if isinstance(q, dict) and 'question' in q:
-            question_history[topic].append(q['question'])
-    
-    # Keep only the last 50 questions per topic to prevent memory bloat
-    question_history[topic] = question_history[topic][-50:]
+    unique = []
+    for i, (q, is_unique) in enumerate(zip(candidates, mask)):
+        if not is_unique:
+            logger.debug("Filtered out duplicate question %s", question_id(q["question"]))
+        elif limit is None or len(unique) < limit:
+            unique.append(i)
+
+    # Keep only the last QUESTION_HISTORY_SIZE questions per topic to prevent memory bloat
+    question_history.add(topic, [texts[i] for i in unique], embeddings[unique])
+    return [candidates[i] for i in unique]
+
+@app.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters for the in-process caches."""
+    return {
+        "answers": answer_cache.stats(),
+        "explanations": explanation_cache.stats(),
+        "sessions": active_quizzes.stats(),
+        "quiz_pool": quiz_pool.stats(),
+        "question_history": question_history.stats(),
+        "suggestions": suggestion_cache.stats(),
+        "suggestion_index": suggestion_index.stats() if suggestion_index is not None else None,
+        "single_flight": {flights.name: flights.stats() for flights in (ask_flights, quiz_flights, suggest_flights)}
+    }
+
+# 📈 Scrape-time views of component counters and sizes for /metrics
+registry.gauge("cache_hits_total", "Cache hits", lambda: {
+    "answers": answer_cache.hits, "explanations": explanation_cache.hits,
+    "quiz": CACHE_LOOKUPS.value(cache="quiz", result="hit"), "quiz_pool": quiz_pool.hits,
+    "suggestions": suggestion_cache.hits
+}, ("cache",), kind="counter")
+registry.gauge("cache_misses_total", "Cache misses", lambda: {
+    "answers": answer_cache.misses, "explanations": explanation_cache.misses,
+    "quiz": CACHE_LOOKUPS.value(cache="quiz", result="miss"), "quiz_pool": quiz_pool.misses,
+    "suggestions": suggestion_cache.misses
+}, ("cache",), kind="counter")
+registry.gauge("cache_entries", "Entries held per cache", lambda: {
+    "answers": len(answer_cache), "explanations": len(explanation_cache), "quiz": len(quiz_cache),
+    "quiz_pool": sum(quiz_pool.stats()["topics"].values()), "suggestions": len(suggestion_cache)
+}, ("cache",))
+registry.gauge("single_flight_saved_total", "Upstream calls saved by request coalescing", lambda: {
+    flights.name: flights.calls - flights.executions for flights in (ask_flights, quiz_flights, suggest_flights)
+}, ("endpoint",), kind="counter")
+registry.gauge("active_quizzes", "Quiz sessions in the session store", lambda: len(active_quizzes))
+registry.gauge("question_history_questions", "Questions held in the quiz question history",
+               lambda: question_history.stats()["questions"])
+registry.gauge("question_history_topics", "Topics in the quiz question history", lambda: len(question_history))
+registry.gauge("llm_inflight", "Upstream LLM calls holding an admission slot", lambda: llm_gate.in_flight)
+registry.gauge("llm_queue_depth", "Upstream LLM calls waiting for an admission slot", llm_gate.queue_depth)
+registry.gauge("kb_chunks", "Chunks in the current knowledge base index", lambda: len(knowledge.records))
+registry.gauge("embedding_queue_depth", "Query texts waiting for the embedding micro-batcher",
+               lambda: embedding_service.queue_depth())
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition of latency histograms, LLM counters, cache and size gauges."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.post("/admin/reload")
+async def reload_knowledge_base_endpoint(x_admin_token: str = Header(default="")):
+    """Re-ingest the KB sources, re-embedding only new or changed chunks."""
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Reload requires a valid X-Admin-Token (set ADMIN_TOKEN).")
+    kb = await reload_knowledge_base()
+    return {
+        "key": kb.key,
+        "chunks": len(kb.records),
+        "documents": kb.index.meta.get("documents"),
+        "encoded": kb.index.meta.get("encoded"),
+        "reused": kb.index.meta.get("reused")
+    }
+
+@app.get("/embeddings/stats")
+def get_embedding_stats():
+    """Embedding backend status plus batch sizes and queue depth of the query micro-batcher."""
+    return dict(embedding_service.stats(), model=embedding_model.status())
 
 @app.get("/quiz/history")
 def get_question_history():
@@ -0,0 +1,140 @@
+"""
+Startup time, memory and vector agreement of the embedding backends.
+
+Each backend is measured in a fresh subprocess: time to import and load the
+model, time of the first encode, steady-state single-query latency and the
+process RSS once loaded. Vectors are compared with the torch backend (the
+reference) by cosine similarity and top-k neighbour overlap on KB chunks.
+
+    python embedding_backends.py export          # once, for the onnx backends
+    python benchmarks/bench_embedding_backends.py --backends torch onnx-int8 onnx-fp32
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BACKENDS = {"torch": {"EMBEDDING_BACKEND": "torch"},
+            "onnx-int8": {"EMBEDDING_BACKEND": "onnx", "EMBEDDING_ONNX_QUANTIZED": "1"},
+            "onnx-fp32": {"EMBEDDING_BACKEND": "onnx", "EMBEDDING_ONNX_QUANTIZED": "0"}}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0  # kB on Linux
+
+
+def child(texts_path: str, vectors_path: str, repeat: int):
+    """Runs in the subprocess: measure one backend and save its vectors."""
+    baseline = rss_mb()
+    start = time.perf_counter()
+    from embedding_backends import create_embedding_backend
+    backend = create_embedding_backend().load()
+    load_seconds = time.perf_counter() - start
+
+    with open(texts_path) as f:
+        texts = json.load(f)
+    start = time.perf_counter()
+    backend.encode(texts[:1])
+    first_encode = time.perf_counter() - start
+
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        backend.encode([texts[i % len(texts)]])
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    vectors = backend.encode(texts)
+    batch_seconds = time.perf_counter() - start
+    np.save(vectors_path, vectors)
+
+    print(json.dumps({
+        "load_s": load_seconds,
+        "first_encode_ms": first_encode * 1000.0,
+        "query_p50_ms": float(np.percentile(latencies, 50)) * 1000.0,
+        "batch_texts_per_s": len(texts) / batch_seconds,
+        "rss_mb": rss_mb(),
+        "baseline_rss_mb": baseline,
+    }))
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """Mean overlap of each text's top-k nearest texts under the two embeddings."""
+    def top_k(vectors):
+        vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        scores = vectors @ vectors.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :k]
+    expected, got = top_k(reference), top_k(candidate)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(expected, got)]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=["torch", "onnx-int8"])
+    parser.add_argument("--texts", type=int, default=256, help="KB chunks to encode and compare")
+    parser.add_argument("--repeat", type=int, default=50, help="single-query encodes to time")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("TEXTS", "VECTORS"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        return child(args.child[0], args.child[1], args.repeat)
+
+    from embedding_backends import cosine_agreement
+    from ingest import embedding_text, load_chunks
+    texts = [embedding_text(chunk) for chunk in load_chunks()[:args.texts]]
+    texts += [f"What are the nursing priorities for patient scenario {i}?" for i in range(max(0, 32 - len(texts)))]
+
+    workdir = tempfile.mkdtemp(prefix="bench-embed-")
+    texts_path = os.path.join(workdir, "texts.json")
+    with open(texts_path, "w") as f:
+        json.dump(texts, f)
+
+    results, vectors = {}, {}
+    for name in args.backends:
+        vectors_path = os.path.join(workdir, f"{name}.npy")
+        env = dict(os.environ, **BACKENDS[name])
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--repeat", str(args.repeat),
+                               "--child", texts_path, vectors_path],
+                              cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"{name}: failed\n{proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ''}")
+            continue
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+        results[name]["process_s"] = time.perf_counter() - start
+        vectors[name] = np.load(vectors_path)
+
+    print(f"\n{len(texts)} texts; vectors compared with torch")
+    print(f"  {'backend':<11}{'load s':>8}{'first ms':>10}{'query p50 ms':>14}{'texts/s':>10}{'RSS MB':>9}"
+          f"{'min cos':>9}{'mean cos':>10}{f'top{args.k} overlap':>14}")
+    for name, result in results.items():
+        line = (f"  {name:<11}{result['load_s']:>8.2f}{result['first_encode_ms']:>10.1f}"
+                f"{result['query_p50_ms']:>14.2f}{result['batch_texts_per_s']:>10.0f}{result['rss_mb']:>9.0f}")
+        if "torch" in vectors and name != "torch":
+            similarity = cosine_agreement(vectors["torch"], vectors[name])
+            overlap = neighbour_overlap(vectors["torch"], vectors[name], args.k)
+            result.update(min_cosine=float(similarity.min()), mean_cosine=float(similarity.mean()),
+                          neighbour_overlap=overlap)
+            line += f"{similarity.min():>9.4f}{similarity.mean():>10.4f}{overlap:>14.3f}"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
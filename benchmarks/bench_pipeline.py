@@ -0,0 +1,160 @@
+"""
+Micro-benchmarks of the request pipeline stages that run in-process.
+
+- ``chunk``: ``ingest.chunk_text`` over documents of several sizes (built by
+  repeating the guides under ``KB_SOURCE_DIR``).
+- ``embed``: the sentence-transformer query/chunk encoder at several batch
+  sizes (skipped if the model cannot be loaded).
+- ``search``: the configured retriever (``RETRIEVER``, semantic search) and the
+  BM25 index at several synthetic corpus sizes.
+
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --only search --sizes 1000 10000 100000 --json after.json
+
+Compare two ``--json`` result files to spot regressions before deploying.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_retrieval import synthetic_corpus, synthetic_queries
+from ingest import KB_SOURCE_DIR, chunk_text, iter_documents
+from retrieval import BM25Index, create_retriever
+
+_SAMPLE_TEXT = (
+    "FLUID BALANCE\n"
+    "Record all intake and output. Weigh the child daily at the same time. "
+    "Report urine output below 1 ml/kg/hr to the medical team.\n"
+    "## Medication Safety\n"
+    "Check the dose against the child's weight. Two nurses verify controlled drugs such as morphine 0.1 mg/kg.\n"
+)
+
+
+def measure(fn: Callable[[], object], repeat: int, min_time: float = 0.0) -> np.ndarray:
+    """Run `fn` `repeat` times (or until `min_time` seconds have passed); latencies in ms."""
+    fn()  # warm-up
+    latencies = []
+    started = time.perf_counter()
+    while len(latencies) < repeat or time.perf_counter() - started < min_time:
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000.0
+
+
+def summarize(name: str, latencies: np.ndarray, items: int = 1, unit: str = "items") -> Dict:
+    result = {
+        "name": name,
+        "runs": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(latencies.mean()),
+        f"{unit}_per_s": items / (float(latencies.mean()) / 1000.0) if latencies.mean() else 0.0,
+    }
+    print(f"  {name:<32} p50={result['p50_ms']:9.3f}ms  p95={result['p95_ms']:9.3f}ms  "
+          f"{result[f'{unit}_per_s']:12.1f} {unit}/s")
+    return result
+
+
+def bench_chunking(args) -> List[Dict]:
+    source = "\n\n".join(text for _, text in iter_documents(args.source)) or _SAMPLE_TEXT
+    results = []
+    print(f"\nchunk_text (source: {len(source)} chars)")
+    for size in args.doc_chars:
+        text = (source * (size // len(source) + 1))[:size]
+        chunks = len(chunk_text(text))
+        latencies = measure(lambda: chunk_text(text), repeat=args.repeat, min_time=0.5)
+        result = summarize(f"{size} chars -> {chunks} chunks", latencies, items=size / 1e6, unit="MB")
+        result.update(stage="chunk", chars=size, chunks=chunks)
+        results.append(result)
+    return results
+
+
+def bench_embedding(args) -> List[Dict]:
+    from kb_index import EMBEDDING_MODEL_NAME
+    print(f"\nembedding ({EMBEDDING_MODEL_NAME})")
+    try:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    except Exception as e:
+        print(f"  skipped: {e}")
+        return []
+
+    texts = [chunk["text"] for chunk in chunk_text(_SAMPLE_TEXT * 64)]
+    results = []
+    for batch_size in args.batch_sizes:
+        batch = (texts * (batch_size // len(texts) + 1))[:batch_size]
+        latencies = measure(lambda: model.encode(batch, batch_size=batch_size), repeat=args.repeat, min_time=0.5)
+        result = summarize(f"batch={batch_size}", latencies, items=batch_size, unit="texts")
+        result.update(stage="embed", batch_size=batch_size)
+        results.append(result)
+    return results
+
+
+def bench_search(args) -> List[Dict]:
+    results = []
+    rng = np.random.default_rng(0)
+    vocabulary = np.array(_SAMPLE_TEXT.lower().split() + [f"term{i}" for i in range(5000)])
+    for size in args.sizes:
+        corpus = synthetic_corpus(size, args.dim, clusters=max(8, size // 200))
+        queries = synthetic_queries(corpus, args.queries)
+        texts = [" ".join(rng.choice(vocabulary, size=60)) for _ in range(size)]
+        text_queries = [" ".join(rng.choice(vocabulary, size=8)) for _ in range(args.queries)]
+        print(f"\nsearch corpus={size} dim={args.dim} k={args.k}")
+
+        start = time.perf_counter()
+        retriever = create_retriever(corpus)
+        print(f"  ({retriever.name} build: {time.perf_counter() - start:.2f}s)")
+        vectors = itertools.cycle(queries)
+        latencies = measure(lambda: retriever.search(next(vectors)[None, :], top_k=args.k), repeat=args.queries)
+        result = summarize(f"semantic ({retriever.name})", latencies, unit="queries")
+        result.update(stage="search", kind=retriever.name, corpus=size)
+        results.append(result)
+
+        start = time.perf_counter()
+        bm25 = BM25Index(texts)
+        print(f"  (bm25 build: {time.perf_counter() - start:.2f}s)")
+        strings = itertools.cycle(text_queries)
+        latencies = measure(lambda: bm25.search(next(strings), top_k=args.k), repeat=args.queries)
+        result = summarize("lexical (bm25)", latencies, unit="queries")
+        result.update(stage="search", kind="bm25", corpus=size)
+        results.append(result)
+    return results
+
+
+BENCHMARKS = {"chunk": bench_chunking, "embed": bench_embedding, "search": bench_search}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--source", default=KB_SOURCE_DIR, help="documents used for the chunking benchmark")
+    parser.add_argument("--doc-chars", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.only:
+        results.extend(BENCHMARKS[name](args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {len(results)} results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
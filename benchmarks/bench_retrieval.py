@@ -0,0 +1,102 @@
+"""
+Recall@k vs latency of the ANN retrievers against exact search.
+
+Builds a synthetic clustered corpus of unit vectors (shaped like MiniLM
+sentence embeddings), uses ExactRetriever as ground truth, and sweeps the
+IVF `n_probe` and (if hnswlib is installed) HNSW `ef_search` knobs.
+
+    python benchmarks/bench_retrieval.py --sizes 10000 100000 --dim 384
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import ExactRetriever, HNSWRetriever, IVFRetriever, normalize_rows
+
+
+def synthetic_corpus(size: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random topic centres, like chunks of many documents."""
+    rng = np.random.default_rng(seed)
+    centres = normalize_rows(rng.standard_normal((clusters, dim)).astype(np.float32))
+    labels = rng.integers(clusters, size=size)
+    noise = rng.standard_normal((size, dim)).astype(np.float32) * 0.6 / np.sqrt(dim) * 4
+    return normalize_rows(centres[labels] + noise).astype(np.float32)
+
+
+def synthetic_queries(corpus: np.ndarray, count: int, seed: int = 1) -> np.ndarray:
+    """Queries are perturbed corpus rows, so each has a meaningful neighbourhood."""
+    rng = np.random.default_rng(seed)
+    base = corpus[rng.integers(len(corpus), size=count)]
+    return normalize_rows(base + rng.standard_normal(base.shape).astype(np.float32) * 0.05)
+
+
+def timed_search(retriever, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(retriever.search(query[None, :], top_k=k)[0])
+        latencies.append(time.perf_counter() - start)
+    return results, np.array(latencies) * 1000.0
+
+
+def recall_at_k(results, truth) -> float:
+    total = 0.0
+    for got, expected in zip(results, truth):
+        expected_ids = {hit["corpus_id"] for hit in expected}
+        total += len(expected_ids & {hit["corpus_id"] for hit in got}) / max(len(expected_ids), 1)
+    return total / len(truth)
+
+
+def report(name: str, results, latencies, truth):
+    print(f"  {name:<24} recall@k={recall_at_k(results, truth):.3f}  "
+          f"p50={np.percentile(latencies, 50):7.3f}ms  p95={np.percentile(latencies, 95):7.3f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128])
+    args = parser.parse_args(argv)
+
+    for size in args.sizes:
+        corpus = synthetic_corpus(size, args.dim, clusters=max(8, size // 200))
+        queries = synthetic_queries(corpus, args.queries)
+        print(f"\ncorpus={size} dim={args.dim} queries={args.queries} k={args.k}")
+
+        exact = ExactRetriever(corpus)
+        truth, latencies = timed_search(exact, queries, args.k)
+        report("exact", truth, latencies, truth)
+
+        start = time.perf_counter()
+        ivf = IVFRetriever(corpus)
+        print(f"  (ivf build: n_list={ivf.n_list}, {time.perf_counter() - start:.2f}s)")
+        for n_probe in args.nprobe:
+            ivf.n_probe = n_probe
+            results, latencies = timed_search(ivf, queries, args.k)
+            report(f"ivf n_probe={n_probe}", results, latencies, truth)
+
+        try:
+            start = time.perf_counter()
+            hnsw = HNSWRetriever(corpus)
+            print(f"  (hnsw build: {time.perf_counter() - start:.2f}s)")
+        except ImportError as e:
+            print(f"  hnsw skipped: {e}")
+            continue
+        for ef in args.ef:
+            hnsw.set_ef(max(ef, args.k))
+            results, latencies = timed_search(hnsw, queries, args.k)
+            report(f"hnsw ef_search={ef}", results, latencies, truth)
+
+
+if __name__ == "__main__":
+    main()
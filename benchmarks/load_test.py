@@ -0,0 +1,184 @@
+"""
+Closed-loop load generator for the backend's ``/ask``, ``/quiz`` and ``/quiz/evaluate``.
+
+``--concurrency`` workers each send one request at a time for ``--duration``
+seconds, picking the endpoint by ``--mix`` weight. ``/quiz/evaluate`` answers a
+quiz fetched earlier by a ``/quiz`` request (with random answers, so wrong
+answers trigger explanations). Reports per-endpoint p50/p95/p99 latency,
+error counts, ``429`` responses (rate limited or shed, counted separately from
+errors) and throughput; ``--json`` writes them for comparison between runs.
+
+Run it against a backend that talks to the local mock LLM (see
+``mock_llm.py``) to benchmark offline. Every worker shares one client address,
+so start the backend with the per-client rate limit off and an upstream cap
+sized for the run, or the run measures the rate limiter instead of the pipeline:
+
+    RATE_LIMIT_PER_MINUTE=0 LLM_MAX_INFLIGHT=64 OPENROUTER_API_KEY=mock \\
+        OPENROUTER_API_URL=http://127.0.0.1:9000/v1/chat/completions uvicorn backend:app --port 8000
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 32 --duration 60
+    python benchmarks/load_test.py --mix ask=1 --vary --json ask.json
+
+Answers, quizzes and explanations are cached by the backend; ``--vary`` makes
+most ``/ask`` questions distinct so the retrieval + LLM path is exercised.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+QUESTIONS = [
+    "How do I calculate maintenance fluids for a child?",
+    "What are the signs of dehydration in infants?",
+    "When should I escalate a high PEWS score?",
+    "How often should observations be recorded after surgery?",
+    "What is the correct dose of paracetamol for a 20 kg child?",
+    "How do I check the position of an NGT before a feed?",
+    "What are the early signs of sepsis in children?",
+    "How should a peripheral cannula site be assessed?",
+    "What should I do if a child has an anaphylactic reaction?",
+    "How do I manage hypoglycaemia in a diabetic child?",
+]
+TOPICS = ["General", "Fluid balance", "Medication safety", "Infection control"]
+_SUBJECTS = ["a neonate", "a toddler", "a school-age child", "an adolescent", "a child with asthma",
+             "a child after tonsillectomy", "a child on insulin", "a child with a fever"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, ok: bool, throttled: bool = False):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if throttled:
+            self.throttled[endpoint] = self.throttled.get(endpoint, 0) + 1
+        elif not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict:
+        endpoints = {}
+        for endpoint, values in sorted(self.latencies.items()):
+            latencies = np.array(values) * 1000.0
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": self.errors.get(endpoint, 0),
+                "throttled": self.throttled.get(endpoint, 0),
+                "throughput_rps": len(values) / elapsed,
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+                "p99_ms": float(np.percentile(latencies, 99)),
+                "max_ms": float(latencies.max()),
+            }
+        total = sum(len(values) for values in self.latencies.values())
+        return {"elapsed_s": elapsed, "requests": total, "throughput_rps": total / elapsed, "endpoints": endpoints}
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.recorder = Recorder()
+        self.quizzes: List[Dict] = []  # {"session_id", "quiz"} to evaluate
+        self.rng = random.Random(args.seed)
+        self.counter = 0
+
+    async def timed(self, endpoint: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        throttled = False
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            throttled = response.status_code == 429
+            body = response.json()
+            ok = response.status_code < 400 and not (isinstance(body, dict) and "error" in body)
+        except (httpx.HTTPError, ValueError):
+            body, ok = None, False
+        self.recorder.record(endpoint, time.perf_counter() - start, ok, throttled)
+        return body if ok else None
+
+    def question(self) -> str:
+        question = self.rng.choice(QUESTIONS)
+        if self.args.vary:
+            self.counter += 1
+            question = f"{question[:-1]} for {self.rng.choice(_SUBJECTS)} (scenario {self.counter})?"
+        return question
+
+    async def ask(self):
+        await self.timed("/ask", "POST", "/ask", json={"question": self.question()})
+
+    async def quiz(self):
+        body = await self.timed("/quiz", "GET", "/quiz",
+                                params={"n": self.args.quiz_size, "topic": self.rng.choice(TOPICS)})
+        if body and body.get("quiz"):
+            self.quizzes.append(body)
+            del self.quizzes[:-100]
+
+    async def evaluate(self):
+        if not self.quizzes:
+            return await self.quiz()
+        quiz = self.rng.choice(self.quizzes)
+        responses = [
+            {"question": q["question"], "question_id": q.get("id"), "answer": self.rng.choice(q["options"])}
+            for q in quiz["quiz"]
+        ]
+        await self.timed("/quiz/evaluate", "POST", "/quiz/evaluate",
+                         json={"session_id": quiz["session_id"], "responses": responses})
+
+    async def worker(self, deadline: float, scenarios: List, weights: List[float]):
+        while time.perf_counter() < deadline:
+            await self.rng.choices(scenarios, weights)[0]()
+
+    async def run(self) -> Dict:
+        mix = {name: float(weight) for name, weight in (item.split("=") for item in self.args.mix.split(","))}
+        scenarios = [getattr(self, name) for name in mix]
+        start = time.perf_counter()
+        deadline = start + self.args.duration
+        await asyncio.gather(*(self.worker(deadline, scenarios, list(mix.values()))
+                               for _ in range(self.args.concurrency)))
+        return self.recorder.summary(time.perf_counter() - start)
+
+
+def print_summary(summary: Dict):
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.1f}s "
+          f"({summary['throughput_rps']:.1f} req/s)")
+    print(f"  {'endpoint':<16}{'requests':>9}{'errors':>8}{'429s':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, stats in summary["endpoints"].items():
+        print(f"  {endpoint:<16}{stats['requests']:>9}{stats['errors']:>8}{stats['throttled']:>8}"
+              f"{stats['throughput_rps']:>9.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+
+
+async def main_async(args) -> Dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await LoadTest(client, args).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight at any time")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--mix", default="ask=6,quiz=2,evaluate=2", help="endpoint weights (ask, quiz, evaluate)")
+    parser.add_argument("--quiz-size", type=int, default=5)
+    parser.add_argument("--vary", action="store_true", help="make /ask questions distinct to bypass the caches")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args(argv)
+
+    summary = asyncio.run(main_async(args))
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
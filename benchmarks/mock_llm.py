@@ -0,0 +1,163 @@
+"""
+Local OpenAI-compatible mock of the chat completions API, for benchmarks.
+
+Answers ``POST /v1/chat/completions`` (plain and ``"stream": true``) with
+canned content shaped like what the backend asks for: a JSON array of quiz
+questions, a JSON object of numbered explanations, a JSON array of follow-up
+suggestions, or a prose answer. Latency, token rate and errors are
+configurable, so the backend can be benchmarked offline and reproducibly:
+
+    python benchmarks/mock_llm.py --port 9000 --ttft-ms 300 --tokens-per-second 60 --error-rate 0.02
+    RATE_LIMIT_PER_MINUTE=0 LLM_MAX_INFLIGHT=64 OPENROUTER_API_KEY=mock \\
+        OPENROUTER_API_URL=http://127.0.0.1:9000/v1/chat/completions uvicorn backend:app --port 8000
+
+(``load_test.py`` sends everything from one address, so the per-client rate
+limit is turned off and the upstream cap raised to fit its concurrency.)
+
+``GET /stats`` reports how many requests, errors and tokens were served.
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Dict, List
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_WORDS = (
+    "assessment airway perfusion sepsis insulin heparin dosage infusion pressure ulcer wound dressing "
+    "catheter fluid balance electrolyte potassium sodium dehydration oxygen saturation nebulizer asthma "
+    "seizure fever neonate toddler adolescent pain score analgesia opioid naloxone allergy anaphylaxis "
+    "hand hygiene isolation handover escalation deterioration observation chart consent discharge "
+    "feeding tube aspiration glucose ketones diabetes cardiac rhythm bradycardia tachycardia capillary "
+    "refill cannula phlebitis transfusion reaction medication error documentation family education"
+).split()
+
+_QUIZ_N_RE = re.compile(r"exactly (\d+)")
+_NUMBERED_RE = re.compile(r"^(\d+)\. Question:", re.M)
+
+
+class MockConfig:
+    def __init__(self, ttft_ms: float = 200, jitter_ms: float = 50, tokens_per_second: float = 0,
+                 answer_tokens: int = 120, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        self.ttft = ttft_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize()
+
+
+def _quiz(rng: random.Random, n: int) -> str:
+    questions = []
+    for _ in range(n):
+        options = [_sentence(rng, 3) + f" {rng.randint(1, 999)}" for _ in range(4)]
+        questions.append({
+            "question": f"{_sentence(rng, 10)} (case {rng.randint(1, 10 ** 6)})?",
+            "option1": options[0], "option2": options[1], "option3": options[2], "option4": options[3],
+            "answer": rng.choice(options),
+        })
+    return json.dumps(questions, indent=1)
+
+
+def completion_text(messages: List[Dict], config: MockConfig) -> str:
+    """Content shaped after the prompt the backend sent."""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    rng = config.rng
+    if "multiple-choice" in prompt:
+        match = _QUIZ_N_RE.search(prompt)
+        return _quiz(rng, int(match.group(1)) if match else 10)
+    if "JSON object mapping each number" in prompt:
+        numbers = _NUMBERED_RE.findall(prompt) or ["1"]
+        return json.dumps({number: f"{_sentence(rng, 12)}. {_sentence(rng, 8)}." for number in numbers})
+    if "follow-up questions" in prompt:
+        return json.dumps([f"{_sentence(rng, 7)}?" for _ in range(3)])
+    return " ".join(_sentence(rng, 12) + "." for _ in range(max(1, config.answer_tokens // 12)))
+
+
+def _tokens(text: str) -> List[str]:
+    """Split into word-sized pieces that concatenate back to `text`."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+    stats = {"requests": 0, "streams": 0, "errors": 0, "completion_tokens": 0}
+
+    async def first_token_delay():
+        await asyncio.sleep(max(0.0, config.ttft + config.rng.uniform(-config.jitter, config.jitter)))
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(body: Dict):
+        stats["requests"] += 1
+        await first_token_delay()
+        if config.rng.random() < config.error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"message": "injected failure"}}, status_code=config.error_status)
+
+        messages = body.get("messages", [])
+        tokens = _tokens(completion_text(messages, config))
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in messages)
+        stats["completion_tokens"] += len(tokens)
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(interval * len(tokens))
+            return {
+                "id": f"mock-{stats['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            }
+
+        stats["streams"] += 1
+
+        async def events():
+            for token in tokens:
+                yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": token}}]}) + "\n\n"
+                if interval:
+                    await asyncio.sleep(interval)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--ttft-ms", type=float, default=200, help="delay before the first token")
+    parser.add_argument("--jitter-ms", type=float, default=50, help="uniform +/- jitter on that delay")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="generation rate (0 = instant)")
+    parser.add_argument("--answer-tokens", type=int, default=120, help="length of prose answers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.ttft_ms, args.jitter_ms, args.tokens_per_second, args.answer_tokens,
+                        args.error_rate, args.error_status, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""
+Small in-process caches used by the backend.
+
+``TTLCache`` is a bounded LRU cache whose entries also expire after a TTL. It
+keeps hit/miss counters and can optionally write through to a SQLite file so
+entries survive restarts and are shared by every worker on the host. The file
+is pruned of expired rows and capped at ``maxsize`` rows; async callers use
+``aget``/``aset`` so SQLite I/O runs in a worker thread, off the event loop.
+
+``SemanticCache`` is keyed on embeddings instead of exact strings, so
+near-duplicate questions share one cached answer. Entries are tagged with a
+namespace (the KB index key) and only match lookups in the same namespace.
+
+``SingleFlight`` coalesces concurrent identical requests: while a call for a
+key is in flight, later callers wait for it and share its result instead of
+issuing their own upstream request.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+class TTLCache:
+    """Bounded LRU cache with per-entry expiry and optional SQLite backing store."""
+
+    PRUNE_EVERY = 100  # writes between prunes of the backing store
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, persist_path: Optional[str] = None,
+                 name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()  # guards the in-memory dict only, never held across SQLite calls
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        if persist_path:
+            self._open_store(persist_path)
+
+    def _open_store(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} "
+            f"(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, stored REAL NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute(f"PRAGMA table_info({self.name})")}
+        if "stored" not in columns:  # stores created before rows were capped
+            self._db.execute(f"ALTER TABLE {self.name} ADD COLUMN stored REAL NOT NULL DEFAULT 0")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.name}_stored ON {self.name} (stored)")
+        self._prune_store()
+
+    def _prune_store(self):
+        """Delete expired rows and the oldest rows beyond `maxsize` (call with the store lock held or at open)."""
+        self._db.execute(f"DELETE FROM {self.name} WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+        self._db.execute(
+            f"DELETE FROM {self.name} WHERE key IN "
+            f"(SELECT key FROM {self.name} ORDER BY stored DESC LIMIT -1 OFFSET ?)", (self.maxsize,)
+        )
+
+    def _expiry(self) -> Optional[float]:
+        return time.time() + self.ttl if self.ttl else None
+
+    _MISSING = object()
+
+    def _get_memory(self, key: str, now: float) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+        return self._MISSING
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = time.time()
+        value = self._get_memory(key, now)
+        if value is not self._MISSING:
+            return value
+
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    f"SELECT value, expires FROM {self.name} WHERE key = ?", (key,)
+                ).fetchone()
+            if row and (row[1] is None or row[1] > now):
+                value = json.loads(row[0])
+                with self._lock:
+                    self._store_locked(key, value, row[1])
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key: str, value: Any):
+        expires = self._expiry()
+        with self._lock:
+            self._store_locked(key, value, expires)
+        if self._db is not None:
+            encoded = json.dumps(value)
+            with self._db_lock:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, expires, stored) VALUES (?, ?, ?, ?)",
+                    (key, encoded, expires, time.time())
+                )
+                self._writes += 1
+                if self._writes % self.PRUNE_EVERY == 0:
+                    self._prune_store()
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        """`get` for async callers: memory hits return inline, SQLite lookups run in a worker thread."""
+        if self._db is None:
+            return self.get(key, default)
+        value = self._get_memory(key, time.time())
+        if value is not self._MISSING:
+            return value
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def aset(self, key: str, value: Any):
+        """`set` for async callers: the SQLite write runs in a worker thread."""
+        if self._db is None:
+            self.set(key, value)
+        else:
+            await asyncio.to_thread(self.set, key, value)
+
+    def _store_locked(self, key: str, value: Any, expires: Optional[float]):
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(f"DELETE FROM {self.name}")
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "persistent": self._db is not None
+        }
+
+
+class SemanticCache:
+    """
+    Nearest-neighbour cache keyed on L2-normalized embeddings.
+
+    A lookup is a single matrix-vector product against every cached key; the
+    best match is a hit when its cosine similarity reaches `threshold`. Entries
+    belong to a `namespace` (e.g. the KB index key) and are only returned for
+    lookups in that namespace, so an answer is never served from a knowledge
+    base it did not come from. A KB reload therefore doesn't clear the cache:
+    entries of other namespaces stop matching and are the first slots reused
+    (then expire), and switching back to an earlier index finds its answers
+    again. Otherwise slots are reused LRU-first once the cache is full.
+    """
+
+    def __init__(self, maxsize: int = 2000, ttl: Optional[float] = None, threshold: float = 0.93,
+                 name: str = "semantic"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.name = name
+        self.namespace: Optional[str] = None  # most recently used, for stats
+        self.hits = 0
+        self.misses = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._values: List[Any] = [None] * maxsize
+        self._expires = np.full(maxsize, np.inf)
+        self._accessed = np.zeros(maxsize)
+        self._used = np.zeros(maxsize, dtype=bool)
+        self._namespaces = np.full(maxsize, None, dtype=object)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _valid_locked(self, now: float, namespace: Optional[str] = None) -> np.ndarray:
+        """Live slots; with `namespace`, only those belonging to it."""
+        valid = self._used & (self._expires > now)
+        return valid if namespace is None else valid & (self._namespaces == namespace)
+
+    def get(self, embedding, namespace: Optional[str] = None) -> Any:
+        query = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self.namespace = namespace
+            valid = self._valid_locked(now, namespace)
+            if self._vectors is None or not valid.any():
+                self.misses += 1
+                return None
+
+            scores = self._vectors @ query
+            scores[~valid] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self._accessed[best] = now
+            self.hits += 1
+            return self._values[best]
+
+    def set(self, embedding, value: Any, namespace: Optional[str] = None):
+        vector = self._normalize(embedding)
+        now = time.time()
+        with self._lock:
+            self.namespace = namespace
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.maxsize, vector.shape[0]), dtype=np.float32)
+                self._used[:] = False
+
+            # Free or expired slots first, then entries of other namespaces, then LRU
+            free = np.flatnonzero(~self._valid_locked(now))
+            if not len(free):
+                free = np.flatnonzero(self._namespaces != namespace)
+            slot = int(free[0]) if len(free) else int(np.argmin(self._accessed))
+            self._vectors[slot] = vector
+            self._values[slot] = value
+            self._expires[slot] = now + self.ttl if self.ttl else np.inf
+            self._accessed[slot] = now
+            self._used[slot] = True
+            self._namespaces[slot] = namespace
+
+    def _clear_locked(self):
+        self._used[:] = False
+        self._values = [None] * self.maxsize
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def __len__(self):
+        return int(self._valid_locked(time.time()).sum())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "threshold": self.threshold,
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its outcome."""
+
+    def __init__(self, name: str = "flights"):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return the result of ``fn()``, or of the call already in flight for `key`.
+
+        Exceptions are shared the same way. The call itself is shielded, so a
+        caller that is cancelled (e.g. its client disconnected) does not abort
+        it for the others.
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every waiter was cancelled
+
+    def __len__(self):
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "saved": self.calls - self.executions,
+            "in_flight": len(self._inflight)
+        }
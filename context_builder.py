@@ -0,0 +1,142 @@
+"""
+Token-budgeted context assembly for /ask.
+
+Retrieved chunks overlap by design (consecutive chunks of a section share up
+to ``CHUNK_OVERLAP_TOKENS`` tokens) and the same passage often appears in more
+than one document. Joining the top hits verbatim therefore repeats text in the
+prompt. ``assemble_context``:
+
+1. merges hits from the same document whose character spans overlap or touch
+   back into one contiguous passage,
+2. drops passages that are near-duplicates of a more relevant one, and
+3. adds passages by relevance until ``CONTEXT_TOKEN_BUDGET`` is used up.
+
+It also reports how many prompt tokens that saved compared with the plain
+``"\\n".join`` of the hits.
+
+``extractive_answer`` is the LLM-free fallback for the same hits: the
+sentences sharing the most terms with the question, in reading order.
+"""
+import math
+import os
+import re
+from typing import Dict, List
+
+from ingest import count_tokens, iter_sentences, truncate_tokens
+from retrieval import lexical_tokens
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "512"))
+# Passages sharing at least this fraction of the smaller one's words are duplicates
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Spans separated by at most this many characters (whitespace between sentences) are merged
+ADJACENT_GAP_CHARS = 2
+EXTRACTIVE_MAX_SENTENCES = int(os.getenv("EXTRACTIVE_MAX_SENTENCES", "2"))
+EXTRACTIVE_MAX_TOKENS = int(os.getenv("EXTRACTIVE_MAX_TOKENS", "96"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def merge_spans(hits: List[Dict]) -> List[Dict]:
+    """
+    Merge hits ({text, doc, start, end, score, ...}) of the same document whose
+    spans overlap or are adjacent. Each passage keeps the best score of its hits.
+    """
+    passages = []
+    by_doc: Dict[str, List[Dict]] = {}
+    for hit in hits:
+        by_doc.setdefault(hit["doc"], []).append(hit)
+
+    for doc_hits in by_doc.values():
+        current = None
+        for hit in sorted(doc_hits, key=lambda h: (h["start"], h["end"])):
+            if current is not None and hit["start"] <= current["end"] + ADJACENT_GAP_CHARS:
+                if hit["end"] > current["end"]:
+                    if hit["start"] < current["end"]:
+                        current["text"] += hit["text"][current["end"] - hit["start"]:]
+                    else:
+                        current["text"] += " " + hit["text"]
+                    current["end"] = hit["end"]
+                current["score"] = max(current["score"], hit["score"])
+                current["hits"] += 1
+                continue
+            if current is not None:
+                passages.append(current)
+            current = {"doc": hit["doc"], "section": hit.get("section", ""), "start": hit["start"],
+                       "end": hit["end"], "text": hit["text"], "score": hit["score"], "hits": 1}
+        passages.append(current)
+
+    passages.sort(key=lambda p: p["score"], reverse=True)
+    return passages
+
+
+def _is_near_duplicate(words: set, kept: List[set], threshold: float) -> bool:
+    for other in kept:
+        smaller = min(len(words), len(other))
+        if smaller and len(words & other) / smaller >= threshold:
+            return True
+    return False
+
+
+def assemble_context(hits: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET,
+                     dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD) -> Dict:
+    """
+    Build the prompt context for `hits` (best first).
+
+    Returns a dict with ``text`` (passages joined by blank lines), ``passages``,
+    ``tokens`` and ``tokens_saved`` versus joining the raw hit texts.
+    """
+    naive_tokens = count_tokens("\n".join(hit["text"] for hit in hits))
+
+    selected, kept_words = [], []
+    used = 0
+    for passage in merge_spans(hits):
+        words = set(_WORD_RE.findall(passage["text"].lower()))
+        if _is_near_duplicate(words, kept_words, dedup_threshold):
+            continue
+        tokens = count_tokens(passage["text"])
+        if used + tokens > token_budget:
+            # Always keep (part of) the most relevant passage; otherwise try smaller ones
+            if selected:
+                continue
+            passage["text"] = truncate_tokens(passage["text"], token_budget)
+            tokens = count_tokens(passage["text"])
+        selected.append(passage)
+        kept_words.append(words)
+        used += tokens
+
+    text = "\n\n".join(passage["text"] for passage in selected)
+    tokens = count_tokens(text)
+    return {
+        "text": text,
+        "passages": selected,
+        "tokens": tokens,
+        "tokens_saved": max(naive_tokens - tokens, 0),
+    }
+
+
+def extractive_answer(question: str, hits: List[Dict], max_sentences: int = EXTRACTIVE_MAX_SENTENCES,
+                      max_tokens: int = EXTRACTIVE_MAX_TOKENS) -> str:
+    """
+    Answer from the hits themselves: the `max_sentences` sentences that share the
+    most question terms (favouring the more relevant passages), in reading order.
+    Falls back to the start of the best passage when no sentence matches.
+    """
+    passages = merge_spans(hits)
+    if not passages:
+        return ""
+    terms = set(lexical_tokens(question))
+    sentences = []  # (score, passage rank, position, text)
+    for rank, passage in enumerate(passages):
+        for position, match in enumerate(iter_sentences(passage["text"])):
+            tokens = lexical_tokens(match.group())
+            if not tokens:
+                continue
+            overlap = len(terms.intersection(tokens))
+            score = overlap / math.sqrt(len(tokens)) / (1.0 + 0.25 * rank)
+            sentences.append((score, rank, position, match.group().strip()))
+
+    best = sorted((s for s in sentences if s[0] > 0), key=lambda s: -s[0])[:max_sentences]
+    if not best:
+        return truncate_tokens(passages[0]["text"].strip(), max_tokens)
+    text = " ".join(sentence for _, _, _, sentence in sorted(best, key=lambda s: (s[1], s[2])))
+    return truncate_tokens(text, max_tokens)
@@ -0,0 +1,286 @@
+"""
+Pluggable, lazily loaded sentence embedding backends.
+
+``EMBEDDING_BACKEND`` selects the implementation:
+
+- ``torch`` (default): ``sentence_transformers.SentenceTransformer``.
+- ``onnx``: the same model exported to ONNX and run with ONNX Runtime, int8
+  dynamically quantized by default. It needs only ``onnxruntime`` and
+  ``tokenizers`` at runtime (no torch), loads in a fraction of the time and
+  holds far less memory. Export it once, on a machine with torch installed:
+
+      python embedding_backends.py export
+
+  The export checks the quantized vectors against the torch model and fails
+  if their cosine similarity drops below ``--min-cosine``. The runtime and
+  export dependencies are pinned in ``requirements-onnx.txt``.
+
+Vectors from different backends only agree within that tolerance, so each
+backend variant (``torch``, ``onnx-int8``, ``onnx-fp32``; see
+``embedding_variant``) is part of the KB index key: queries are always
+searched against vectors produced the same way.
+
+Backends load nothing until the first ``encode`` (or an explicit ``load``),
+so importing the server is cheap and ``backend.py`` can load the model in the
+background after startup. Concurrent first calls wait for a single load.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "paraphrase-MiniLM-L3-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "")  # default: models/<model name>-onnx
+EMBEDDING_ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "1") == "1"
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = runtime default
+
+ONNX_CONFIG_FILE = "embedding_config.json"
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model.int8.onnx"
+
+logger = logging.getLogger(__name__)
+
+
+def onnx_model_dir(model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    return EMBEDDING_ONNX_DIR or os.path.join("models", model_name.replace("/", "__") + "-onnx")
+
+
+class EmbeddingBackend:
+    """Interface shared by the embedding backends; subclasses implement ``_load`` and ``_encode``."""
+
+    name = "base"
+    variant = "base"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> "EmbeddingBackend":
+        """Load the model (once; concurrent callers wait for the same load)."""
+        if self._loaded:
+            return self
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                self._load()
+                self.load_seconds = time.perf_counter() - start
+                self._loaded = True
+                logger.info("Loaded %s embedding model %s in %.2fs", self.name, self.model_name, self.load_seconds)
+        return self
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embeddings of `texts` as a float32 ``(len(texts), dim)`` array."""
+        self.load()
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._encode(list(texts), batch_size)
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def status(self) -> Dict:
+        return {
+            "backend": self.name,
+            "variant": self.variant,
+            "model": self.model_name,
+            "loaded": self._loaded,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None
+        }
+
+
+class TorchBackend(EmbeddingBackend):
+    """``sentence_transformers`` on PyTorch; the reference implementation."""
+
+    name = "torch"
+    variant = "torch"
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(self.model_name)
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class ONNXBackend(EmbeddingBackend):
+    """Exported transformer run by ONNX Runtime, with the model's pooling reimplemented in NumPy."""
+
+    name = "onnx"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, model_dir: Optional[str] = None,
+                 quantized: bool = EMBEDDING_ONNX_QUANTIZED, threads: int = EMBEDDING_THREADS):
+        super().__init__(model_name)
+        self.model_dir = model_dir or onnx_model_dir(model_name)
+        self.quantized = quantized
+        self.variant = embedding_variant(self.name, quantized)
+        self.threads = threads
+
+    def _load(self):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        config_path = os.path.join(self.model_dir, ONNX_CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(
+                f"No exported ONNX model in {self.model_dir}; run `python embedding_backends.py export` first")
+        with open(config_path) as f:
+            self.config = json.load(f)
+        if self.config.get("model") != self.model_name:
+            raise ValueError(f"{self.model_dir} holds {self.config.get('model')}, not {self.model_name}")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = onnxruntime.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if self.quantized else ONNX_MODEL_FILE
+        self.session = onnxruntime.InferenceSession(os.path.join(self.model_dir, model_file), options,
+                                                    providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def _encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        outputs = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+            outputs.append(self._pool(hidden, inputs["attention_mask"]))
+        return np.concatenate(outputs).astype(np.float32)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooling = self.config.get("pooling", "mean")
+        if pooling == "cls":
+            pooled = hidden[:, 0]
+        elif pooling == "max":
+            pooled = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize"):
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+
+def embedding_variant(kind: Optional[str] = None, quantized: bool = EMBEDDING_ONNX_QUANTIZED) -> str:
+    """How vectors are produced: ``torch``, ``onnx-int8`` or ``onnx-fp32``."""
+    kind = (kind or EMBEDDING_BACKEND).lower()
+    if kind == "onnx":
+        return "onnx-int8" if quantized else "onnx-fp32"
+    return kind
+
+
+def create_embedding_backend(kind: Optional[str] = None, model_name: str = EMBEDDING_MODEL_NAME) -> EmbeddingBackend:
+    """Build (without loading) the backend selected by EMBEDDING_BACKEND (``torch`` or ``onnx``)."""
+    kind = (kind or EMBEDDING_BACKEND).lower()
+    if kind == "torch":
+        return TorchBackend(model_name)
+    if kind == "onnx":
+        return ONNXBackend(model_name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{kind}', expected 'torch' or 'onnx'")
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between two embedding matrices."""
+    reference = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    candidate = candidate / np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    return (reference * candidate).sum(axis=1)
+
+
+def export_onnx(model_name: str, out_dir: str, sample_texts: List[str], min_cosine: float = 0.98) -> Dict:
+    """
+    Export `model_name` to ONNX (fp32 plus an int8 dynamically quantized copy)
+    and verify both against the torch model on `sample_texts`.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    reference_model = SentenceTransformer(model_name, device="cpu")
+    transformer = reference_model[0].auto_model.eval()
+    tokenizer = reference_model.tokenizer
+    pooling_module = next((m for m in reference_model if type(m).__name__ == "Pooling"), None)
+    config = {
+        "model": model_name,
+        "max_seq_length": reference_model.max_seq_length,
+        "pooling": pooling_module.get_pooling_mode_str() if pooling_module is not None else "mean",
+        "normalize": any(type(m).__name__ == "Normalize" for m in reference_model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "dim": reference_model.get_sentence_embedding_dimension(),
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer.save_pretrained(out_dir)
+    dummy = tokenizer(["export"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    fp32_path = os.path.join(out_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(dummy[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=14)
+    quantize_dynamic(fp32_path, os.path.join(out_dir, ONNX_QUANTIZED_MODEL_FILE), weight_type=QuantType.QInt8)
+    with open(os.path.join(out_dir, ONNX_CONFIG_FILE), "w") as f:
+        json.dump(config, f, indent=2)
+
+    reference = np.asarray(reference_model.encode(sample_texts), dtype=np.float32)
+    report = {}
+    for quantized in (False, True):
+        backend = ONNXBackend(model_name, model_dir=out_dir, quantized=quantized)
+        similarity = cosine_agreement(reference, backend.encode(sample_texts))
+        report["int8" if quantized else "fp32"] = {"min_cosine": float(similarity.min()),
+                                                   "mean_cosine": float(similarity.mean())}
+    if report["int8"]["min_cosine"] < min_cosine:
+        raise ValueError(f"int8 model deviates from {model_name}: min cosine {report['int8']['min_cosine']:.4f} "
+                         f"< {min_cosine} (serve it with EMBEDDING_ONNX_QUANTIZED=0)")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the embedding model for the ONNX backend.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export to ONNX, quantize to int8 and verify against torch")
+    export.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    export.add_argument("--out", help="output directory (default: EMBEDDING_ONNX_DIR or models/<model>-onnx)")
+    export.add_argument("--min-cosine", type=float, default=0.98,
+                        help="fail if any sample's int8 vector is less similar than this to the torch vector")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    from ingest import embedding_text, load_chunks
+    samples = [embedding_text(chunk) for chunk in load_chunks()[:256]] or ["What are the signs of dehydration?"]
+    out_dir = args.out or onnx_model_dir(args.model)
+    try:
+        report = export_onnx(args.model, out_dir, samples, min_cosine=args.min_cosine)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Exported {args.model} to {out_dir}, checked on {len(samples)} chunks: {json.dumps(report)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Hedged upstream calls under a latency budget.
+
+A slow LLM response usually means that one request landed on a slow replica
+or a congested model, not that every request will be slow. ``hedged`` starts
+the call on the primary model. If it has not answered after ``hedge_after``
+seconds, it sends a duplicate, to the next model in the list if there is one.
+The first successful response wins and the others are cancelled. An attempt
+that fails outright is replaced by the next hedge immediately.
+
+When the overall ``budget`` runs out first, ``BudgetExhausted`` is raised so
+the caller can answer another way (``/ask`` answers extractively). The
+attempts still running are handed over in ``pending`` instead of being
+cancelled, so their result can still be used, e.g. to fill a cache.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import LLM_HEDGES
+
+
+class BudgetExhausted(Exception):
+    """No attempt finished within the budget; `pending` holds the ones still running."""
+
+    def __init__(self, budget: float, pending: List[asyncio.Task]):
+        super().__init__(f"No upstream response within {budget:.1f}s")
+        self.budget = budget
+        self.pending = pending
+
+
+async def hedged(call: Callable[[str], Awaitable], models: List[str], hedge_after: float = 0.0,
+                 max_hedges: int = 0, budget: Optional[float] = None,
+                 may_hedge: Callable[[], bool] = lambda: True) -> Tuple[object, int, str]:
+    """
+    Return ``(result, attempt, model)`` of the first attempt of ``call(model)`` to succeed.
+
+    Attempt 0 uses ``models[0]``; hedge i uses ``models[i % len(models)]``. A
+    hedge is only sent while ``may_hedge()`` is true (e.g. the upstream is not
+    saturated). Raises the last attempt's exception if every attempt failed,
+    or ``BudgetExhausted`` if `budget` seconds pass first.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget if budget else None
+    tasks: Dict[asyncio.Task, int] = {}
+    launched = 0
+    last_error: Optional[BaseException] = None
+    handed_over = False
+
+    def launch():
+        nonlocal launched
+        model = models[launched % len(models)]
+        if launched:
+            LLM_HEDGES.inc(model=model)
+        tasks[asyncio.ensure_future(call(model))] = launched
+        launched += 1
+
+    launch()
+    next_hedge = loop.time() + hedge_after if hedge_after > 0 and max_hedges > 0 else None
+    try:
+        while True:
+            wake = min((t for t in (next_hedge, deadline) if t is not None), default=None)
+            timeout = max(0.0, wake - loop.time()) if wake is not None else None
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt = tasks.pop(task)
+                if task.exception() is None:
+                    return task.result(), attempt, models[attempt % len(models)]
+                last_error = task.exception()
+
+            now = loop.time()
+            if deadline is not None and now >= deadline and tasks:
+                handed_over = True
+                raise BudgetExhausted(budget, list(tasks))
+            hedges_left = launched <= max_hedges
+            if hedges_left and (not tasks or (next_hedge is not None and now >= next_hedge)) and may_hedge():
+                launch()
+                next_hedge = now + hedge_after if hedge_after > 0 and launched <= max_hedges else None
+            elif next_hedge is not None and now >= next_hedge:
+                next_hedge = now + hedge_after if hedges_left else None  # saturated: check again later
+            if not tasks:
+                raise last_error
+    finally:
+        if not handed_over:
+            for task in tasks:
+                task.cancel()
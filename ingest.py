@@ -0,0 +1,179 @@
+"""
+Knowledge base ingestion: document discovery and structure-aware chunking.
+
+Documents (``.txt``/``.md``) are streamed one at a time from ``KB_SOURCE_DIR``.
+Each document is split into sections at heading lines, sections into
+sentences, and sentences are packed into chunks of at most
+``CHUNK_MAX_TOKENS`` tokens. Chunks never cut through a sentence or cross a
+heading, and consecutive chunks of a section share up to
+``CHUNK_OVERLAP_TOKENS`` tokens of trailing sentences.
+
+Every chunk is a record holding its document, section, character span and a
+content hash of the text that gets embedded. ``kb_index`` uses the hashes to
+re-embed only new or changed chunks when the knowledge base is rebuilt.
+"""
+import hashlib
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+KB_SOURCE_DIR = os.getenv("KB_SOURCE_DIR", "data")
+KB_EXTENSIONS = (".txt", ".md")
+# Generated artefacts (e.g. an index from older builds) that are not knowledge base documents
+KB_SKIP_DIRS = {"index", "cache"}
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "128"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "24"))
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+# A sentence ends at . ! or ? followed by whitespace, or at the end of the line
+_SENTENCE_RE = re.compile(r"\S.*?(?:[.!?](?=\s)|$)", re.M)
+_HEADING_RE = re.compile(
+    r"^\s*(?:"
+    r"#{1,6}\s+\S.*"                              # Markdown heading
+    r"|\d+(?:\.\d+)*[.)]?\s+[A-Z][^.!?]{0,80}"    # Numbered heading, e.g. "2.1 Fluid Balance"
+    r"|[A-Z][A-Z0-9 /&(),'-]{2,80}:?"             # ALL CAPS heading
+    r")\s*$"
+)
+
+
+def count_tokens(text: str) -> int:
+    """Approximate model tokens: words and punctuation marks."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut `text` after its first `max_tokens` tokens (as counted by ``count_tokens``)."""
+    for i, match in enumerate(_TOKEN_RE.finditer(text)):
+        if i == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+
+def iter_sentences(text: str, start: int = 0, end: Optional[int] = None) -> Iterator[re.Match]:
+    """Sentence matches in ``text[start:end]``; ``match.start()``/``end()`` index into `text`."""
+    return _SENTENCE_RE.finditer(text, start, len(text) if end is None else end)
+
+
+def iter_documents(source: str = KB_SOURCE_DIR) -> Iterator[Tuple[str, str]]:
+    """Yield (relative path, text) for each KB document, reading one file at a time."""
+    if os.path.isfile(source):
+        with open(source, "r", encoding="utf-8") as f:
+            yield os.path.basename(source), f.read()
+        return
+
+    for root, dirs, files in os.walk(source):
+        dirs[:] = sorted(d for d in dirs if d not in KB_SKIP_DIRS and not d.startswith("."))
+        for name in sorted(files):
+            if not name.endswith(KB_EXTENSIONS) or name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "r", encoding="utf-8") as f:
+                yield os.path.relpath(path, source).replace(os.sep, "/"), f.read()
+
+
+def source_signature(source: str = KB_SOURCE_DIR) -> Tuple:
+    """Cheap change detector: (path, size, mtime) of every KB document."""
+    paths = [source] if os.path.isfile(source) else [
+        os.path.join(root, name)
+        for root, dirs, files in os.walk(source)
+        if not set(os.path.relpath(root, source).split(os.sep)) & KB_SKIP_DIRS
+        for name in files if name.endswith(KB_EXTENSIONS)
+    ]
+    signature = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        signature.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def _sections(text: str) -> Iterator[Tuple[str, int, int]]:
+    """Yield (heading, start, end) for each run of text between heading lines."""
+    heading, start = "", 0
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if _HEADING_RE.match(line):
+            if text[start:offset].strip():
+                yield heading, start, offset
+            heading = line.strip().lstrip("#").strip().rstrip(":")
+            start = offset + len(line)
+        offset += len(line)
+    if text[start:].strip():
+        yield heading, start, len(text)
+
+
+def _sentences(text: str, start: int, end: int, max_tokens: int) -> List[Tuple[int, int, int]]:
+    """(start, end, tokens) spans of the sentences in text[start:end]; over-long ones are split at words."""
+    spans = []
+    for match in iter_sentences(text, start, end):
+        s, e = match.start(), match.end()
+        tokens = count_tokens(text[s:e])
+        if tokens <= max_tokens:
+            spans.append((s, e, tokens))
+            continue
+        piece_start, piece_tokens, piece_end = s, 0, s
+        for word in re.finditer(r"\S+", text[s:e]):
+            word_tokens = count_tokens(word.group())
+            if piece_tokens and piece_tokens + word_tokens > max_tokens:
+                spans.append((piece_start, piece_end, piece_tokens))
+                piece_start, piece_tokens = s + word.start(), 0
+            piece_tokens += word_tokens
+            piece_end = s + word.end()
+        spans.append((piece_start, piece_end, piece_tokens))
+    return spans
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Dict]:
+    """
+    Split `text` into sentence-aligned chunks of at most `max_tokens` tokens.
+
+    Returns dicts with ``section``, ``start``, ``end`` (character span into
+    `text`) and ``text``.
+    """
+    chunks = []
+    for heading, section_start, section_end in _sections(text):
+        sentences = _sentences(text, section_start, section_end, max_tokens)
+        i = 0
+        while i < len(sentences):
+            j, tokens = i, 0
+            while j < len(sentences) and (j == i or tokens + sentences[j][2] <= max_tokens):
+                tokens += sentences[j][2]
+                j += 1
+
+            start, end = sentences[i][0], sentences[j - 1][1]
+            chunks.append({"section": heading, "start": start, "end": end, "text": text[start:end]})
+            if j >= len(sentences):
+                break
+
+            # Step back over trailing sentences to carry them into the next chunk
+            k, overlap = j, 0
+            while k - 1 > i and overlap + sentences[k - 1][2] <= overlap_tokens:
+                overlap += sentences[k - 1][2]
+                k -= 1
+            i = k
+    return chunks
+
+
+def embedding_text(chunk: Dict) -> str:
+    """Text that is embedded for a chunk: its section heading plus the chunk text."""
+    section = chunk.get("section")
+    return f"{section}\n{chunk['text']}" if section else chunk["text"]
+
+
+def chunk_hash(chunk: Dict) -> str:
+    return hashlib.sha1(embedding_text(chunk).encode("utf-8")).hexdigest()
+
+
+def iter_chunks(source: str = KB_SOURCE_DIR, max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict]:
+    """Stream chunk records for every document under `source`."""
+    for doc, text in iter_documents(source):
+        for chunk in chunk_text(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens):
+            chunk["doc"] = doc
+            chunk["hash"] = chunk_hash(chunk)
+            yield chunk
+
+
+def load_chunks(source: Optional[str] = None) -> List[Dict]:
+    return list(iter_chunks(source or KB_SOURCE_DIR))
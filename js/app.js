@@ -7,6 +7,7 @@ const BASE_API_URL = isLocalDevelopment
 const BACKEND_URL_FINAL = `${BASE_API_URL}/ask`;
 const QUIZ_URL_FINAL = `${BASE_API_URL}/quiz`;
 const QUIZ_EVAL_URL_FINAL = `${BASE_API_URL}/quiz/evaluate`;
+const QUIZ_EXPLANATIONS_URL_FINAL = `${BASE_API_URL}/quiz/explanations`;
 const SUGGEST_URL_FINAL = `${BASE_API_URL}/suggest`;
 
 console.log(`[CONFIG] Using API base URL: ${BASE_API_URL}`);
@@ -899,6 +900,7 @@ function switchSession(group, chat, index) {
     
     const userResponses = currentQuiz.map((q, i) => ({
       question: q.question,
+      question_id: q.id || null,
       answer: quizAnswers[i] || ''
     }));
     
@@ -908,16 +910,18 @@ function switchSession(group, chat, index) {
     console.log('[DEBUG] User responses:', userResponses);
     
     try {
+      const evalSessionId = currentQuizSessionId || `quiz-${Date.now()}`;
       const result = await fetch(QUIZ_EVAL_URL_FINAL, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ 
-          session_id: currentQuizSessionId || `quiz-${Date.now()}`,
+          session_id: evalSessionId,
           responses: userResponses
         })
       });
       
       const feedback = await result.json();
+      const pendingExplanations = {};
       let score = 0;
       
       feedback.forEach((item, i) => {
@@ -940,7 +944,12 @@ function switchSession(group, chat, index) {
         
         if (item.correct) score++;
         if (!item.correct) {
-          explanation.innerHTML = `❌ <strong>Explanation:</strong> ${item.explanation || 'Refer to nursing guide for details.'}`;
+          if (item.explanation_pending) {
+            explanation.innerHTML = `❌ <strong>Explanation:</strong> <em>Loading explanation...</em>`;
+            pendingExplanations[i] = explanation;
+          } else {
+            explanation.innerHTML = `❌ <strong>Explanation:</strong> ${item.explanation || 'Refer to nursing guide for details.'}`;
+          }
           block.appendChild(explanation);
         }
       });
@@ -960,12 +969,47 @@ function switchSession(group, chat, index) {
       const topic = localStorage.getItem('kkh-quiz-topic-' + activeSessionId) || 'General';
       appendGroupedMessage('bot', `✅ You scored ${score} out of ${currentQuiz.length} on the ${topic} quiz!`);
       
+      // Scores are shown; fill in the explanations still being generated
+      if (Object.keys(pendingExplanations).length > 0) {
+        pollQuizExplanations(evalSessionId, feedback, pendingExplanations, activeSessionId);
+      }
+      
     } catch (error) {
       console.error('Error submitting quiz:', error);
       appendGroupedMessage('bot', '❌ Failed to submit quiz. Please try again.');
     }
   }
   
+  // Poll for explanations generated after the scores were returned
+  async function pollQuizExplanations(evalSessionId, feedback, pendingExplanations, chatSessionId, attempt = 0) {
+    const maxAttempts = 30;
+    try {
+      const res = await fetch(`${QUIZ_EXPLANATIONS_URL_FINAL}?session_id=${encodeURIComponent(evalSessionId)}`);
+      if (res.ok) {
+        const data = await res.json();
+        if (!data.pending) {
+          Object.entries(pendingExplanations).forEach(([i, element]) => {
+            const text = (data.explanations || {})[i] || 'Refer to nursing guide for details.';
+            element.innerHTML = `❌ <strong>Explanation:</strong> ${text}`;
+            feedback[i].explanation = text;
+            delete feedback[i].explanation_pending;
+          });
+          localStorage.setItem('kkh-quiz-feedback-' + chatSessionId, JSON.stringify(feedback));
+          return;
+        }
+      }
+    } catch (error) {
+      console.error('Error fetching quiz explanations:', error);
+    }
+    if (attempt + 1 < maxAttempts) {
+      setTimeout(() => pollQuizExplanations(evalSessionId, feedback, pendingExplanations, chatSessionId, attempt + 1), 1000);
+    } else {
+      Object.values(pendingExplanations).forEach(element => {
+        element.innerHTML = `❌ <strong>Explanation:</strong> Refer to nursing guide for details.`;
+      });
+    }
+  }
+  
   // Global event listeners for quiz action buttons using event delegation
   document.addEventListener('click', (e) => {
     // Event delegation for other dynamic buttons can be added here if needed
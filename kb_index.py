@@ -0,0 +1,286 @@
+"""
+Prebuilt, memory-mapped embedding index for the nursing knowledge base.
+
+The index is a directory holding a chunk table (``chunks.json``: one record per
+chunk with its document, section, character span, text and content hash), an
+embedding matrix (``embeddings.npy``) and a small ``meta.json``. It is keyed by
+a hash of the chunk table together with the embedding model name and backend
+variant (torch, onnx-int8, onnx-fp32), so a changed guide, model or backend
+never reuses a stale index. ``CURRENT`` names the most recently
+published index.
+
+Build it once (e.g. during the Docker build) with:
+
+    python kb_index.py build
+
+Rebuilds are incremental: vectors of chunks whose content hash already exists
+in the current index are copied over and only new or changed chunks are
+encoded.
+
+At startup ``backend.py`` loads the matrix with ``numpy.load(mmap_mode="r")``,
+which returns a read-only ``numpy.memmap``. Loading takes milliseconds and all
+uvicorn workers share the same page-cache pages instead of each holding a
+private copy of the embeddings. Searching is left to ``retrieval.py``; with
+``RETRIEVER=ivf|hnsw`` the build also saves the IVF centroids or HNSW graph
+into the index directory so workers load them instead of rebuilding.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_backends import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, create_embedding_backend, embedding_variant
+from ingest import CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, KB_SOURCE_DIR, embedding_text, load_chunks
+from retrieval import RETRIEVER, create_retriever, normalize_rows
+
+# Outside data/, which is served publicly at /data
+INDEX_DIR = os.getenv("KB_INDEX_DIR", os.path.join("cache", "index"))
+INDEX_DTYPE = os.getenv("KB_INDEX_DTYPE", "float32")
+
+SUPPORTED_DTYPES = ("float32", "float16")
+CURRENT_FILE = "CURRENT"
+
+logger = logging.getLogger(__name__)
+
+
+def index_key(records: List[Dict], model_name: str, variant: str) -> str:
+    """Content hash identifying an index built from `records` with `model_name` on backend `variant`."""
+    digest = hashlib.sha256()
+    digest.update(f"{model_name}|{variant}".encode("utf-8"))
+    digest.update(f"|{CHUNK_MAX_TOKENS}|{CHUNK_OVERLAP_TOKENS}|".encode("utf-8"))
+    for record in records:
+        digest.update(f"{record['doc']}|{record['start']}|{record['end']}|{record['hash']}\n".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class KnowledgeBaseIndex:
+    """Chunk records plus an L2-normalized embedding matrix (possibly memory-mapped)."""
+
+    def __init__(self, key: str, records: List[Dict], embeddings: np.ndarray, meta: Dict,
+                 path: Optional[str] = None):
+        self.key = key
+        self.path = path  # directory it was loaded from, None while only in memory
+        self.records = records
+        self.chunks = [record["text"] for record in records]
+        self.embeddings = embeddings
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.records)
+
+
+def _index_path(key: str, index_dir: str) -> str:
+    return os.path.join(index_dir, key)
+
+
+def save_index(index: KnowledgeBaseIndex, index_dir: str = INDEX_DIR) -> str:
+    """
+    Write `index` to ``<index_dir>/<key>/`` and point ``CURRENT`` at it.
+
+    Files are written to a temporary directory first and renamed into place, so
+    concurrent workers never observe a half-written index.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    final_path = _index_path(index.key, index_dir)
+    if not os.path.isdir(final_path):
+        tmp_path = tempfile.mkdtemp(prefix=f".{index.key}-", dir=index_dir)
+        try:
+            with open(os.path.join(tmp_path, "chunks.json"), "w", encoding="utf-8") as f:
+                json.dump(index.records, f, ensure_ascii=False)
+            np.save(os.path.join(tmp_path, "embeddings.npy"), np.ascontiguousarray(index.embeddings))
+            with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(index.meta, f, indent=2)
+            os.rename(tmp_path, final_path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            # Another worker may have won the race to publish the same index.
+            if not os.path.isdir(final_path):
+                raise
+
+    fd, tmp_current = tempfile.mkstemp(prefix=".current-", dir=index_dir)
+    with os.fdopen(fd, "w") as f:
+        f.write(index.key)
+    os.replace(tmp_current, os.path.join(index_dir, CURRENT_FILE))
+    return final_path
+
+
+def load_index(key: str, index_dir: str = INDEX_DIR) -> Optional[KnowledgeBaseIndex]:
+    """Load a prebuilt index with a memory-mapped embedding matrix, or None if absent."""
+    path = _index_path(key, index_dir)
+    if not os.path.isdir(path):
+        return None
+
+    with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "chunks.json"), "r", encoding="utf-8") as f:
+        records = json.load(f)
+    embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+
+    if embeddings.shape[0] != len(records):
+        raise ValueError(f"Corrupt KB index at {path}: {len(records)} chunks but {embeddings.shape[0]} vectors")
+    return KnowledgeBaseIndex(key, records, embeddings, meta, path=path)
+
+
+def load_current_index(index_dir: str = INDEX_DIR) -> Optional[KnowledgeBaseIndex]:
+    """Load the index named by ``CURRENT``, if any."""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), "r") as f:
+            key = f.read().strip()
+    except OSError:
+        return None
+    try:
+        return load_index(key, index_dir)
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable KB index %s: %s", key, e)
+        return None
+
+
+def build_index(records: List[Dict], model, model_name: str = EMBEDDING_MODEL_NAME, dtype: str = INDEX_DTYPE,
+                previous: Optional[KnowledgeBaseIndex] = None, variant: Optional[str] = None) -> KnowledgeBaseIndex:
+    """
+    Embed `records` with `model` into an in-memory index.
+
+    Vectors for chunks whose content hash appears in `previous` (built with the
+    same model and backend variant) are reused; only the remaining chunks are
+    encoded. `variant` defaults to the model's own (or EMBEDDING_BACKEND's).
+    """
+    variant = variant or getattr(model, "variant", None) or embedding_variant()
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported index dtype '{dtype}', expected one of {SUPPORTED_DTYPES}")
+
+    reusable: Dict[str, int] = {}
+    if (previous is not None and previous.meta.get("model") == model_name
+            and previous.meta.get("embedding_variant") == variant):
+        reusable = {record["hash"]: row for row, record in enumerate(previous.records)}
+
+    missing = [i for i, record in enumerate(records) if record["hash"] not in reusable]
+    reused = [i for i, record in enumerate(records) if record["hash"] in reusable]
+
+    encoded = None
+    if missing:
+        encoded = np.asarray(model.encode([embedding_text(records[i]) for i in missing]), dtype=np.float32)
+        encoded = normalize_rows(encoded.reshape(len(missing), -1))
+    dim = encoded.shape[1] if encoded is not None else (previous.embeddings.shape[1] if reused else 0)
+
+    vectors = np.zeros((len(records), dim), dtype=dtype)
+    if missing:
+        vectors[missing] = encoded
+    if reused:
+        vectors[reused] = previous.embeddings[[reusable[records[i]["hash"]] for i in reused]]
+
+    key = index_key(records, model_name, variant)
+    meta = {
+        "key": key,
+        "model": model_name,
+        "embedding_variant": variant,
+        "dtype": dtype,
+        "dim": int(vectors.shape[1]),
+        "count": len(records),
+        "documents": len({record["doc"] for record in records}),
+        "chunk_max_tokens": CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "encoded": len(missing),
+        "reused": len(reused),
+        "created": time.time(),
+    }
+    return KnowledgeBaseIndex(key, records, vectors, meta)
+
+
+def load_or_build_index(model_loader, records: Optional[List[Dict]] = None, model_name: str = EMBEDDING_MODEL_NAME,
+                        index_dir: str = INDEX_DIR, dtype: str = INDEX_DTYPE,
+                        previous: Optional[KnowledgeBaseIndex] = None,
+                        variant: Optional[str] = None) -> KnowledgeBaseIndex:
+    """
+    Return the prebuilt index for the current knowledge base, building it if missing.
+
+    `model_loader` is a zero-argument callable returning the embedding model; it
+    is only called when chunks have to be (re)embedded. Unchanged chunks reuse
+    vectors from `previous`, or from the ``CURRENT`` index on disk. `variant`
+    (default: EMBEDDING_BACKEND's) must match how query vectors are produced.
+    """
+    if records is None:
+        records = load_chunks()
+    variant = variant or embedding_variant()
+    key = index_key(records, model_name, variant)
+
+    index = load_index(key, index_dir)
+    if index is not None:
+        return index
+
+    if previous is None:
+        previous = load_current_index(index_dir)
+    logger.warning("No prebuilt KB index for key %s, building it now (run `python kb_index.py build` ahead of time)", key)
+    index = build_index(records, model_loader(), model_name=model_name, dtype=dtype, previous=previous,
+                        variant=variant)
+    logger.info("KB index %s: %d chunks encoded, %d reused", key, index.meta["encoded"], index.meta["reused"])
+    try:
+        save_index(index, index_dir)
+        return load_index(key, index_dir) or index
+    except OSError as e:
+        logger.warning("Could not persist KB index to %s: %s", index_dir, e)
+        return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the prebuilt KB embedding index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="chunk and embed the knowledge base (incrementally)")
+    build.add_argument("--source", default=KB_SOURCE_DIR, help="knowledge base directory or file")
+    build.add_argument("--index-dir", default=INDEX_DIR)
+    build.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    build.add_argument("--dtype", default=INDEX_DTYPE, choices=SUPPORTED_DTYPES)
+    build.add_argument("--backend", default=EMBEDDING_BACKEND, choices=("torch", "onnx"))
+    build.add_argument("--retriever", default=RETRIEVER, choices=("exact", "ivf", "hnsw"),
+                       help="also build and save the ANN structure for this retriever")
+
+    info = sub.add_parser("info", help="show the index matching the current knowledge base")
+    info.add_argument("--source", default=KB_SOURCE_DIR)
+    info.add_argument("--index-dir", default=INDEX_DIR)
+    info.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    info.add_argument("--backend", default=EMBEDDING_BACKEND, choices=("torch", "onnx"))
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    records = load_chunks(args.source)
+    key = index_key(records, args.model, embedding_variant(args.backend))
+
+    if args.command == "info":
+        index = load_index(key, args.index_dir)
+        if index is None:
+            print(f"No index for key {key} in {args.index_dir}")
+            return 1
+        print(json.dumps(index.meta, indent=2))
+        return 0
+
+    index = load_index(key, args.index_dir)
+    if index is not None:
+        print(f"Index {key} is already up to date in {args.index_dir}")
+    else:
+        start = time.time()
+        model = create_embedding_backend(args.backend, model_name=args.model)
+        index = build_index(records, model, model_name=args.model, dtype=args.dtype,
+                            previous=load_current_index(args.index_dir))
+        path = save_index(index, args.index_dir)
+        index = load_index(key, args.index_dir)
+        print(f"Built index {key}: {len(index)} chunks from {index.meta['documents']} documents "
+              f"({index.meta['encoded']} encoded, {index.meta['reused']} reused), dtype {args.dtype}, "
+              f"in {time.time() - start:.1f}s -> {path}")
+
+    if args.retriever != "exact":
+        start = time.time()
+        create_retriever(index.embeddings, args.retriever, index_path=index.path)
+        print(f"{args.retriever} index ready in {time.time() - start:.1f}s -> {index.path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
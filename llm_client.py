@@ -0,0 +1,247 @@
+"""
+Async, connection-pooled client for OpenAI-compatible chat completion APIs.
+
+One ``LLMClient`` is shared by the whole process. It keeps a keep-alive
+connection pool (so requests reuse TLS sessions), bounds the number of
+in-flight upstream calls, applies connect/read timeouts, and retries 429/5xx
+responses and connection failures with jittered exponential backoff.
+
+The upstream URL is configurable, so the client can be pointed at a local stub
+server, e.g. ``OPENROUTER_API_URL=http://127.0.0.1:9000/v1/chat/completions``.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+
+from metrics import LLM_LATENCY, LLM_REQUESTS, LLM_TOKENS
+
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "256"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Raised when the upstream LLM API call fails."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMConnectionError(LLMError):
+    pass
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class LLMClient:
+    """Shared async client for an OpenAI-compatible ``/chat/completions`` endpoint."""
+
+    def __init__(self, api_url: str, api_key: str = "",
+                 connect_timeout: float = LLM_CONNECT_TIMEOUT,
+                 read_timeout: float = LLM_READ_TIMEOUT,
+                 max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so the pool binds to the server's running event loop.
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Full-jitter exponential backoff, honouring a numeric Retry-After header."""
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def complete(self, payload: Dict) -> Dict:
+        """POST `payload` and return the decoded JSON body, retrying transient failures."""
+        client = self._get_client()
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    response = await client.post(self.api_url, headers=self._headers(), json=payload)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                LLM_REQUESTS.inc(mode="chat", outcome="connect_error")
+                if attempt >= self.max_retries:
+                    raise LLMConnectionError("Cannot connect to OpenRouter API. Please check your internet connection.") from e
+            except httpx.TimeoutException as e:
+                LLM_REQUESTS.inc(mode="chat", outcome="timeout")
+                raise LLMTimeoutError("OpenRouter API request timed out. Please try again.") from e
+            except httpx.HTTPError as e:
+                LLM_REQUESTS.inc(mode="chat", outcome="error")
+                raise LLMError(f"OpenRouter API request failed: {str(e)}") from e
+            else:
+                LLM_LATENCY.observe(time.perf_counter() - start, mode="chat")
+                LLM_REQUESTS.inc(mode="chat", outcome=str(response.status_code))
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError as e:
+                        raise LLMError("Failed to parse OpenRouter API response") from e
+
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                    raise LLMError(_error_detail(response), status_code=response.status_code)
+                retry_after = response.headers.get("Retry-After")
+
+            delay = self._backoff(attempt, retry_after)
+            logger.warning("OpenRouter call failed (attempt %d), retrying in %.2fs", attempt + 1, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def chat(self, messages: List[Dict[str, str]], model: str,
+                   max_tokens: int = 2000, temperature: float = 0.7) -> str:
+        """Run a chat completion and return the first choice's message content."""
+        result = await self.complete({
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        })
+
+        usage = result.get("usage") or {}
+        for kind in ("prompt", "completion"):
+            if isinstance(usage.get(f"{kind}_tokens"), (int, float)):
+                LLM_TOKENS.inc(usage[f"{kind}_tokens"], type=kind)
+
+        choices = result.get("choices", [])
+        if not choices:
+            raise LLMError("OpenRouter API returned no response choices")
+
+        content = choices[0].get("message", {}).get("content", "")
+        if not content:
+            raise LLMError("OpenRouter API returned empty response")
+        return content
+
+    async def stream_chat(self, messages: List[Dict[str, str]], model: str,
+                          max_tokens: int = 2000, temperature: float = 0.7) -> AsyncIterator[str]:
+        """
+        Stream a chat completion, yielding content deltas as they arrive (SSE).
+
+        Connection failures and 429/5xx responses are retried only before the
+        first token. Closing the generator (e.g. when the downstream client
+        disconnects) closes the upstream response, which stops generation.
+        """
+        client = self._get_client()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self._semaphore:
+                    start = time.perf_counter()
+                    async with client.stream("POST", self.api_url, headers=self._headers(), json=payload) as response:
+                        # Latency of a stream attempt is measured to the response headers (time to first byte)
+                        LLM_LATENCY.observe(time.perf_counter() - start, mode="stream")
+                        LLM_REQUESTS.inc(mode="stream", outcome=str(response.status_code))
+                        if response.status_code == 200:
+                            async for line in response.aiter_lines():
+                                delta = _parse_stream_line(line)
+                                if delta is _STREAM_DONE:
+                                    return
+                                if delta:
+                                    yield delta
+                            return
+
+                        await response.aread()
+                        if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= self.max_retries:
+                            raise LLMError(_error_detail(response), status_code=response.status_code)
+                        retry_after = response.headers.get("Retry-After")
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                LLM_REQUESTS.inc(mode="stream", outcome="connect_error")
+                if attempt >= self.max_retries:
+                    raise LLMConnectionError("Cannot connect to OpenRouter API. Please check your internet connection.") from e
+            except httpx.TimeoutException as e:
+                LLM_REQUESTS.inc(mode="stream", outcome="timeout")
+                raise LLMTimeoutError("OpenRouter API request timed out. Please try again.") from e
+            except httpx.HTTPError as e:
+                LLM_REQUESTS.inc(mode="stream", outcome="error")
+                raise LLMError(f"OpenRouter API request failed: {str(e)}") from e
+
+            delay = self._backoff(attempt, retry_after)
+            logger.warning("OpenRouter stream failed (attempt %d), retrying in %.2fs", attempt + 1, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_STREAM_DONE = object()
+
+
+def _parse_stream_line(line: str):
+    """Return the content delta in one SSE line, ``_STREAM_DONE`` at the end, or None."""
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return _STREAM_DONE
+    try:
+        chunk = json.loads(data)
+    except ValueError:
+        return None
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def _error_detail(response: httpx.Response) -> str:
+    detail = f"OpenRouter API error: {response.status_code}"
+    try:
+        error_data = response.json()
+        if "error" in error_data:
+            detail += f" - {error_data['error'].get('message', 'Unknown error')}"
+    except (ValueError, AttributeError):
+        detail += f" - {response.text[:200]}"
+    return detail
@@ -0,0 +1,253 @@
+"""
+Tolerant, incremental parsing of JSON arrays in LLM output.
+
+Models wrap the requested JSON array in prose or code fences, over-escape
+quotes, leave trailing commas, or get cut off at ``max_tokens``. Rather than
+locating the whole array with a regex and giving up on any defect,
+``JSONArrayStreamParser`` scans the text as it arrives and emits each
+top-level array element as soon as it is complete. Elements that are not
+valid JSON get a light repair attempt and are otherwise skipped on their own,
+so one bad or truncated element never discards the rest. Given an ``accept``
+check, only elements passing it are emitted, and a bracketed aside in the
+prose (``"see [1]"``) that yields none is skipped in favour of a later array.
+
+``iter_quiz_questions`` / ``parse_quiz_questions`` and ``parse_suggestions``
+validate the elements against the quiz question and suggestion schemas.
+"""
+import ast
+import json
+import re
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "‘": "'", "’": "'"})
+_OPTION_KEYS = ("option1", "option2", "option3", "option4")
+# "A", "b)", "C." or "option3" as an answer refers to an option by position
+_ANSWER_REF_RE = re.compile(r"^\s*(?:option\s*([1-4])|([a-d]))\s*[.)]?\s*$", re.I)
+_OPTION_PREFIX_RE = re.compile(r"^\s*[a-d][.)]\s+", re.I)
+
+
+def _load_element(raw: str) -> Any:
+    """Parse one array element, repairing common defects; raises ValueError if hopeless."""
+    try:
+        return json.loads(raw)
+    except ValueError:
+        pass
+    repaired = _TRAILING_COMMA_RE.sub(r"\1", raw.translate(_SMART_QUOTES))
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        pass
+    try:
+        # Python-style literals: single quotes, True/False/None
+        return ast.literal_eval(repaired)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError(f"Unparseable element: {raw[:80]!r}")
+
+
+class JSONArrayStreamParser:
+    """
+    Incrementally extracts the elements of the first JSON array in a text stream
+    that has an element passing `accept` (any parseable element by default).
+
+    If the text contains top-level objects but no array (``{...}{...}``), each
+    object is treated as an element. ``feed`` returns the accepted elements
+    completed by the new text; ``close`` flushes a final unterminated scalar.
+    """
+
+    def __init__(self, accept: Optional[Callable[[Any], bool]] = None):
+        self.accept = accept
+        self.errors = 0
+        self.emitted = 0
+        self.done = False
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._element_start: Optional[int] = None
+        self._element_depth = 1  # depth at which elements live: 1 inside "[...]", 0 without an array
+
+    def feed(self, text: str) -> List[Any]:
+        self._buffer += text
+        elements = []
+        buffer = self._buffer
+        i = self._pos
+        while i < len(buffer) and not self.done:
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == self._element_depth and self._element_start is not None \
+                            and buffer[self._element_start] == '"':
+                        self._emit(buffer[self._element_start:i + 1], elements)
+            elif char == '"':
+                self._in_string = True
+                if self._depth == self._element_depth and self._element_start is None:
+                    self._element_start = i
+            elif char in "[{":
+                if self._depth == 0 and char == "{" and self._element_start is None:
+                    # Bare object(s) before any array
+                    self._element_depth = 0
+                if self._depth == self._element_depth and self._element_start is None and \
+                        not (self._depth == 0 and char == "["):
+                    self._element_start = i
+                self._depth += 1
+            elif char in "]}":
+                if self._depth == 0:
+                    pass  # stray closer in surrounding prose
+                else:
+                    self._depth -= 1
+                    if self._depth == self._element_depth and self._element_start is not None:
+                        self._emit(buffer[self._element_start:i + 1], elements)
+                    elif self._depth < self._element_depth:
+                        # The array closed; flush a trailing scalar such as `"x" ]`
+                        self._flush_scalar(buffer[:i], elements)
+                        # An array without accepted elements (a bracketed aside in prose such
+                        # as "[1]" or "[see below]") is not the one we want: keep scanning
+                        self.done = self.emitted > 0
+            elif char == ",":
+                if self._depth == self._element_depth:
+                    self._flush_scalar(buffer[:i], elements)
+            elif not char.isspace() and self._depth == self._element_depth and self._element_depth == 1 \
+                    and self._element_start is None:
+                self._element_start = i  # number / true / false / null
+            i += 1
+        self._pos = i
+        return elements
+
+    def _emit(self, raw: str, elements: List[Any]):
+        self._element_start = None
+        try:
+            element = _load_element(raw)
+        except ValueError:
+            self.errors += 1
+            return
+        if self.accept is None or self.accept(element):
+            elements.append(element)
+            self.emitted += 1
+
+    def _flush_scalar(self, buffer: str, elements: List[Any]):
+        if self._element_start is not None:
+            raw = buffer[self._element_start:].strip()
+            if raw:
+                self._emit(raw, elements)
+            self._element_start = None
+
+    def close(self) -> List[Any]:
+        """Flush a trailing scalar of a truncated array; unfinished objects are dropped."""
+        elements = []
+        if not self.done and not self._in_string and self._depth == self._element_depth:
+            self._flush_scalar(self._buffer, elements)
+        self.done = True
+        return elements
+
+
+def iter_json_array(text: str, accept: Optional[Callable[[Any], bool]] = None) -> Iterator[Any]:
+    """
+    Elements of the first JSON array in `text` with an element passing `accept`,
+    tolerating prose, fences and truncation.
+    """
+    parser = JSONArrayStreamParser(accept)
+    elements = parser.feed(text) + parser.close()
+    if not elements and '\\"' in text:
+        # Over-escaped output such as [{\"question\": ...}]
+        parser = JSONArrayStreamParser(accept)
+        unescaped = text.replace('\\"', '"')
+        elements = parser.feed(unescaped) + parser.close()
+    return iter(elements)
+
+
+def _normalize_option(text: str) -> str:
+    return re.sub(r"\W+", "", _OPTION_PREFIX_RE.sub("", text)).lower()
+
+
+def validate_question(item: Any) -> Optional[Dict]:
+    """
+    Convert a raw quiz element to ``{"question", "options", "answer"}``, or None if invalid.
+
+    Accepts ``option1``..``option4`` keys or an ``options`` list. The answer must
+    match one of the options by text or refer to one by letter/position.
+    """
+    if not isinstance(item, dict):
+        return None
+    question = item.get("question")
+    if not isinstance(question, str) or not question.strip():
+        return None
+
+    raw_options = item.get("options")
+    if not isinstance(raw_options, list):
+        raw_options = [item[key] for key in _OPTION_KEYS if key in item]
+    options = [str(option).strip() for option in raw_options if str(option).strip()]
+    if len(options) < 2 or len({_normalize_option(option) for option in options}) != len(options):
+        return None
+
+    answer = str(item.get("answer", "")).strip()
+    matched = next((option for option in options if _normalize_option(option) == _normalize_option(answer)), None)
+    if matched is None:
+        ref = _ANSWER_REF_RE.match(answer)
+        if ref:
+            index = int(ref.group(1)) - 1 if ref.group(1) else "abcd".index(ref.group(2).lower())
+            matched = options[index] if index < len(options) else None
+    if matched is None:
+        return None
+
+    return {"question": question.strip(), "options": options, "answer": matched}
+
+
+def _is_quiz_question(item: Any) -> bool:
+    return validate_question(item) is not None
+
+
+def iter_quiz_questions(elements: Iterable[Any]) -> Iterator[Dict]:
+    for element in elements:
+        question = validate_question(element)
+        if question is not None:
+            yield question
+
+
+def parse_quiz_questions(text: str) -> List[Dict]:
+    """All valid quiz questions in a complete LLM response."""
+    return list(iter_quiz_questions(iter_json_array(text, accept=_is_quiz_question)))
+
+
+async def stream_quiz_questions(tokens: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    """Yield each valid quiz question as soon as its JSON object has streamed in."""
+    parser = JSONArrayStreamParser(accept=_is_quiz_question)
+    async for token in tokens:
+        for question in iter_quiz_questions(parser.feed(token)):
+            yield question
+        if parser.done:
+            break
+    for question in iter_quiz_questions(parser.close()):
+        yield question
+
+
+def _suggestion_text(element: Any, max_words: int) -> Optional[str]:
+    if isinstance(element, dict):
+        element = element.get("question")
+    if isinstance(element, str) and element.strip() and len(element.split()) <= max_words:
+        return element.strip()
+    return None
+
+
+def parse_suggestions(text: str, limit: int = 3, max_words: int = 30) -> List[str]:
+    """
+    Non-empty suggestion strings from a JSON array of strings (or of {"question": ...} objects).
+
+    The first array holding actual questions (ending in "?") wins over earlier
+    bracketed prose such as ``["a"]``; without one, any array of strings is used.
+    """
+    def is_question(element: Any) -> bool:
+        suggestion = _suggestion_text(element, max_words)
+        return suggestion is not None and suggestion.endswith("?")
+
+    def is_suggestion(element: Any) -> bool:
+        return _suggestion_text(element, max_words) is not None
+
+    elements = list(iter_json_array(text, accept=is_question)) or iter_json_array(text, accept=is_suggestion)
+    return [_suggestion_text(element, max_words) for element in elements][:limit]
@@ -0,0 +1,203 @@
+"""
+Minimal Prometheus-style metrics, exposed by ``GET /metrics``.
+
+Counters and histograms are plain in-process objects (no client library
+needed) rendered in the Prometheus text exposition format. Values that other
+components already track (cache hit counters, session store sizes, ...) are
+exported with ``Gauge`` callbacks that are read at scrape time, so the hot
+path pays nothing for them.
+
+Each uvicorn worker exposes its own numbers; scrape every worker, or run one.
+
+    with stage_timer("embed"):
+        vector = await embed_question(question)
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Seconds; covers in-process stages (sub-millisecond) up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram(Metric):
+    """Cumulative-bucket latency histogram per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[Tuple, List] = {}  # key -> [bucket counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {total!r}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+class Gauge(Metric):
+    """
+    Value read from a callback at scrape time. The callback returns a number,
+    or a dict mapping label-value tuples to numbers. `kind` may be "counter"
+    for callbacks that report monotonically increasing totals.
+    """
+
+    def __init__(self, name: str, documentation: str, fn: Callable, labelnames: Sequence[str] = (),
+                 kind: str = "gauge"):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        value = self.fn()
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, sample in sorted(items, key=lambda item: item[0]):
+            key = key if isinstance(key, tuple) else (key,)
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(sample)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, fn: Callable, labelnames: Sequence[str] = (),
+              kind: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, documentation, fn, labelnames, kind))
+
+    def render(self) -> str:
+        blocks = []
+        for metric in self._metrics.values():
+            try:
+                blocks.append(metric.render())
+            except Exception as e:  # a failing callback must not break the whole scrape
+                blocks.append(f"# {metric.name} unavailable: {_escape(e)}")
+        return "\n".join(blocks) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Time until the response starts, per endpoint", ("method", "endpoint", "status"))
+STAGE_LATENCY = registry.histogram(
+    "stage_duration_seconds", "Latency of request processing stages (embed, retrieve, context, llm, ...)", ("stage",))
+LLM_REQUESTS = registry.counter(
+    "llm_requests_total", "Upstream LLM HTTP attempts by mode and outcome (status code or error kind)",
+    ("mode", "outcome"))
+LLM_LATENCY = registry.histogram(
+    "llm_request_duration_seconds", "Upstream LLM HTTP attempt latency", ("mode",))
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens reported by the upstream usage field", ("type",))
+ADMISSION_REJECTED = registry.counter(
+    "admission_rejected_total", "Requests shed with 429 by admission control", ("reason",))
+LLM_HEDGES = registry.counter(
+    "llm_hedges_total", "Hedged duplicate upstream calls sent after the hedge delay or a failed attempt", ("model",))
+ASK_ANSWERS = registry.counter(
+    "ask_answers_total", "/ask answers by the path that produced them (llm, hedge, extractive)", ("path",))
+CACHE_LOOKUPS = registry.counter(
+    "cache_lookups_total", "Lookups in caches without their own counters", ("cache", "result"))
+
+
+def stage_timer(stage: str):
+    """Context manager timing one request stage into ``stage_duration_seconds``."""
+    return STAGE_LATENCY.time(stage=stage)
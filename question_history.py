@@ -0,0 +1,121 @@
+"""
+Per-topic history of generated quiz questions with near-duplicate detection.
+
+Each topic keeps its most recent questions (``QUESTION_HISTORY_SIZE``) together
+with their L2-normalized embeddings in one compact float32 matrix. A batch of
+candidate questions is checked with a single matrix product against the
+topic's history (plus the earlier candidates of the same batch); a candidate
+whose cosine similarity to any of them reaches ``QUESTION_DUP_THRESHOLD`` is
+a rephrased repeat and is rejected. Exact repeats are caught by text as well.
+"""
+import os
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import normalize_rows
+
+QUESTION_HISTORY_SIZE = int(os.getenv("QUESTION_HISTORY_SIZE", "50"))
+QUESTION_DUP_THRESHOLD = float(os.getenv("QUESTION_DUP_THRESHOLD", "0.9"))
+
+
+def normalize_question_for_comparison(question: str) -> str:
+    """Normalize question text for comparison to detect duplicates."""
+    return re.sub(r'[^\w\s]', '', question.lower().strip())
+
+
+class TopicHistory:
+    """Ring buffer of one topic's questions and their embeddings."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.questions: List[str] = []
+        self.vectors: Optional[np.ndarray] = None
+
+    def add(self, questions: List[str], vectors: np.ndarray):
+        self.questions = (self.questions + questions)[-self.capacity:]
+        self.vectors = vectors if self.vectors is None else np.vstack([self.vectors, vectors])
+        self.vectors = self.vectors[-self.capacity:]
+
+    def __len__(self):
+        return len(self.questions)
+
+
+class QuestionHistory:
+    """Question history per topic; reads like ``Dict[str, List[str]]`` for callers that only need the text."""
+
+    def __init__(self, capacity: int = QUESTION_HISTORY_SIZE, threshold: float = QUESTION_DUP_THRESHOLD):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.checked = 0
+        self.rejected = 0
+        self._topics: Dict[str, TopicHistory] = {}
+
+    def unique_mask(self, topic: str, questions: List[str], embeddings) -> List[bool]:
+        """
+        For each candidate, whether it is new: not an exact or near-duplicate of
+        the topic's history or of an earlier accepted candidate in the batch.
+        """
+        if not questions:
+            return []
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(questions), -1))
+        history = self._topics.get(topic)
+        seen = {normalize_question_for_comparison(q) for q in history.questions} if history else set()
+
+        # One product against the history, one within the batch
+        if history is not None and len(history):
+            history_best = (vectors @ history.vectors.T).max(axis=1)
+        else:
+            history_best = np.full(len(questions), -1.0, dtype=np.float32)
+        batch_scores = vectors @ vectors.T
+
+        mask = []
+        accepted: List[int] = []
+        for i, question in enumerate(questions):
+            normalized = normalize_question_for_comparison(question)
+            unique = bool(
+                normalized not in seen
+                and history_best[i] < self.threshold
+                and not (accepted and batch_scores[i, accepted].max() >= self.threshold)
+            )
+            if unique:
+                accepted.append(i)
+                seen.add(normalized)
+            mask.append(unique)
+
+        self.checked += len(questions)
+        self.rejected += len(questions) - len(accepted)
+        return mask
+
+    def add(self, topic: str, questions: List[str], embeddings):
+        if not questions:
+            return
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32).reshape(len(questions), -1))
+        self._topics.setdefault(topic, TopicHistory(self.capacity)).add(list(questions), vectors)
+
+    def get(self, topic: str, default: Optional[List[str]] = None) -> List[str]:
+        history = self._topics.get(topic)
+        return list(history.questions) if history else (default if default is not None else [])
+
+    def items(self) -> Iterator[Tuple[str, List[str]]]:
+        for topic, history in list(self._topics.items()):
+            yield topic, history.questions
+
+    def __contains__(self, topic: str) -> bool:
+        return topic in self._topics
+
+    def __delitem__(self, topic: str):
+        del self._topics[topic]
+
+    def __len__(self):
+        return len(self._topics)
+
+    def stats(self) -> Dict:
+        return {
+            "topics": len(self._topics),
+            "questions": sum(len(history) for history in self._topics.values()),
+            "threshold": self.threshold,
+            "checked": self.checked,
+            "rejected": self.rejected
+        }
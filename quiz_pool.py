@@ -0,0 +1,183 @@
+"""
+Background pre-generation pool of quiz questions per topic.
+
+Generating a quiz takes one or two full LLM calls, so ``/quiz`` would keep
+users waiting on every cache miss. ``QuizPool`` keeps a ready pool of
+validated, de-duplicated questions for each popular topic and tops it up to
+``QUIZ_POOL_DEPTH`` in the background. ``draw`` hands out a random mix of
+``n`` pooled questions instantly (each question is served once), then
+schedules a refill.
+
+Topics listed in ``QUIZ_POOL_TOPICS`` are warmed at startup and always kept.
+Any other (free-text) topic only joins the pool once it has been requested
+``QUIZ_POOL_MIN_DEMAND`` times, so one-off topics don't trigger background
+generations; at most ``QUIZ_POOL_MAX_TOPICS`` are pooled (the least recently
+requested demand topic is dropped first). ``QUIZ_POOL_DEPTH=0`` disables it.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+QUIZ_POOL_DEPTH = int(os.getenv("QUIZ_POOL_DEPTH", "30"))
+QUIZ_POOL_BATCH = int(os.getenv("QUIZ_POOL_BATCH", "10"))
+QUIZ_POOL_MAX_TOPICS = int(os.getenv("QUIZ_POOL_MAX_TOPICS", "20"))
+QUIZ_POOL_TOPICS = [t.strip() for t in os.getenv("QUIZ_POOL_TOPICS", "General").split(",") if t.strip()]
+# Requests a topic outside QUIZ_POOL_TOPICS needs before it gets a pool
+QUIZ_POOL_MIN_DEMAND = int(os.getenv("QUIZ_POOL_MIN_DEMAND", "3"))
+# Distinct unpooled topics whose request counts are remembered
+DEMAND_TRACKED = 1000
+# Seconds to wait before retrying a topic whose last refill produced nothing
+QUIZ_POOL_RETRY_DELAY = float(os.getenv("QUIZ_POOL_RETRY_DELAY", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+class QuizPool:
+    """Per-topic pools of ready questions, refilled by background tasks."""
+
+    def __init__(self, produce: Callable[[str, int], Awaitable[List[Dict]]], depth: int = QUIZ_POOL_DEPTH,
+                 batch_size: int = QUIZ_POOL_BATCH, max_topics: int = QUIZ_POOL_MAX_TOPICS,
+                 retry_delay: float = QUIZ_POOL_RETRY_DELAY, topics: Iterable[str] = QUIZ_POOL_TOPICS,
+                 min_demand: int = QUIZ_POOL_MIN_DEMAND):
+        self.produce = produce
+        self.depth = depth
+        self.batch_size = batch_size
+        self.max_topics = max_topics
+        self.retry_delay = retry_delay
+        self.topics = set(topics)
+        self.min_demand = min_demand
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.failures = 0
+        self._pools: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._demand: "OrderedDict[str, int]" = OrderedDict()
+
+    @property
+    def enabled(self) -> bool:
+        return self.depth > 0
+
+    def _touch(self, topic: str) -> List[Dict]:
+        """Register `topic` as recently requested, evicting the least recent demand topic if needed."""
+        pool = self._pools.setdefault(topic, [])
+        self._pools.move_to_end(topic)
+        while len(self._pools) > self.max_topics:
+            stale = next((t for t in self._pools if t not in self.topics), next(iter(self._pools)))
+            del self._pools[stale]
+            task = self._tasks.pop(stale, None)
+            if task:
+                task.cancel()
+        return pool
+
+    def _wanted(self, topic: str) -> bool:
+        """Count a request for `topic`; True once it is configured, pooled or in enough demand."""
+        if topic in self.topics or topic in self._pools:
+            return True
+        count = self._demand.pop(topic, 0) + 1
+        if count >= self.min_demand:
+            return True
+        self._demand[topic] = count
+        while len(self._demand) > DEMAND_TRACKED:
+            self._demand.popitem(last=False)
+        return False
+
+    def draw(self, topic: str, n: int) -> Optional[List[Dict]]:
+        """
+        Take `n` random questions from the topic's pool, or None if it holds fewer
+        (or `n` < 1).
+
+        Either way a background refill is scheduled for the topic, once it is
+        configured or has been requested ``min_demand`` times.
+        """
+        if not self.enabled or n < 1:
+            return None
+        if not self._wanted(topic):
+            self.misses += 1
+            return None
+        pool = self._touch(topic)
+        questions = None
+        if len(pool) >= n:
+            picked = set(random.sample(range(len(pool)), n))
+            questions = [pool[i] for i in sorted(picked)]
+            pool[:] = [q for i, q in enumerate(pool) if i not in picked]
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.refill(topic)
+        return questions
+
+    def add(self, topic: str, questions: Iterable[Dict]):
+        """Put spare questions (e.g. left over from a synchronous generation) into a pooled topic."""
+        if not self.enabled or (topic not in self.topics and topic not in self._pools):
+            return
+        pool = self._touch(topic)
+        seen = {q.get("id") or q["question"] for q in pool}
+        for q in questions:
+            key = q.get("id") or q["question"]
+            if key not in seen and len(pool) < self.depth:
+                pool.append(q)
+                seen.add(key)
+
+    def refill(self, topic: str):
+        """Start a background top-up for `topic` unless one is already running."""
+        if not self.enabled:
+            return
+        task = self._tasks.get(topic)
+        if task is not None and not task.done():
+            return
+        if time.time() - self._failed_at.get(topic, 0) < self.retry_delay:
+            return
+        self._touch(topic)
+        self._tasks[topic] = asyncio.create_task(self._top_up(topic))
+
+    def warm(self, topics: Optional[Iterable[str]] = None):
+        if topics is not None:
+            self.topics.update(topics)
+        for topic in self.topics:
+            self.refill(topic)
+
+    async def _top_up(self, topic: str):
+        while len(self._pools.get(topic, ())) < self.depth:
+            try:
+                questions = await self.produce(topic, self.batch_size)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Quiz pool refill for '%s' failed: %s", topic, e)
+                questions = []
+            if not questions:
+                self.failures += 1
+                self._failed_at[topic] = time.time()
+                return
+            if topic not in self._pools:
+                return  # evicted while generating
+            before = len(self._pools[topic])
+            self.add(topic, questions)
+            self.generated += len(self._pools[topic]) - before
+            logger.debug("Quiz pool '%s': %d/%d questions ready", topic, len(self._pools[topic]), self.depth)
+
+    async def aclose(self):
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "depth": self.depth,
+            "topics": {topic: len(pool) for topic, pool in self._pools.items()},
+            "refilling": sorted(topic for topic, task in self._tasks.items() if not task.done()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "generated": self.generated,
+            "failures": self.failures
+        }
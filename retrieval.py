@@ -0,0 +1,377 @@
+"""
+Pluggable nearest-neighbour retrievers over the KB embedding matrix.
+
+Every retriever takes L2-normalized embeddings (so dot product == cosine) and
+returns hits shaped like ``sentence_transformers.util.semantic_search``: one
+list of ``{"corpus_id", "score"}`` dicts per query, best first.
+
+- ``ExactRetriever``: brute-force dot product against every chunk.
+- ``IVFRetriever``: NumPy inverted-file index (k-means coarse quantizer).
+  ``n_probe`` trades recall for latency.
+- ``HNSWRetriever``: graph index via the optional ``hnswlib`` package.
+  ``ef_search`` trades recall for latency.
+
+Select one with ``RETRIEVER=exact|ivf|hnsw``; see ``benchmarks/bench_retrieval.py``
+for recall@k vs latency against exact search. The IVF centroids and the HNSW
+graph are built by ``python kb_index.py build`` and saved inside the KB index
+directory (so they are keyed by the index key); workers and hot reloads load
+them instead of retraining.
+
+``BM25Index`` is the lexical counterpart for exact terms the small embedding
+model handles poorly (drug names, doses, acronyms such as "NGT" or "PEWS");
+``reciprocal_rank_fusion`` merges its ranking with the semantic one.
+"""
+import contextlib
+import logging
+import math
+import os
+import re
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+RETRIEVER = os.getenv("RETRIEVER", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))  # 0 = about sqrt(number of chunks)
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+# Encode/score in blocks so float16 or memory-mapped matrices are never upcast whole
+BLOCK_SIZE = 65536
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _as_queries(query_embeddings) -> np.ndarray:
+    return normalize_rows(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+
+
+def _top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> List[Dict]:
+    """Best-first hits from candidate `scores` belonging to corpus rows `ids`."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [{"corpus_id": int(ids[i]), "score": float(scores[i])} for i in top]
+
+
+class Retriever:
+    """Interface shared by the retrieval backends."""
+
+    name = "base"
+
+    def search(self, query_embeddings, top_k: int = 5) -> List[List[Dict]]:
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class ExactRetriever(Retriever):
+    """Brute-force cosine search; exact but linear in the corpus size."""
+
+    name = "exact"
+
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        if self.embeddings.dtype == np.float32:
+            return queries @ self.embeddings.T
+        out = np.empty((len(queries), len(self.embeddings)), dtype=np.float32)
+        for start in range(0, len(self.embeddings), BLOCK_SIZE):
+            block = np.asarray(self.embeddings[start:start + BLOCK_SIZE], dtype=np.float32)
+            out[:, start:start + len(block)] = queries @ block.T
+        return out
+
+    def search(self, query_embeddings, top_k: int = 5) -> List[List[Dict]]:
+        queries = _as_queries(query_embeddings)
+        if len(self.embeddings) == 0:
+            return [[] for _ in range(len(queries))]
+        ids = np.arange(len(self.embeddings))
+        return [_top_k(row, ids, top_k) for row in self.scores(queries)]
+
+
+class IVFRetriever(Retriever):
+    """
+    Inverted-file index: chunks are bucketed by their nearest k-means centroid
+    and a query only scores the chunks in its `n_probe` closest buckets.
+    """
+
+    name = "ivf"
+
+    def __init__(self, embeddings: np.ndarray, n_list: int = IVF_NLIST, n_probe: int = IVF_NPROBE,
+                 iterations: int = 20, train_size: int = 256, seed: int = 0):
+        self.embeddings = embeddings
+        count = len(embeddings)
+        self.n_list = max(1, min(n_list or int(math.sqrt(count)), count)) if count else 1
+        self.n_probe = n_probe
+        self.centroids = self._train(iterations, train_size * self.n_list, seed) if count else None
+
+        assignments = self._assign(embeddings) if count else np.zeros(0, dtype=np.int64)
+        # CSR layout: chunk ids grouped by list, with offsets into that array
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.zeros(self.n_list + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=self.n_list), out=self.offsets[1:])
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    @staticmethod
+    def filename(count: int, n_list: int = IVF_NLIST) -> str:
+        """Name of the saved structure for `count` chunks (it depends on the resolved list count)."""
+        resolved = max(1, min(n_list or int(math.sqrt(count)), count)) if count else 1
+        return f"ivf-{resolved}.npz"
+
+    def save(self, path: str):
+        with _atomic_path(path) as tmp:
+            np.savez(tmp, centroids=self.centroids, order=self.order, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, embeddings: np.ndarray, path: str, n_probe: int = IVF_NPROBE) -> "IVFRetriever":
+        """Restore an index saved by `save` for the same `embeddings`."""
+        with np.load(path) as data:
+            centroids, order, offsets = data["centroids"], data["order"], data["offsets"]
+        if int(offsets[-1]) != len(embeddings):
+            raise ValueError(f"{path} indexes {int(offsets[-1])} chunks, expected {len(embeddings)}")
+        retriever = cls.__new__(cls)
+        retriever.embeddings = embeddings
+        retriever.n_list = len(offsets) - 1
+        retriever.n_probe = n_probe
+        retriever.centroids = centroids
+        retriever.order = order
+        retriever.offsets = offsets
+        return retriever
+
+    def _train(self, iterations: int, sample_size: int, seed: int) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        count = len(self.embeddings)
+        sample_ids = np.sort(rng.choice(count, size=min(sample_size, count), replace=False))
+        sample = np.asarray(self.embeddings[sample_ids], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), size=self.n_list, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(self.n_list):
+                members = sample[labels == c]
+                # Re-seed empty clusters from a random sample point
+                centroids[c] = members.mean(axis=0) if len(members) else sample[rng.integers(len(sample))]
+            centroids = normalize_rows(centroids)
+        return centroids
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(embeddings), dtype=np.int64)
+        for start in range(0, len(embeddings), BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start + BLOCK_SIZE], dtype=np.float32)
+            labels[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def search(self, query_embeddings, top_k: int = 5, n_probe: Optional[int] = None) -> List[List[Dict]]:
+        queries = _as_queries(query_embeddings)
+        if len(self.embeddings) == 0:
+            return [[] for _ in range(len(queries))]
+
+        n_probe = min(n_probe or self.n_probe, self.n_list)
+        centroid_scores = queries @ self.centroids.T
+        results = []
+        for query, row in zip(queries, centroid_scores):
+            lists = np.argpartition(-row, n_probe - 1)[:n_probe]
+            # Sorted ids keep reads from a memory-mapped matrix sequential
+            ids = np.sort(np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists]))
+            candidates = np.asarray(self.embeddings[ids], dtype=np.float32)
+            results.append(_top_k(candidates @ query, ids, top_k))
+        return results
+
+
+class HNSWRetriever(Retriever):
+    """HNSW graph index backed by the optional `hnswlib` package."""
+
+    name = "hnsw"
+
+    def __init__(self, embeddings: np.ndarray, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH):
+        hnswlib = _import_hnswlib()
+        self.count = len(embeddings)
+        dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+        self.index = hnswlib.Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=max(self.count, 1), ef_construction=ef_construction, M=m)
+        for start in range(0, self.count, BLOCK_SIZE):
+            block = np.asarray(embeddings[start:start + BLOCK_SIZE], dtype=np.float32)
+            self.index.add_items(block, np.arange(start, start + len(block)))
+        self.set_ef(ef_search)
+
+    @staticmethod
+    def filename(count: int, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION) -> str:
+        return f"hnsw-m{m}-ef{ef_construction}.bin"
+
+    def save(self, path: str):
+        with _atomic_path(path) as tmp:
+            self.index.save_index(tmp)
+
+    @classmethod
+    def load(cls, embeddings: np.ndarray, path: str, ef_search: int = HNSW_EF_SEARCH) -> "HNSWRetriever":
+        """Restore a graph saved by `save` for the same `embeddings`."""
+        hnswlib = _import_hnswlib()
+        retriever = cls.__new__(cls)
+        retriever.count = len(embeddings)
+        dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+        retriever.index = hnswlib.Index(space="ip", dim=dim)
+        retriever.index.load_index(path, max_elements=max(retriever.count, 1))
+        if retriever.index.get_current_count() != retriever.count:
+            raise ValueError(f"{path} indexes {retriever.index.get_current_count()} chunks, expected {retriever.count}")
+        retriever.set_ef(ef_search)
+        return retriever
+
+    def set_ef(self, ef_search: int):
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+
+    def __len__(self):
+        return self.count
+
+    def search(self, query_embeddings, top_k: int = 5) -> List[List[Dict]]:
+        queries = _as_queries(query_embeddings)
+        k = min(top_k, self.count)
+        if k == 0:
+            return [[] for _ in range(len(queries))]
+        labels, distances = self.index.knn_query(queries, k=k)
+        # "ip" space reports 1 - dot product as the distance
+        return [
+            [{"corpus_id": int(i), "score": float(1.0 - d)} for i, d in zip(row_ids, row_dist)]
+            for row_ids, row_dist in zip(labels, distances)
+        ]
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise ImportError("RETRIEVER=hnsw requires the optional 'hnswlib' package (pip install hnswlib)") from e
+    return hnswlib
+
+
+@contextlib.contextmanager
+def _atomic_path(path: str):
+    """Yield a temporary path next to `path`, renamed into place once written."""
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.basename(path), dir=os.path.dirname(path) or ".")
+    os.close(fd)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+_LEXICAL_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.,/][0-9]+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or should the to what when which who why with".split()
+)
+
+
+def lexical_tokens(text: str) -> List[str]:
+    """Lower-cased word, number and dose tokens (e.g. "ngt", "0.5", "10/kg"), minus stopwords."""
+    return [t for t in _LEXICAL_TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 scoring.
+
+    Each posting list stores chunk ids with their precomputed BM25 term weight
+    (everything except the IDF), so a query is a handful of vectorized
+    scatter-adds into a dense score array.
+    """
+
+    name = "bm25"
+
+    def __init__(self, texts: List[str], k1: float = 1.2, b: float = 0.75):
+        self.count = len(texts)
+        postings: Dict[str, Dict[int, int]] = {}
+        lengths = np.zeros(self.count, dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = lexical_tokens(text)
+            lengths[doc_id] = len(tokens)
+            for token in tokens:
+                counts = postings.setdefault(token, {})
+                counts[doc_id] = counts.get(doc_id, 0) + 1
+
+        average_length = float(lengths.mean()) if self.count else 0.0
+        norm = k1 * (1 - b + b * lengths / average_length) if average_length else np.full(self.count, k1)
+        self.postings: Dict[str, tuple] = {}
+        for token, counts in postings.items():
+            ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            idf = math.log(1 + (self.count - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[token] = (ids, (idf * tf * (k1 + 1) / (tf + norm[ids])).astype(np.float32))
+
+    def __len__(self):
+        return self.count
+
+    def search(self, query: str, top_k: int = 5) -> List[Dict]:
+        """Best-first BM25 hits for a query string (chunks without any query term are skipped)."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        touched = []
+        for token in set(lexical_tokens(query)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                ids, weights = posting
+                scores[ids] += weights
+                touched.append(ids)
+        if not touched:
+            return []
+        candidates = np.unique(np.concatenate(touched))
+        return _top_k(scores[candidates], candidates, top_k)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Dict]], top_k: int = 5, k: int = 60) -> List[Dict]:
+    """Fuse best-first hit lists: each list contributes 1 / (k + rank) per chunk."""
+    fused: Dict[int, float] = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            fused[hit["corpus_id"]] = fused.get(hit["corpus_id"], 0.0) + 1.0 / (k + rank)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [{"corpus_id": corpus_id, "score": score} for corpus_id, score in best]
+
+
+def create_retriever(embeddings: np.ndarray, kind: Optional[str] = None,
+                     index_path: Optional[str] = None) -> Retriever:
+    """
+    Build the retriever selected by RETRIEVER (``exact``, ``ivf`` or ``hnsw``).
+
+    With `index_path` (a KB index directory) a saved IVF/HNSW structure is
+    loaded from it; one that is missing is built and saved there for the next
+    worker or reload.
+    """
+    kind = (kind or RETRIEVER).lower()
+    if kind == "exact":
+        return ExactRetriever(embeddings)
+    if kind not in ("ivf", "hnsw"):
+        raise ValueError(f"Unknown RETRIEVER '{kind}', expected 'exact', 'ivf' or 'hnsw'")
+
+    cls = IVFRetriever if kind == "ivf" else HNSWRetriever
+    path = os.path.join(index_path, cls.filename(len(embeddings))) if index_path else None
+    if path and os.path.exists(path):
+        try:
+            return cls.load(embeddings, path)
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.warning("Rebuilding unreadable %s index %s: %s", kind, path, e)
+    retriever = cls(embeddings)
+    if path:
+        try:
+            retriever.save(path)
+        except (OSError, RuntimeError) as e:
+            logger.warning("Could not save %s index to %s: %s", kind, path, e)
+    return retriever
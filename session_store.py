@@ -0,0 +1,259 @@
+"""
+Session stores for active quiz sessions.
+
+Both backends expire sessions after a TTL, cap the number of sessions with LRU
+eviction and track approximate memory/byte usage:
+
+- ``MemorySessionStore`` keeps live objects in-process (single worker).
+- ``SQLiteSessionStore`` keeps encoded sessions in a SQLite file (WAL mode), so
+  every uvicorn worker on the host sees the same sessions and they survive
+  restarts.
+
+Pick a backend with ``SESSION_STORE=memory|sqlite`` (see ``create_session_store``).
+Async endpoints use ``aget``/``aset``/``adelete``; the SQLite backend runs them
+in a worker thread so disk I/O never stalls the event loop.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "7200"))  # seconds = 2 hours
+SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "10000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join("cache", "sessions.sqlite3"))
+
+
+class SessionStore:
+    """Dict-like interface shared by the session store backends."""
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, session_id: str, value: Any):
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __setitem__(self, session_id: str, value: Any):
+        self.set(session_id, value)
+
+    async def aget(self, session_id: str, default: Any = None) -> Any:
+        return self.get(session_id, default)
+
+    async def aset(self, session_id: str, value: Any):
+        self.set(session_id, value)
+
+    async def adelete(self, session_id: str):
+        self.delete(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU store with TTL expiry and an approximate byte budget."""
+
+    def __init__(self, ttl: float = SESSION_TTL, max_entries: int = SESSION_MAX_ENTRIES,
+                 max_bytes: int = SESSION_MAX_BYTES, encode: Callable[[Any], str] = json.dumps):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return default
+            value, size, expires = entry
+            if expires <= time.time():
+                self._remove_locked(session_id)
+                self.expirations += 1
+                return default
+            self._data.move_to_end(session_id)
+            return value
+
+    def set(self, session_id: str, value: Any):
+        size = len(self.encode(value))
+        with self._lock:
+            if session_id in self._data:
+                self._remove_locked(session_id)
+            self._data[session_id] = (value, size, time.time() + self.ttl)
+            self.bytes += size
+            self._evict_locked()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if session_id in self._data:
+                self._remove_locked(session_id)
+
+    def _remove_locked(self, session_id: str):
+        _, size, _ = self._data.pop(session_id)
+        self.bytes -= size
+
+    def _evict_locked(self):
+        now = time.time()
+        # Entries are kept in access order, so expired ones cluster at the front
+        while self._data:
+            oldest_id, (_, _, expires) = next(iter(self._data.items()))
+            if expires <= now:
+                self._remove_locked(oldest_id)
+                self.expirations += 1
+            elif len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove_locked(oldest_id)
+                self.evictions += 1
+            else:
+                break
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "sessions": len(self._data),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """SQLite-backed store shared by all workers on the host."""
+
+    def __init__(self, path: str = SESSION_DB_PATH, ttl: float = SESSION_TTL,
+                 max_entries: int = SESSION_MAX_ENTRIES, max_bytes: int = SESSION_MAX_BYTES,
+                 encode: Callable[[Any], str] = json.dumps, decode: Callable[[str], Any] = json.loads,
+                 table: str = "sessions"):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid session table name '{table}'")
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.encode = encode
+        self.decode = decode
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "id TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed)")
+        self._db.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expires ON {self.table} (expires)")
+
+    def get(self, session_id: str, default: Any = None) -> Any:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT value FROM {self.table} WHERE id = ? AND expires > ?", (session_id, now)
+            ).fetchone()
+            if row is None:
+                return default
+            self._db.execute(f"UPDATE {self.table} SET accessed = ? WHERE id = ?", (now, session_id))
+        return self.decode(row[0])
+
+    def set(self, session_id: str, value: Any):
+        encoded = self.encode(value)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (id, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                (session_id, encoded, len(encoded), now + self.ttl, now)
+            )
+            self._evict_locked(now)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE id = ?", (session_id,))
+
+    async def aget(self, session_id: str, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, session_id, default)
+
+    async def aset(self, session_id: str, value: Any):
+        await asyncio.to_thread(self.set, session_id, value)
+
+    async def adelete(self, session_id: str):
+        await asyncio.to_thread(self.delete, session_id)
+
+    def _evict_locked(self, now: float):
+        self._db.execute(f"DELETE FROM {self.table} WHERE expires <= ?", (now,))
+        count, total = self._db.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            excess = max(count - self.max_entries, 1)
+            removed = self._db.execute(
+                f"DELETE FROM {self.table} WHERE id IN (SELECT id FROM {self.table} ORDER BY accessed LIMIT ?)",
+                (excess,)
+            ).rowcount
+            if removed <= 0:
+                break
+            self.evictions += removed
+            count, total = self._db.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+
+    def __len__(self):
+        with self._lock:
+            query = f"SELECT COUNT(*) FROM {self.table} WHERE expires > ?"
+            return self._db.execute(query, (time.time(),)).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, total = self._db.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table} WHERE expires > ?", (time.time(),)
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "sessions": count,
+            "bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "evictions": self.evictions
+        }
+
+
+def create_session_store(encode: Callable[[Any], str] = json.dumps,
+                         decode: Callable[[str], Any] = json.loads,
+                         backend: Optional[str] = None, table: str = "sessions") -> SessionStore:
+    """
+    Build the session store selected by SESSION_STORE (``memory`` or ``sqlite``).
+
+    Stores for different kinds of session data share the SQLite file but use
+    their own `table`.
+    """
+    backend = (backend or SESSION_STORE).lower()
+    if backend == "memory":
+        return MemorySessionStore(encode=encode)
+    if backend == "sqlite":
+        return SQLiteSessionStore(encode=encode, decode=decode, table=table)
+    raise ValueError(f"Unknown SESSION_STORE backend '{backend}', expected 'memory' or 'sqlite'")
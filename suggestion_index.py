@@ -0,0 +1,361 @@
+"""
+Precomputed follow-up suggestions for ``/suggest``.
+
+Built offline from the KB index, next to the chunk table it belongs to
+(``<KB_INDEX_DIR>/<key>/suggestions.npz``):
+
+- candidate questions per chunk, derived from the chunk's section heading and
+  its most distinctive phrases (TF-IDF over the KB), embedded with the same
+  model as user questions;
+- a chunk-neighbour graph: the ``SUGGEST_NEIGHBOURS`` most similar chunks of
+  every chunk, so suggestions can step to adjacent topics.
+
+At request time the question is embedded once and searched against the KB.
+Candidates are gathered from the nearest chunks and their neighbours. They
+are ranked by similarity to the question, minus their similarity to the
+suggestions already picked. Candidates that merely restate the question are
+dropped. This is a few milliseconds of NumPy, with no LLM round trip.
+
+    python suggestion_index.py build
+"""
+import argparse
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from retrieval import normalize_rows
+
+SUGGEST_NEIGHBOURS = int(os.getenv("SUGGEST_NEIGHBOURS", "8"))
+SUGGEST_PHRASES_PER_CHUNK = int(os.getenv("SUGGEST_PHRASES_PER_CHUNK", "2"))
+# Candidates at least this similar to the asked question only restate it
+SUGGEST_DUPLICATE_THRESHOLD = float(os.getenv("SUGGEST_DUPLICATE_THRESHOLD", "0.9"))
+# Relevance vs. variety of the picked suggestions (1.0 = relevance only)
+SUGGEST_DIVERSITY = float(os.getenv("SUGGEST_DIVERSITY", "0.7"))
+
+SUGGESTIONS_FILE = "suggestions.npz"
+_NEIGHBOUR_BLOCK = 1024
+
+logger = logging.getLogger(__name__)
+
+SECTION_TEMPLATES = (
+    "What are the key nursing considerations for {topic}?",
+    "When should I escalate concerns about {topic}?",
+)
+PHRASE_TEMPLATES = (
+    "What should I know about {phrase}?",
+    "What are the nursing priorities around {phrase}?",
+)
+
+_PHRASE_STOPWORDS = frozenset("""
+    a about above after again all also am an and any are as at be been before being below between both but by
+    can could did do does doing down during each either else ensure etc every few for from further had has
+    have having her here hers him his i if in into is it its itself just may me might more most must my no nor
+    not now of off on once only or other our out over own per please same she should so some such than that
+    the their them then there these they this those through to too under until up upon us use used using very
+    via was we were what when where whether which while who whom why will with within without would you your
+    against always apply assess assessed check checked confirm daily document documented ensure escalate every
+    follow give given include includes including indicate indicates keep make monitor perform record report
+    start take used weigh immediately one two three four five six seven eight nine ten
+""".split())
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z'-]*")
+# Without a POS tagger: a phrase's last word should not look like an adjective, adverb or verb form,
+# and a modifier should not look like an adverb, participle or third-person verb ("confirms gastric")
+_NON_HEAD_SUFFIXES = ("ly", "ed", "ic", "al", "ous", "ive", "ful", "able", "ible", "ary")
+_NON_MODIFIER_SUFFIXES = ("ly", "ing", "ed", "es")
+
+
+def _topic(heading: str) -> str:
+    """Section heading as a phrase that reads inside a sentence ("FLUID BALANCE" -> "fluid balance")."""
+    heading = re.sub(r"^\d+(?:\.\d+)*[.)]?\s*", "", heading).strip(" :-")
+    words = []
+    for word in heading.split():
+        # Keep acronyms such as NGT or PEWS, lower-case everything else
+        words.append(word if word.isupper() and len(word) <= 5 and not heading.isupper() else word.lower())
+    return " ".join(words)
+
+
+def _phrases(text: str) -> List[str]:
+    """Unigrams and bigrams of consecutive content words."""
+    phrases = []
+    for run in re.split(r"[.,;:!?()\n]", text):
+        words = [w.lower() for w in _WORD_RE.findall(run)]
+        content = [w if w not in _PHRASE_STOPWORDS and len(w) > 2 else None for w in words]
+        for i, word in enumerate(content):
+            if word is None:
+                continue
+            phrases.append(word)
+            if i + 1 < len(content) and content[i + 1] is not None:
+                phrases.append(f"{word} {content[i + 1]}")
+    return phrases
+
+
+def _is_noun_phrase(phrase: str) -> bool:
+    """Heuristic: does `phrase` read as a noun phrase ("gastric placement", not "confirms gastric")?"""
+    *modifiers, head = phrase.split()
+    if head.endswith(_NON_HEAD_SUFFIXES):
+        return False
+    for word in modifiers:
+        if word.endswith(_NON_MODIFIER_SUFFIXES) or (word.endswith("s") and not word.endswith(("ss", "'s", "us", "is"))):
+            return False
+    return True
+
+
+def candidate_questions(records: List[Dict], phrases_per_chunk: int = SUGGEST_PHRASES_PER_CHUNK) -> List[List[str]]:
+    """
+    Template questions for each chunk: about its section, and about its most
+    distinctive phrases (bigrams first, then by TF-IDF across the KB).
+    """
+    chunk_phrases = [Counter(_phrases(record["text"])) for record in records]
+    document_frequency = Counter(phrase for counts in chunk_phrases for phrase in counts)
+    total = max(len(records), 1)
+
+    questions = []
+    for record, counts in zip(records, chunk_phrases):
+        topic = _topic(record.get("section", ""))
+        chunk_questions = [template.format(topic=topic) for template in SECTION_TEMPLATES] if topic else []
+
+        scored = sorted(
+            counts,
+            key=lambda p: -counts[p] * math.log(1 + total / document_frequency[p])
+        )
+        topic_words = set(topic.lower().split())
+        picked: List[str] = []
+        for phrase in sorted(scored, key=lambda p: " " not in p):  # bigrams first, stable within each group
+            if len(picked) >= phrases_per_chunk:
+                break
+            # Skip non-noun phrases, and phrases repeating the section topic or an already picked phrase
+            words = set(phrase.split())
+            if not _is_noun_phrase(phrase) or words & topic_words or any(words & set(p.split()) for p in picked):
+                continue
+            picked.append(phrase)
+        for i, phrase in enumerate(picked):
+            chunk_questions.append(PHRASE_TEMPLATES[i % len(PHRASE_TEMPLATES)].format(phrase=phrase))
+        questions.append(chunk_questions)
+    return questions
+
+
+def chunk_neighbours(embeddings: np.ndarray, k: int = SUGGEST_NEIGHBOURS) -> np.ndarray:
+    """(n, k) ids of each chunk's most similar other chunks, best first (blockwise, exact)."""
+    count = embeddings.shape[0]
+    k = min(k, max(count - 1, 0))
+    neighbours = np.zeros((count, k), dtype=np.int32)
+    if not k:
+        return neighbours
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    for start in range(0, count, _NEIGHBOUR_BLOCK):
+        block = matrix[start:start + _NEIGHBOUR_BLOCK]
+        scores = block @ matrix.T
+        rows = np.arange(block.shape[0])
+        scores[rows, rows + start] = -np.inf
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        neighbours[start:start + block.shape[0]] = np.take_along_axis(top, order, axis=1)
+    return neighbours
+
+
+class SuggestionIndex:
+    """Candidate questions (with embeddings) per chunk plus the chunk-neighbour graph of one KB index."""
+
+    def __init__(self, key: str, questions: List[str], vectors: np.ndarray, offsets: np.ndarray,
+                 question_ids: np.ndarray, neighbours: np.ndarray):
+        self.key = key
+        self.questions = questions
+        self.vectors = vectors
+        # Chunk i owns question_ids[offsets[i]:offsets[i + 1]]
+        self.offsets = offsets
+        self.question_ids = question_ids
+        self.neighbours = neighbours
+
+    def __len__(self):
+        return len(self.questions)
+
+    def chunk_questions(self, chunk_id: int) -> np.ndarray:
+        return self.question_ids[self.offsets[chunk_id]:self.offsets[chunk_id + 1]]
+
+    def suggest(self, question_embedding: np.ndarray, hit_ids: List[int], limit: int = 3,
+                neighbour_weight: float = 0.9, duplicate_threshold: float = SUGGEST_DUPLICATE_THRESHOLD,
+                diversity: float = SUGGEST_DIVERSITY) -> List[str]:
+        """Up to `limit` distinct follow-ups for a question whose nearest KB chunks are `hit_ids`."""
+        weights: Dict[int, float] = {}
+        for chunk_id in hit_ids:
+            for question in self.chunk_questions(chunk_id):
+                weights[int(question)] = 1.0
+        for chunk_id in hit_ids:
+            for neighbour in self.neighbours[chunk_id]:
+                for question in self.chunk_questions(neighbour):
+                    weights.setdefault(int(question), neighbour_weight)
+        if not weights:
+            return []
+
+        ids = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        candidates = self.vectors[ids].astype(np.float32, copy=False)
+        # Cosine similarity: the candidate vectors are unit-norm, the query may not be
+        query = normalize_rows(np.asarray(question_embedding, dtype=np.float32).reshape(1, -1))[0]
+        similarity = candidates @ query
+        keep = similarity < duplicate_threshold
+        ids, candidates = ids[keep], candidates[keep]
+        relevance = similarity[keep] * np.fromiter((weights[int(i)] for i in ids), dtype=np.float32, count=len(ids))
+
+        # Maximal marginal relevance: trade relevance against similarity to what is already picked
+        picked: List[int] = []
+        redundancy = np.zeros(len(ids), dtype=np.float32)
+        while len(picked) < limit and len(picked) < len(ids):
+            scores = diversity * relevance - (1.0 - diversity) * redundancy
+            scores[picked] = -np.inf
+            best = int(np.argmax(scores))
+            picked.append(best)
+            redundancy = np.maximum(redundancy, candidates @ candidates[best])
+        return [self.questions[ids[i]] for i in picked]
+
+    def stats(self) -> Dict:
+        return {"key": self.key, "questions": len(self.questions), "chunks": len(self.offsets) - 1,
+                "neighbours": int(self.neighbours.shape[1]) if self.neighbours.ndim == 2 else 0}
+
+
+def build_suggestion_index(kb_index, model, previous: Optional[SuggestionIndex] = None,
+                           neighbours: int = SUGGEST_NEIGHBOURS) -> SuggestionIndex:
+    """
+    Build the suggestion index for a ``kb_index.KnowledgeBaseIndex``.
+
+    Only questions not already embedded in `previous` are encoded with `model`.
+    """
+    per_chunk = candidate_questions(kb_index.records)
+    questions: List[str] = []
+    positions: Dict[str, int] = {}
+    question_ids, offsets = [], [0]
+    for chunk_questions in per_chunk:
+        for question in chunk_questions:
+            if question not in positions:
+                positions[question] = len(questions)
+                questions.append(question)
+            question_ids.append(positions[question])
+        offsets.append(len(question_ids))
+
+    dim = kb_index.embeddings.shape[1] if kb_index.embeddings.ndim == 2 else 0
+    vectors = np.zeros((len(questions), dim), dtype=np.float32)
+    known = {q: i for i, q in enumerate(previous.questions)} if previous is not None else {}
+    if previous is not None and previous.vectors.shape[1] != dim:
+        known = {}
+    missing = [i for i, q in enumerate(questions) if q not in known]
+    reused = [i for i, q in enumerate(questions) if q in known]
+    if missing:
+        encoded = np.asarray(model.encode([questions[i] for i in missing]), dtype=np.float32)
+        vectors[missing] = normalize_rows(encoded.reshape(len(missing), -1))
+    if reused:
+        vectors[reused] = previous.vectors[[known[questions[i]] for i in reused]]
+    logger.info("Suggestion index %s: %d questions (%d encoded, %d reused)",
+                kb_index.key, len(questions), len(missing), len(reused))
+
+    return SuggestionIndex(kb_index.key, questions, vectors, np.asarray(offsets, dtype=np.int64),
+                           np.asarray(question_ids, dtype=np.int64), chunk_neighbours(kb_index.embeddings, neighbours))
+
+
+def _suggestions_path(key: str, index_dir: str) -> str:
+    return os.path.join(index_dir, key, SUGGESTIONS_FILE)
+
+
+def save_suggestion_index(index: SuggestionIndex, index_dir: str) -> str:
+    """Write `index` next to its KB index; the file is renamed into place so readers never see half of it."""
+    path = _suggestions_path(index.key, index_dir)
+    fd, tmp_path = tempfile.mkstemp(prefix=".suggestions-", suffix=".npz", dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, key=np.array(index.key), questions=np.array(index.questions, dtype=str),
+                     vectors=index.vectors, offsets=index.offsets, question_ids=index.question_ids,
+                     neighbours=index.neighbours)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def load_suggestion_index(key: str, index_dir: str) -> Optional[SuggestionIndex]:
+    """The suggestion index built for KB index `key`, or None if there is none (or it is unreadable)."""
+    path = _suggestions_path(key, index_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["key"]) != key:
+                return None
+            return SuggestionIndex(key, data["questions"].tolist(), data["vectors"], data["offsets"],
+                                   data["question_ids"], data["neighbours"])
+    except (OSError, KeyError, ValueError) as e:
+        logger.warning("Ignoring unreadable suggestion index %s: %s", path, e)
+        return None
+
+
+def load_or_build_suggestion_index(kb_index, model_loader, index_dir: str,
+                                   previous: Optional[SuggestionIndex] = None) -> SuggestionIndex:
+    """Load the suggestion index for `kb_index`, building and persisting it if missing."""
+    index = load_suggestion_index(kb_index.key, index_dir)
+    if index is not None:
+        return index
+    logger.warning("No suggestion index for KB index %s, building it now "
+                   "(run `python suggestion_index.py build` ahead of time)", kb_index.key)
+    index = build_suggestion_index(kb_index, model_loader(), previous=previous)
+    try:
+        save_suggestion_index(index, index_dir)
+    except OSError as e:
+        logger.warning("Could not persist suggestion index to %s: %s", index_dir, e)
+    return index
+
+
+def main(argv=None):
+    from embedding_backends import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, create_embedding_backend, embedding_variant
+    from ingest import KB_SOURCE_DIR, load_chunks
+    from kb_index import INDEX_DIR, index_key, load_index
+
+    parser = argparse.ArgumentParser(description="Build the precomputed follow-up suggestion index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("build", "build suggestions for the current KB index"),
+                            ("show", "print the suggestions for a question")):
+        command = sub.add_parser(name, help=help_text)
+        command.add_argument("--source", default=KB_SOURCE_DIR, help="knowledge base directory or file")
+        command.add_argument("--index-dir", default=INDEX_DIR)
+        command.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+        command.add_argument("--backend", default=EMBEDDING_BACKEND, choices=("torch", "onnx"))
+    sub.choices["build"].add_argument("--force", action="store_true", help="rebuild even if up to date")
+    sub.choices["show"].add_argument("question")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    key = index_key(load_chunks(args.source), args.model, embedding_variant(args.backend))
+    kb_index = load_index(key, args.index_dir)
+    if kb_index is None:
+        print(f"No KB index for key {key} in {args.index_dir}; run `python kb_index.py build` first")
+        return 1
+    model = create_embedding_backend(args.backend, model_name=args.model)
+
+    if args.command == "show":
+        from retrieval import create_retriever
+        index = load_suggestion_index(key, args.index_dir) or build_suggestion_index(kb_index, model)
+        embedding = normalize_rows(np.asarray(model.encode([args.question]), dtype=np.float32).reshape(1, -1))
+        hits = create_retriever(kb_index.embeddings, index_path=kb_index.path).search(embedding, top_k=3)[0]
+        for suggestion in index.suggest(embedding[0], [hit["corpus_id"] for hit in hits]):
+            print(suggestion)
+        return 0
+
+    if not args.force and load_suggestion_index(key, args.index_dir) is not None:
+        print(f"Suggestion index for {key} is already up to date")
+        return 0
+    start = time.time()
+    index = build_suggestion_index(kb_index, model)
+    path = save_suggestion_index(index, args.index_dir)
+    print(f"Built suggestion index {key}: {len(index)} questions for {len(kb_index)} chunks "
+          f"in {time.time() - start:.1f}s -> {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
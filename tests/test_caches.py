@@ -0,0 +1,26 @@
+import numpy as np
+
+from caches import SemanticCache
+
+
+def test_answers_are_scoped_to_their_namespace_and_survive_a_reload():
+    cache = SemanticCache(maxsize=4, threshold=0.9)
+    vector = np.array([1.0, 0.0, 0.0])
+    cache.set(vector, "old answer", namespace="kb-a")
+
+    # After a reload to another KB index the old answer is never served...
+    assert cache.get(vector, namespace="kb-b") is None
+    cache.set(vector, "new answer", namespace="kb-b")
+    assert cache.get(vector, namespace="kb-b") == "new answer"
+    # ...but it is not wiped either: switching back finds it again
+    assert cache.get(vector, namespace="kb-a") == "old answer"
+
+
+def test_other_namespaces_are_evicted_first():
+    cache = SemanticCache(maxsize=2, threshold=0.9)
+    cache.set([1.0, 0.0], "stale", namespace="kb-a")
+    cache.set([0.0, 1.0], "current", namespace="kb-b")
+    cache.get([0.0, 1.0], namespace="kb-b")
+    cache.set([0.7, 0.7], "newer", namespace="kb-b")
+    assert cache.get([0.0, 1.0], namespace="kb-b") == "current"
+    assert cache.get([1.0, 0.0], namespace="kb-a") is None
@@ -0,0 +1,30 @@
+import asyncio
+
+from llm_json import parse_quiz_questions, parse_suggestions, stream_quiz_questions
+
+QUIZ = '[{"question": "Which fluid?", "options": ["Saline", "Glucose"], "answer": "Saline"}]'
+
+
+def test_quiz_skips_bracketed_prose_before_the_payload():
+    assert parse_quiz_questions("Note [1] then " + QUIZ) == [
+        {"question": "Which fluid?", "options": ["Saline", "Glucose"], "answer": "Saline"}
+    ]
+
+
+def test_streamed_quiz_skips_bracketed_prose_before_the_payload():
+    async def tokens():
+        for token in ("Note [", "1] then ", QUIZ[:30], QUIZ[30:]):
+            yield token
+
+    async def collect():
+        return [question async for question in stream_quiz_questions(tokens())]
+
+    assert [q["question"] for q in asyncio.run(collect())] == ["Which fluid?"]
+
+
+def test_suggestions_prefer_the_array_of_questions():
+    assert parse_suggestions('1. ["a"] ["How?","Why?"]') == ["How?", "Why?"]
+
+
+def test_suggestions_fall_back_to_any_strings():
+    assert parse_suggestions('["Explain fluid balance", "Dosing"]') == ["Explain fluid balance", "Dosing"]